@@ -0,0 +1,264 @@
+"""
+İçerik adresli ek dosya deposu.
+
+Her dosya içeriğinin SHA-256 özetiyle bir kez saklanır; aynı dosya on kişiye
+gönderilse de diskte tek kopya vardır. Dizinler özetin ilk baytlarına göre
+bölünür:
+
+    {ATTACHMENTS_PATH}/ab/cd/abcd...ef   (64 karakter özet)
+
+Yazma atomiktir: içerik .tmp altında bir dosyaya yazılır, ardından os.replace
+ile yerine taşınır; yarım dosya hiçbir zaman görünmez.
+
+Referanslar `attachments` tablosunda sayılır (bkz. migrations.py 008):
+
+    - Depoya yazmadan önce satır ayrılır (pending_until = şimdi + PENDING_GRACE);
+      mesaj henüz yazılmamış bir nesne bu sürede silinmez.
+    - Mesaj yazıcısı (message_writer) mesajla aynı transaction'da refcount'u artırır.
+    - Mesajlar kalıcı olarak silindiğinde (hesap silme) aynı transaction'da azaltılır.
+    - collect() refcount'u 0 olan nesneleri siler; satır kilidi tutulurken dosya
+      silindiğinden aynı anda yeniden yüklenen içerik kaybolmaz.
+
+Yetim nesneleri toplamak için:
+
+    python3 attachments.py --gc      # refcount 0 olan satırlar
+    python3 attachments.py --scan    # satırı hiç olmayan dosyalar (yazarken çöken süreçler)
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import re
+import time
+import uuid
+
+from connectdb import get_connection, run_in_db
+
+USER_FILES_PATH = os.environ.get("GUVERCIN_FILES_PATH", "/home/gcloude/download_file")
+# Yükleme dizini (.uploads) ile aynı dosya sisteminde olmalı; parçalar taşınarak eklenir
+ATTACHMENTS_PATH = os.environ.get("GUVERCIN_ATTACHMENTS_PATH", os.path.join(USER_FILES_PATH, ".objects"))
+PENDING_GRACE = int(os.environ.get("GUVERCIN_ATTACHMENT_GRACE", "3600"))  # saniye
+HASH_CHUNK = 1024 * 1024
+GC_BATCH = 500
+
+_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+
+
+def path_for(digest: str, root: str = ATTACHMENTS_PATH) -> str:
+    if not _DIGEST.match(digest or ""):
+        raise ValueError("Geçersiz içerik özeti.")
+    return os.path.join(root, digest[:2], digest[2:4], digest)
+
+
+def _tmp_path(root: str) -> str:
+    directory = os.path.join(root, ".tmp")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, uuid.uuid4().hex)
+
+
+def _place(tmp: str, digest: str, root: str):
+    # Aynı içerik zaten varsa yenisi atılır; yoksa atomik olarak yerine taşınır
+    destination = path_for(digest, root)
+    if os.path.exists(destination):
+        os.remove(tmp)
+        return False
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    os.replace(tmp, destination)
+    return True
+
+
+def _hash_file(path: str) -> tuple:
+    sha = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK):
+            sha.update(chunk)
+            size += len(chunk)
+    return sha.hexdigest(), size
+
+
+def _reserve(conn, cursor, digest: str, size: int):
+    cursor.execute("""
+        INSERT INTO attachments (sha256, size, refcount, pending_until)
+        VALUES (%s, %s, 0, NOW() + INTERVAL %s SECOND)
+        ON DUPLICATE KEY UPDATE pending_until = GREATEST(COALESCE(pending_until, NOW()), VALUES(pending_until))
+    """, (digest, size, PENDING_GRACE))
+    conn.commit()
+
+
+class AttachmentStore:
+    def __init__(self, root: str = ATTACHMENTS_PATH):
+        self.root = root
+
+    def path_for(self, digest: str) -> str:
+        return path_for(digest, self.root)
+
+    def tmp_path(self) -> str:
+        """Yüklemelerin tamamlanınca taşınacağı geçici yol (depoyla aynı dosya sistemi)."""
+        return _tmp_path(self.root)
+
+    def _write_bytes(self, data: bytes, digest: str):
+        if os.path.exists(self.path_for(digest)):
+            return False
+        tmp = _tmp_path(self.root)
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return _place(tmp, digest, self.root)
+
+    async def put_bytes(self, data: bytes) -> str:
+        """İçeriği depoya ekler (yoksa), özetini döner."""
+        digest = await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+        # Satır dosyadan önce ayrılır: eşzamanlı bir collect() yeni yazılan dosyayı silemez
+        await run_in_db(_reserve, digest, len(data))
+        await asyncio.to_thread(self._write_bytes, data, digest)
+        return digest
+
+    async def put_file(self, path: str) -> str:
+        """Depoyla aynı dosya sistemindeki dosyayı depoya taşır, özetini döner."""
+        digest, size = await asyncio.to_thread(_hash_file, path)
+        await run_in_db(_reserve, digest, size)
+        await asyncio.to_thread(_place, path, digest, self.root)
+        return digest
+
+    # --- çöp toplama ---
+
+    def _collect_one(self, conn, cursor, digest: str) -> bool:
+        cursor.execute("""
+            SELECT refcount FROM attachments
+            WHERE sha256 = %s AND (pending_until IS NULL OR pending_until < NOW())
+            FOR UPDATE
+        """, (digest,))
+        row = cursor.fetchone()
+        if row is None or row["refcount"] > 0:
+            conn.rollback()
+            return False
+        # Dosya satır kilitliyken silinir; aynı içeriği ayıran _reserve kilidi bekler
+        try:
+            os.remove(self.path_for(digest))
+        except FileNotFoundError:
+            pass
+        cursor.execute("DELETE FROM attachments WHERE sha256 = %s", (digest,))
+        conn.commit()
+        return True
+
+    async def collect(self, digests) -> int:
+        """Verilen nesnelerden artık referansı olmayanları siler; silinen sayısını döner."""
+        removed = 0
+        for digest in dict.fromkeys(digests):
+            if await run_in_db(self._collect_one, digest):
+                removed += 1
+        return removed
+
+    async def collect_unreferenced(self, batch: int = GC_BATCH) -> int:
+        """refcount'u 0 olan ve ayırma süresi geçmiş tüm nesneleri siler."""
+        removed = 0
+        while True:
+            rows = await run_in_db(_select_unreferenced, batch)
+            if not rows:
+                return removed
+            collected = await self.collect(rows)
+            removed += collected
+            if len(rows) < batch or collected == 0:
+                return removed
+
+    def scan(self, grace: int = PENDING_GRACE) -> int:
+        """
+        Depoda olup tabloda satırı olmayan, grace saniyeden eski dosyaları siler.
+        Yarım kalmış .tmp dosyaları da temizlenir.
+        """
+        removed = 0
+        cutoff = time.time() - grace
+        conn, cursor = get_connection()
+        try:
+            for directory, _, files in os.walk(self.root):
+                for name in files:
+                    path = os.path.join(directory, name)
+                    try:
+                        if os.path.getmtime(path) > cutoff:
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    if os.path.basename(directory) != ".tmp":
+                        if not _DIGEST.match(name):
+                            continue
+                        cursor.execute("SELECT 1 FROM attachments WHERE sha256 = %s", (name,))
+                        if cursor.fetchone():
+                            continue
+                    try:
+                        os.remove(path)
+                        removed += 1
+                    except FileNotFoundError:
+                        pass
+        finally:
+            cursor.close()
+            conn.close()
+        return removed
+
+
+def _select_unreferenced(conn, cursor, limit: int) -> list:
+    cursor.execute("""
+        SELECT sha256 FROM attachments
+        WHERE refcount <= 0 AND (pending_until IS NULL OR pending_until < NOW())
+        LIMIT %s
+    """, (limit,))
+    return [row["sha256"] for row in cursor.fetchall()]
+
+
+def add_references(cursor, digests):
+    """Yeni mesajların eklerini sayar; mesajların INSERT'iyle aynı transaction'da çağrılır."""
+    counts = {}
+    for digest in digests:
+        if digest:
+            counts[digest] = counts.get(digest, 0) + 1
+    if not counts:
+        return
+    # Anahtar sırasıyla; eşzamanlı gruplar satır kilitlerini aynı sırada alır
+    items = sorted(counts.items())
+    placeholders = ", ".join(["(%s, 0, %s)"] * len(items))
+    cursor.execute(f"""
+        INSERT INTO attachments (sha256, size, refcount) VALUES {placeholders}
+        ON DUPLICATE KEY UPDATE refcount = refcount + VALUES(refcount)
+    """, [value for item in items for value in item])
+
+
+def release_references(cursor, message_ids) -> list:
+    """
+    Silinecek mesajların eklerinin sayısını azaltır; mesajlar silinmeden önce,
+    aynı transaction'da çağrılır. Referansı azalan özetleri döner (collect için).
+    """
+    if not message_ids:
+        return []
+    placeholders = ", ".join(["%s"] * len(message_ids))
+    cursor.execute(f"""
+        SELECT attachment, COUNT(*) AS count FROM messages
+        WHERE id IN ({placeholders}) AND attachment IS NOT NULL
+        GROUP BY attachment
+        ORDER BY attachment
+    """, list(message_ids))
+    rows = cursor.fetchall()
+    for row in rows:
+        cursor.execute(
+            "UPDATE attachments SET refcount = GREATEST(refcount - %s, 0) WHERE sha256 = %s",
+            (row["count"], row["attachment"])
+        )
+    return [row["attachment"] for row in rows]
+
+
+store = AttachmentStore()
+
+
+async def _main(args):
+    if args.gc:
+        print(f"Referanssız nesne silindi: {await store.collect_unreferenced()}")
+    if args.scan:
+        print(f"Satırı olmayan dosya silindi: {await asyncio.to_thread(store.scan, args.grace)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gc", action="store_true", help="refcount'u 0 olan nesneleri sil")
+    parser.add_argument("--scan", action="store_true", help="Tabloda satırı olmayan dosyaları sil")
+    parser.add_argument("--grace", type=int, default=PENDING_GRACE, help="--scan için en düşük dosya yaşı (sn)")
+    asyncio.run(_main(parser.parse_args()))
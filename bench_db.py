@@ -0,0 +1,104 @@
+"""
+MySQL erişim kıyaslaması: her mesajda yeni bağlantı açmak ile havuz kullanımı.
+
+Yerel bir MySQL/MariaDB'ye karşı çalışır (connectdb ortam değişkenleri kullanılır)
+ve geçici bir `bench_messages` tablosu oluşturup siler:
+
+    GUVERCIN_DB_PASSWORD=... python3 bench_db.py --messages 500 --concurrency 8
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime, timezone
+
+import mysql.connector
+
+import connectdb
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS bench_messages (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        sender VARCHAR(255), receiver VARCHAR(255), content TEXT,
+        timestamp DATETIME, delivered BOOLEAN DEFAULT FALSE
+    )
+"""
+INSERT = "INSERT INTO bench_messages (sender, receiver, content, timestamp) VALUES (%s, %s, %s, %s)"
+DELIVERED = "UPDATE bench_messages SET delivered = TRUE WHERE id = %s"
+
+
+def legacy_message(i):
+    # Eski davranış: mesaj başına iki ayrı bağlantı
+    conn = mysql.connector.connect(**connectdb.db_config)
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(INSERT, ("a", "b", f"mesaj {i}", datetime.now(timezone.utc)))
+    conn.commit()
+    message_id = cursor.lastrowid
+    cursor.close()
+    conn.close()
+
+    conn = mysql.connector.connect(**connectdb.db_config)
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(DELIVERED, (message_id,))
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+async def pooled_message(i):
+    message_id = await connectdb.execute_async(
+        INSERT, ("a", "b", f"mesaj {i}", datetime.now(timezone.utc)), commit=True)
+    await connectdb.execute_async(DELIVERED, (message_id,), commit=True)
+
+
+def report(name, latencies, elapsed):
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"{name:<10} mesaj/sn={len(latencies) / elapsed:8.1f} "
+          f"p50={statistics.median(latencies) * 1000:7.2f}ms p99={p99 * 1000:7.2f}ms")
+
+
+async def run_pooled(messages, concurrency):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await pooled_message(i)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(messages)))
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    connectdb.execute(CREATE_TABLE, commit=True)
+    try:
+        latencies = []
+        start = time.perf_counter()
+        for i in range(args.messages):
+            t = time.perf_counter()
+            legacy_message(i)
+            latencies.append(time.perf_counter() - t)
+        report("eski", latencies, time.perf_counter() - start)
+
+        latencies, elapsed = asyncio.run(run_pooled(args.messages, 1))
+        report("havuz", latencies, elapsed)
+
+        latencies, elapsed = asyncio.run(run_pooled(args.messages, args.concurrency))
+        report(f"havuz x{args.concurrency}", latencies, elapsed)
+        print(f"açılan bağlantı sayısı (havuz): {connectdb.pool.opened}")
+    finally:
+        connectdb.execute("DROP TABLE IF EXISTS bench_messages", commit=True)
+        connectdb.pool.close_all()
+
+
+if __name__ == "__main__":
+    main()
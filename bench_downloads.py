@@ -0,0 +1,62 @@
+"""
+Eşzamanlı büyük dosya indirme kıyaslaması.
+
+Çalışan bir chat servisine karşı aynı indirme adresini N istemciyle çeker ve
+toplam aktarım hızını raporlar. İsteğe bağlı olarak yarıdan devam ettirme
+(Range) isteklerini de ölçer:
+
+    python3 bench_downloads.py --url http://localhost:5004/download/<token> --clients 32 --rounds 4
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def fetch(client, url, headers):
+    start = time.perf_counter()
+    size = 0
+    async with client.stream("GET", url, headers=headers) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            size += len(chunk)
+    return size, time.perf_counter() - start
+
+
+async def run(url, clients, rounds, resume):
+    limits = httpx.Limits(max_connections=clients)
+    async with httpx.AsyncClient(limits=limits, timeout=None) as client:
+        probe = await client.get(url, headers={"Range": "bytes=0-0"})
+        total_size = int(probe.headers["content-range"].rsplit("/", 1)[1])
+        headers = {"Range": f"bytes={total_size // 2}-"} if resume else {}
+
+        results = []
+        start = time.perf_counter()
+        for _ in range(rounds):
+            results += await asyncio.gather(*(fetch(client, url, headers) for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+
+    transferred = sum(size for size, _ in results)
+    durations = sorted(duration for _, duration in results)
+    mode = "Range (yarıdan)" if resume else "tam dosya"
+    print(f"{mode}: {len(results)} indirme, {transferred / 1e6:.1f} MB, "
+          f"{transferred / elapsed / 1e6:.1f} MB/sn, "
+          f"p50={statistics.median(durations) * 1000:.0f}ms "
+          f"p99={durations[int(len(durations) * 0.99) - 1] * 1000:.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", required=True)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=4)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.url, args.clients, args.rounds, resume=False))
+    asyncio.run(run(args.url, args.clients, args.rounds, resume=True))
+
+
+if __name__ == "__main__":
+    main()
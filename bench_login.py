@@ -0,0 +1,90 @@
+"""
+Giriş kıyaslaması: farklı eşzamanlılık düzeylerinde giriş/sn ve p99 gecikme.
+
+Varsayılan olarak passwords.verify_password doğrudan ölçülür. --url verilirse
+çalışan login servisine HTTP ile gider (kullanıcı önceden kayıtlı olmalıdır):
+
+    python3 bench_login.py --levels 1 4 16 64
+    python3 bench_login.py --url http://localhost:5001/login --username test --password test
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import passwords
+
+
+def direct_login(stored, password):
+    async def attempt():
+        try:
+            return (await passwords.verify_password(stored, password))[0]
+        except passwords.Overloaded:
+            return False
+    return attempt
+
+
+def http_login(url, username, password):
+    body = json.dumps({"username": username, "password": password}).encode()
+
+    def blocking_attempt():
+        request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return response.status == 201
+        except urllib.error.HTTPError:
+            return False
+
+    async def attempt():
+        return await asyncio.to_thread(blocking_attempt)
+    return attempt
+
+
+async def run_level(attempt, concurrency, requests):
+    limit = asyncio.Semaphore(concurrency)
+
+    async def timed():
+        async with limit:
+            start = time.perf_counter()
+            ok = await attempt()
+            return ok, time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(timed() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(duration for _, duration in results)
+    failures = sum(1 for ok, _ in results if not ok)
+    p99 = latencies[max(int(len(latencies) * 0.99) - 1, 0)]
+    print(f"eşzamanlılık={concurrency:>4} giriş/sn={requests / elapsed:8.1f} "
+          f"p50={statistics.median(latencies) * 1000:7.1f}ms p99={p99 * 1000:7.1f}ms başarısız={failures}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--url")
+    parser.add_argument("--username", default="bench")
+    parser.add_argument("--password", default="bench-password")
+    args = parser.parse_args()
+
+    # HTTP modunda her eşzamanlı istek bir thread kullanır
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=max(args.levels)))
+    if args.url:
+        attempt = http_login(args.url, args.username, args.password)
+    else:
+        attempt = direct_login(await passwords.hash_password(args.password), args.password)
+
+    print(f"argon2id t={passwords.TIME_COST} m={passwords.MEMORY_COST}KiB p={passwords.PARALLELISM}, "
+          f"havuz={passwords.POOL_SIZE} süreç")
+    for level in args.levels:
+        await run_level(attempt, level, args.requests)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+"""
+Chat çerçeve biçimi kıyaslaması: mesaj başına CPU ve bayt.
+
+Sunucunun bir mesaj için yaptığı kodlama işini taklit eder: gönderenin
+çerçevesini çözer, alıcıya giden mesajı ve gönderene dönen yankıyı/onayı
+kodlar (bkz. protocol.py). Baytlar hem ham hem de permessage-deflate ile
+(bağlantı başına sıkıştırma bağlamı korunarak) ölçülür.
+
+    python3 bench_protocol.py
+    python3 bench_protocol.py --messages 50000 --file-size 65536
+"""
+import argparse
+import os
+import random
+import time
+import zlib
+
+import protocol
+
+WORDS = ["merhaba", "nasılsın", "bugün", "akşam", "görüşürüz", "tamam", "şimdi", "geliyorum",
+         "toplantı", "ğ", "çok", "iyi", "teşekkürler", "yarın", "ödev", "İstanbul", "ışık", "😀"]
+
+
+class Deflate:
+    """permessage-deflate: bağlam mesajlar arasında korunur, sondaki 00 00 ff ff atılır."""
+
+    def __init__(self):
+        self.compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+
+    def size(self, data) -> int:
+        if isinstance(data, str):
+            data = data.encode()
+        return len(self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+
+
+def text_frame(i: int) -> dict:
+    return {
+        "sender": f"kullanici{i % 100}",
+        "receiver": f"kullanici{(i + 1) % 100}",
+        "type": "text",
+        "message": " ".join(random.choice(WORDS) for _ in range(random.randint(2, 25))),
+        "client_id": f"c{i}",
+    }
+
+
+def enrich(frame: dict, i: int) -> dict:
+    # process_message'ın mesaja eklediği alanlar
+    message = {key: value for key, value in frame.items() if key != "data"}
+    message.update({
+        "message_id": 10_000_000 + i,
+        "timestamp": 1_760_000_000 + i,
+        "file_url": None,
+        "status": "sent",
+        "delivered": True,
+        "seen": False,
+    })
+    return message
+
+
+def run(codec, frames, attachments):
+    inbound, receiver, sender = Deflate(), Deflate(), Deflate()
+    raw_bytes = deflated_bytes = 0
+
+    # v1: dosya içeriği ayrı ikili çerçevede; v2: aynı çerçevede
+    encoded = []
+    for frame, attachment in zip(frames, attachments):
+        if attachment is not None and codec.inline_data:
+            frame = dict(frame, data=attachment)
+        encoded.append((codec.encode(frame), None if codec.inline_data else attachment))
+
+    start = time.process_time()
+    outgoing = []
+    for i, (data, attachment) in enumerate(encoded):
+        message = enrich(codec.decode(data), i)
+        to_receiver = codec.encode(message)
+        to_sender = codec.encode(protocol.sender_ack(message) if codec.compact_ack else message)
+        outgoing.append((data, attachment, to_receiver, to_sender))
+    cpu = time.process_time() - start
+
+    for data, attachment, to_receiver, to_sender in outgoing:
+        raw_bytes += len(data) + len(to_receiver) + len(to_sender) + (len(attachment) if attachment else 0)
+        deflated_bytes += inbound.size(data) + receiver.size(to_receiver) + sender.size(to_sender)
+        if attachment:
+            deflated_bytes += inbound.size(attachment)
+    count = len(frames)
+    return cpu / count * 1e6, raw_bytes / count, deflated_bytes / count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20_000)
+    parser.add_argument("--file-every", type=int, default=20, help="Her N mesajdan biri dosya")
+    parser.add_argument("--file-size", type=int, default=16 * 1024)
+    args = parser.parse_args()
+
+    random.seed(1)
+    frames, attachments = [], []
+    for i in range(args.messages):
+        frame = text_frame(i)
+        attachment = None
+        if args.file_every and i % args.file_every == args.file_every - 1:
+            frame.update({"type": "file", "file_name": f"foto_{i}.jpg", "mime_type": "image/jpeg"})
+            attachment = os.urandom(args.file_size)
+        frames.append(frame)
+        attachments.append(attachment)
+
+    text_only = [(f, a) for f, a in zip(frames, attachments) if a is None]
+    print(f"{'biçim':<22} {'karışım':<8} {'CPU µs/mesaj':>13} {'bayt/mesaj':>11} {'deflate bayt/mesaj':>19}")
+    for codec in (protocol.JSON, protocol.MSGPACK):
+        for label, (fs, atts) in (("metin", zip(*text_only)), ("karışık", (frames, attachments))):
+            cpu, raw, deflated = run(codec, list(fs), list(atts))
+            print(f"{codec.name:<22} {label:<8} {cpu:13.2f} {raw:11.1f} {deflated:19.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Önek araması kıyaslaması: tuş vuruşu başına p50/p99 gecikme.
+
+Her tuş vuruşu, gerçek bir kullanıcı adının ilk 1..8 karakteri için bir
+user_index.search_prefix çağrısıdır. Kullanıcı sayısı 1M'ye kadar artırılır.
+Varsayılan olarak fakeredis kullanır, --redis-url ile gerçek Redis verilebilir:
+
+    python3 bench_search.py
+    python3 bench_search.py --redis-url redis://localhost:6379/15
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import user_index
+
+SIZES = [10_000, 100_000, 1_000_000]
+FIRST = ["ali", "ayşe", "İsmail", "Işık", "ömer", "çağla", "şule", "gül", "İrem", "ırmak",
+         "mehmet", "zeynep", "Ugur", "elif", "burak", "Deniz", "can", "ece", "emre", "selin"]
+LAST = ["yılmaz", "kaya", "demir", "Şahin", "çelik", "öztürk", "aydın", "arslan", "doğan", "kılıç"]
+
+
+def get_client(redis_url):
+    if redis_url:
+        import redis.asyncio as aioredis
+        return aioredis.Redis.from_url(redis_url, decode_responses=True)
+    import fakeredis
+    return fakeredis.FakeAsyncRedis(decode_responses=True)
+
+
+def make_username(i: int) -> str:
+    return f"{random.choice(FIRST)}{random.choice(['', '_', '.'])}{random.choice(LAST)}{i}"
+
+
+async def populate(client, target: int, current: int, names: list):
+    batch = {}
+    for i in range(current, target):
+        username = make_username(i)
+        names.append(username)
+        batch[user_index.lex_member(username)] = 0
+        if len(batch) >= 10_000:
+            await client.zadd(user_index.LEX_KEY, batch)
+            batch = {}
+    if batch:
+        await client.zadd(user_index.LEX_KEY, batch)
+
+
+async def measure(client, names, typed: int, limit: int):
+    latencies = {}
+    for username in random.sample(names, typed):
+        for length in range(1, min(len(username), 8) + 1):
+            start = time.perf_counter()
+            await user_index.search_prefix(client, username[:length], limit)
+            latencies.setdefault(length, []).append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def p99(values):
+    values = sorted(values)
+    return values[max(int(len(values) * 0.99) - 1, 0)]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--redis-url", default=None)
+    parser.add_argument("--typed", type=int, default=300, help="Yazılan kullanıcı adı sayısı")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    client = get_client(args.redis_url)
+    await client.delete(user_index.LEX_KEY)
+
+    print(f"{'kullanıcı':>10} {'p50 (ms)':>9} {'p99 (ms)':>9}   p99 önek uzunluğuna göre (1..8)")
+    names = []
+    current = 0
+    for size in SIZES:
+        await populate(client, size, current, names)
+        current = size
+        latencies = await measure(client, names, args.typed, args.limit)
+        everything = [value for values in latencies.values() for value in values]
+        by_length = " ".join(f"{p99(latencies[length]):5.2f}" for length in sorted(latencies))
+        print(f"{size:>10} {statistics.median(everything):9.2f} {p99(everything):9.2f}   {by_length}")
+
+    await client.delete(user_index.LEX_KEY)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
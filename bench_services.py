@@ -0,0 +1,145 @@
+"""
+Servis yük testi: Redis'e dayanan hafif endpoint'lerde istek/sn ve çekirdek başına istek/sn.
+
+Her senaryo --duration saniye boyunca --concurrency eşzamanlı istemciyle koşar.
+--pids ile sunucu süreçleri verilirse harcanan CPU süresi /proc'tan okunur ve
+"CPU saniyesi başına istek" (çekirdek başına istek/sn) hesaplanır; verilmezse
+toplam istek/sn --cores'a bölünür.
+
+Önce/sonra karşılaştırması için eski ve yeni sürüm ayrı ayrı ölçülüp sonuçlar
+JSON'a yazılır:
+
+    # eski Flask servisleri (ayrı portlar)
+    python3 bench_services.py --setup --output before.json \\
+        --service-url register=http://localhost:5000 --service-url get_user_id=http://localhost:5000 \\
+        --service-url login=http://localhost:5001 --service-url check_user=http://localhost:5003 \\
+        --service-url public_key=http://localhost:5004 \\
+        --pids $(pgrep -d' ' -f 'python3 (search|register|login|chat).py')
+
+    # yeni sürüm (server.py worker'ları)
+    python3 bench_services.py --setup --output after.json --compare before.json \\
+        --pids $(pgrep -d' ' -f 'multiprocessing.spawn')
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import httpx
+
+SCENARIOS = ["check_user", "get_user_id", "check_session", "public_key"]
+
+
+def request_for(scenario, args, state):
+    if scenario == "check_user":
+        return "GET", "/check_user", {"params": {"username": args.username}}
+    if scenario == "get_user_id":
+        return "GET", f"/get_user_id/{args.username}", {}
+    if scenario == "check_session":
+        return "POST", "/check-session", {"json": {"token": state["token"]}}
+    if scenario == "public_key":
+        return "GET", f"/public_key/{args.username}", {}
+    raise ValueError(scenario)
+
+
+def cpu_seconds(pids) -> float:
+    # utime + stime (/proc/<pid>/stat'ın 14. ve 15. alanları)
+    total = 0
+    for pid in pids:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        total += int(fields[11]) + int(fields[12])
+    return total / os.sysconf("SC_CLK_TCK")
+
+
+async def setup(client, args, urls):
+    # Kullanıcı zaten varsa kayıt 400 döner, sorun değil
+    await client.post(urls["register"] + "/register", json={
+        "username": args.username, "password": args.password, "public_key": "bench-key"})
+    response = await client.post(urls["login"] + "/login", json={
+        "username": args.username, "password": args.password})
+    response.raise_for_status()
+    return {"token": response.json()["token"]}
+
+
+async def run_scenario(client, scenario, base_url, args, state):
+    method, path, kwargs = request_for(scenario, args, state)
+    url = base_url + path
+    deadline = time.perf_counter() + args.duration
+    counts = {"ok": 0, "error": 0}
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            try:
+                response = await client.request(method, url, **kwargs)
+                counts["ok" if response.status_code < 400 else "error"] += 1
+            except httpx.HTTPError:
+                counts["error"] += 1
+
+    cpu_start = cpu_seconds(args.pids) if args.pids else None
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    result = {"requests": counts["ok"], "errors": counts["error"], "rps": counts["ok"] / elapsed}
+    if cpu_start is not None:
+        cpu = cpu_seconds(args.pids) - cpu_start
+        result["cpu_seconds"] = cpu
+        result["rps_per_core"] = counts["ok"] / cpu if cpu else 0.0
+    else:
+        result["rps_per_core"] = result["rps"] / args.cores
+    return result
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--service-url", action="append", default=[],
+                        help="senaryo=adres; senaryo ya da register/login için ayrı adres")
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--cores", type=int, default=1)
+    parser.add_argument("--pids", type=int, nargs="*", default=[])
+    parser.add_argument("--username", default="bench")
+    parser.add_argument("--password", default="bench-password")
+    parser.add_argument("--setup", action="store_true", help="Kullanıcıyı kaydet ve giriş yap")
+    parser.add_argument("--token", help="--setup yerine hazır oturum token'ı")
+    parser.add_argument("--output")
+    parser.add_argument("--compare", help="Önceki ölçümün JSON dosyası")
+    args = parser.parse_args()
+
+    overrides = dict(item.split("=", 1) for item in args.service_url)
+    urls = {name: overrides.get(name, args.base_url).rstrip("/") for name in SCENARIOS + ["register", "login"]}
+    if "check_session" not in overrides:
+        urls["check_session"] = urls["login"]
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        state = await setup(client, args, urls) if args.setup else {"token": args.token}
+        results = {}
+        for scenario in args.scenarios:
+            if scenario == "check_session" and not state["token"]:
+                print("check_session atlandı: --setup ya da --token gerekli")
+                continue
+            results[scenario] = await run_scenario(client, scenario, urls[scenario], args, state)
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)["results"]
+
+    print(f"{'senaryo':<15} {'istek/sn':>10} {'çekirdek başına':>16} {'hata':>6} {'önceki':>10}")
+    for scenario, result in results.items():
+        before = previous.get(scenario)
+        ratio = f"{result['rps_per_core'] / before['rps_per_core']:9.2f}x" if before else f"{'-':>10}"
+        print(f"{scenario:<15} {result['rps']:10.1f} {result['rps_per_core']:16.1f} {result['errors']:6d} {ratio}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"concurrency": args.concurrency, "duration": args.duration, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
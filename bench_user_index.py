@@ -0,0 +1,89 @@
+"""
+Kullanıcı indeksi kıyaslaması.
+
+1k'dan 1M kullanıcıya kadar arama gecikmesinin sabit kaldığını gösterir.
+Varsayılan olarak fakeredis kullanır, --redis-url ile gerçek Redis verilebilir:
+
+    python3 bench_user_index.py
+    python3 bench_user_index.py --redis-url redis://localhost:6379/15
+"""
+import argparse
+import random
+import time
+import uuid
+
+import redis
+
+import user_index
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+
+def get_client(redis_url):
+    if redis_url:
+        return redis.Redis.from_url(redis_url, decode_responses=True)
+    import fakeredis
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def populate(client, target: int, current: int):
+    pipe = client.pipeline(transaction=False)
+    for i in range(current, target):
+        username = f"user{i}"
+        user_id = str(uuid.uuid4())
+        pipe.hset(user_index.USER_IDS_KEY, username, user_id)
+        pipe.hset(user_index.USERNAMES_KEY, user_id, username)
+        pipe.sadd(user_index.LEGACY_USERS_KEY, f"{username}:{user_id}")
+        if i % 10_000 == 0:
+            pipe.execute()
+    pipe.execute()
+
+
+def indexed_lookup(client, username: str):
+    # user_index.get_user_id'nin gönderdiği komutun aynısı (senkron istemciyle)
+    return client.hget(user_index.USER_IDS_KEY, username)
+
+
+def legacy_lookup(client, username: str):
+    for entry in client.smembers(user_index.LEGACY_USERS_KEY):
+        if entry.startswith(username + ":"):
+            return entry.split(":")[1]
+    return None
+
+
+def measure(func, client, size: int, lookups: int) -> float:
+    names = [f"user{random.randrange(size)}" for _ in range(lookups)]
+    start = time.perf_counter()
+    for name in names:
+        func(client, name)
+    return (time.perf_counter() - start) / lookups * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--redis-url", default=None)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--legacy-max", type=int, default=10_000,
+                        help="Eski SMEMBERS taramasının ölçüleceği en büyük boyut")
+    args = parser.parse_args()
+
+    client = get_client(args.redis_url)
+    client.delete(user_index.USER_IDS_KEY, user_index.USERNAMES_KEY, user_index.LEGACY_USERS_KEY)
+
+    print(f"{'kullanıcı':>10} {'indeks (µs)':>12} {'SMEMBERS (µs)':>14}")
+    current = 0
+    for size in SIZES:
+        populate(client, size, current)
+        current = size
+        indexed = measure(indexed_lookup, client, size, args.lookups)
+        if size <= args.legacy_max:
+            legacy = f"{measure(legacy_lookup, client, size, max(args.lookups // 100, 5)):14.1f}"
+        else:
+            legacy = f"{'-':>14}"
+        print(f"{size:>10} {indexed:12.1f} {legacy}")
+
+    client.delete(user_index.USER_IDS_KEY, user_index.USERNAMES_KEY, user_index.LEGACY_USERS_KEY)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,209 +1,484 @@
 import os
 import json
+import asyncio
+import logging
 import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, BackgroundTasks, Body
-from fastapi.responses import FileResponse
-import uvicorn
-
-import firebase_admin
-from firebase_admin import credentials, messaging
-import redis
-
-from connectdb import get_connection  # Senin DB bağlantını getiren fonksiyon
-
-# Redis ayarları
-redis_client = redis.Redis(host="localhost", port=6379, db=0)
-
-# Firebase admin başlatma
-cred = credentials.Certificate("/home/gcloude/guvercin/guvercin-b5d67-firebase-adminsdk-ieas1-28df47be95.json")
-firebase_admin.initialize_app(cred)
-
-app = FastAPI()
+from typing import Optional
 
-active_connections: dict[str, WebSocket] = {}
-USER_FILES_PATH = "/home/gcloude/download_file"
-download_tokens: dict[str, str] = {}
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, BackgroundTasks, Body, Query, Request
+from fastapi.responses import StreamingResponse
+import uvicorn
 
-@app.get("/public_key/{username}")
+import metrics
+import ratelimit
+import redisdb
+from connectdb import execute_async, run_in_db, stream_query  # Havuzlu DB bağlantıları
+from message_writer import writer
+from router import Router
+from presence import tracker as presence
+from connection import Connection
+from uploads import UploadStore, UploadError
+import downloads
+import attachments
+import conversations
+import inbox
+import protocol
+import recent_messages
+from notifications import NotificationDispatcher, create_transport
+
+logger = logging.getLogger(__name__)
+
+# Paylaşılan async Redis havuzu
+redis_client = redisdb.client
+
+# FCM bildirimleri arka planda, toplu gönderilir (Firebase admin transport içinde başlatılır)
+notifier = NotificationDispatcher(redis_client, create_transport())
+
+# Sohbet ve seen soketleri ayrı tutulur; mesajlar worker'lar arasında Redis ile yönlendirilir
+chat_router = Router("chat", presence=presence)
+seen_router = Router("seen", presence=presence)
+
+
+async def on_chat_delivered(username: str, payload: dict, remote: bool):
+    # Yalnızca alıcıya giden yeni mesajlar; onay çerçeveleri değil
+    if payload.get("status") != "sent" or payload.get("receiver") != username:
+        return
+    writer.mark_delivered(payload["message_id"])
+    await recent_messages.mark_delivered(redis_client, payload["sender"], username, payload["message_id"])
+    if remote:
+        # Gönderen başka bir worker'da olabilir, iletildi bilgisi aynı yoldan geri döner
+        await chat_router.send(payload["sender"], {
+            "type": "delivered",
+            "message_id": payload["message_id"],
+            "receiver": username
+        })
+
+
+async def notify_senders(receiver: str, senders: list):
+    # Yeniden bağlanınca toplu iletilen mesajlar: gönderici başına tek bildirim
+    for row in senders:
+        await recent_messages.delivered_up_to(redis_client, row["sender"], receiver, row["up_to"])
+        await chat_router.send(row["sender"], {
+            "type": "delivered",
+            "receiver": receiver,
+            "up_to": row["up_to"],
+            "count": row["count"]
+        })
+
+
+async def on_chat_failed(username: str, payload: dict):
+    if payload.get("status") == "sent" and payload.get("receiver") == username:
+        notifier.notify(username)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    chat_router.on_delivered = on_chat_delivered
+    chat_router.on_failed = on_chat_failed
+    await writer.start()
+    await notifier.start()
+    await presence.start()
+    await chat_router.start()
+    await seen_router.start()
+    # Terk edilmiş yarım yüklemeler açılışta ve saatlik silinir
+    await upload_store.start()
+    yield
+    await upload_store.stop()
+    await seen_router.stop()
+    await chat_router.stop()
+    await presence.stop()
+    await notifier.stop()
+    await writer.stop()
+
+app = FastAPI(lifespan=lifespan)
+metrics.install(app)
+ratelimit.install(app)
+
+USER_FILES_PATH = os.environ.get("GUVERCIN_FILES_PATH", "/home/gcloude/download_file")
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+upload_store = UploadStore(os.path.join(USER_FILES_PATH, ".uploads"))
+
+@app.get("/public_key/{username}", dependencies=[ratelimit.limit("lookup_ip")])
 async def get_public_key(username: str):
     key = f"user:{username}"
-    if not redis_client.exists(key):
+    # Varlık kontrolü ve okuma tek gidiş-dönüşte
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.exists(key)
+    pipe.hget(key, "public_key")
+    exists, public_key = await pipe.execute()
+    if not exists:
         raise HTTPException(status_code=404, detail="User not found")
-    public_key = redis_client.hget(key, "public_key")
     if public_key:
-        return {"username": username, "public_key": public_key.decode()}
+        return {"username": username, "public_key": public_key}
     else:
         raise HTTPException(status_code=404, detail="Public key not found")
 
 
 
 
-def send_fcm_notification(receiver: str):
+async def register_download(file_path: str, receiver: str, file_name: str) -> str:
+    # Token Redis'te TTL ile saklanır, her worker /download/{token} ile çözebilir
+    token = str(uuid.uuid4())
+    await downloads.store_token(redis_client, token, file_path, receiver, file_name)
+    return token
+
+
+async def save_file(file: bytes, username: str, filename: str) -> tuple:
+    """Dosyayı içerik adresli depoya yazar; (özet, indirme token'ı) döner."""
+    digest = await attachments.store.put_bytes(file)
+    return digest, await register_download(attachments.store.path_for(digest), username, filename)
+
+
+async def handle_upload(websocket: WebSocket, connection: Connection, frame: dict):
+    """
+    Parçalı yükleme çerçevelerini işler (bkz. uploads.py).
+    Yükleme tamamlandığında kaydedilecek dosya mesajını, aksi halde None döner.
+    """
+    frame_type = frame["type"]
+    upload_id = frame.get("upload_id")
     try:
-        fcm_token = redis_client.hget(f"user:{receiver}", "fcm_token")
-        if fcm_token:
-            message = messaging.Message(
-                notification=messaging.Notification(
-                    title="Yeni bir mesajınız var!",
-                ),
-                token=fcm_token.decode()
-            )
-            response = messaging.send(message)
-            print(f"FCM bildirimi gönderildi: {response}")
+        if frame_type == "upload_start":
+            meta = {
+                "sender": frame["sender"],
+                "receiver": frame["receiver"],
+                "file_name": os.path.basename(frame["file_name"]),
+                "mime_type": frame.get("mime_type"),
+                "message": frame.get("message"),
+                "size": frame.get("size"),
+            }
+            upload_id, meta, offset = await upload_store.start(meta, connection.username, upload_id)
+        elif frame_type == "upload_chunk":
+            chunk = await protocol.read_attachment(websocket, connection.codec, frame)
+            offset = await upload_store.write_chunk(upload_id, connection.username, int(frame["offset"]), chunk)
         else:
-            print(f"{receiver} için FCM token bulunamadı.")
-    except Exception as e:
-        print(f"FCM bildirimi gönderilemedi: {e}")
-
-async def save_file(file: bytes, username: str, filename: str) -> str:
-    user_folder = os.path.join(USER_FILES_PATH, username)
-    os.makedirs(user_folder, exist_ok=True)
-    file_path = os.path.join(user_folder, filename)
-    with open(file_path, "wb") as f:
-        f.write(file)
+            # Parça deponun geçici dizinine taşınır, oradan özetine göre yerleşir
+            meta = await upload_store.finish(upload_id, connection.username,
+                                             lambda meta: attachments.store.tmp_path())
+            digest = await attachments.store.put_file(meta["path"])
+            download_token = await register_download(attachments.store.path_for(digest), meta["receiver"],
+                                                     meta["file_name"])
+            return {
+                "sender": meta["sender"],
+                "receiver": meta["receiver"],
+                "type": "file",
+                "message": meta.get("message"),
+                "file_name": meta["file_name"],
+                "mime_type": meta.get("mime_type"),
+                "upload_id": upload_id,
+                "download_token": download_token,
+            }, digest
+    except (KeyError, ValueError, TypeError):
+        error = UploadError("Eksik veya geçersiz alan.")
+    except UploadError as e:
+        error = e
+    except OSError:
+        # Parça depoya taşınamadı
+        logger.exception("Yükleme tamamlanamadı: %s", upload_id)
+        error = UploadError("Dosya yazılamadı.")
+    else:
+        await connection.send({"type": "upload_ack", "upload_id": upload_id, "offset": offset})
+        return None
+
+    await connection.send({
+        "type": "upload_error",
+        "upload_id": upload_id,
+        "offset": error.offset,
+        "detail": error.detail
+    })
+    return None
+
+
+UPLOAD_FRAMES = ("upload_start", "upload_chunk", "upload_finish")
+
+def validate_message(message_data: dict):
+    """Mesaj yazılmadan önce alanları doğrular; geçersizse ValueError fırlatır."""
+    for field in ("sender", "receiver"):
+        if not isinstance(message_data.get(field), str) or not message_data[field]:
+            raise ValueError(f"{field} eksik.")
+    for field in ("type", "message", "file_name", "mime_type"):
+        if not isinstance(message_data.get(field, ""), (str, type(None))):
+            raise ValueError(f"{field} geçersiz.")
+
+
+async def process_message(websocket: WebSocket, connection: Connection, message_data: dict,
+                          attachment: Optional[str] = None):
+    # Yalnızca yazmadan önceki adımlar çerçeve hatası sayılır; mesaj kaydedildikten
+    # sonra istemciye hata dönmek yeniden denemeyle kopya mesaj üretirdi
+    try:
+        validate_message(message_data)
+        file_bytes = None
+        if message_data.get("type") == "file" and message_data.get("file_name") and attachment is None:
+            # Eski istemciler: dosyanın tamamı tek bir binary çerçevede gelir
+            file_bytes = await protocol.read_attachment(websocket, connection.codec, message_data)
+    except protocol.FRAME_ERRORS:
+        # Eksik alan ya da v2 dosya çerçevesinde içerik yok; soket açık kalır
+        await connection.send(protocol.frame_error(message_data, "Eksik veya geçersiz alan."))
+        return
+
+    sender = message_data["sender"]
+    receiver = message_data["receiver"]
+    msg_type = message_data.get("type", "text")
+    content = message_data.get("message")
+    file_name = message_data.get("file_name")
+    mime_type = message_data.get("mime_type")
+    timestamp = datetime.now(timezone.utc)
+
+    if file_bytes is not None:
+        attachment, message_data["download_token"] = await save_file(file_bytes, receiver, file_name)
+    file_url = attachments.store.path_for(attachment) if attachment else None
+
+    # İçerik yalnızca dosya çerçevelerinde okunur; yönlendirilen mesajda taşınmaz
+    message_data.pop("data", None)
+
+    # Mesaj toplu yazma hattına verilir, ID grup commit edildiğinde döner
+    message_id = await writer.insert_message(
+        (sender, receiver, msg_type, content, file_url, file_name, mime_type, timestamp, attachment)
+    )
 
-    token = str(uuid.uuid4())
-    download_tokens[token] = file_path
-    return token
+    if file_url and file_name:
+        # Aynı adlı eski dosyaya işaret eden /download_file önbelleği yeni mesaja taşınır
+        await downloads.cache_lookup(redis_client, receiver, file_name, {"path": file_url, "id": message_id})
+
+    # Sıcak katman teslimattan önce güncellenir: canlı çerçeveyi alıp sohbeti hemen
+    # açan alıcının ilk sayfası bu mesajı içermelidir. İletildi bilgisi teslimatta yazılır.
+    await recent_messages.append(redis_client, {
+        "id": message_id,
+        "sender": sender,
+        "receiver": receiver,
+        "type": msg_type,
+        "content": content,
+        "file_url": file_url,
+        "file_name": file_name,
+        "mime_type": mime_type,
+        "timestamp": timestamp,
+        "delivered": False,
+        "seen": False
+    })
+
+    message_data.update({
+        "message_id": message_id,
+        "timestamp": int(timestamp.timestamp()),
+        "file_url": file_url,
+        "status": "sent",
+        "delivered": True,
+        "seen": False
+    })
+
+    # Alıcı hangi worker'a bağlıysa oraya iletilir; bağlı değilse
+    # ya da iletilemezse on_chat_failed FCM bildirimini kuyruğa ekler
+    message_data["delivered"] = await chat_router.send(receiver, message_data)
+
+    # Gönderene yankı da kendi gönderim kuyruğu üzerinden yazılır; v2 istemcilere
+    # mesajın tamamı yerine kısa onay gider
+    await connection.send(protocol.sender_ack(message_data) if connection.codec.compact_ack else message_data)
 
 @app.websocket("/ws/{username}")
 async def websocket_endpoint(websocket: WebSocket, username: str):
-    await websocket.accept()
-    active_connections[username] = websocket
-    print(f"{username} bağlandı.")
+    codec = protocol.negotiate(websocket)
+    await websocket.accept(subprotocol=codec.subprotocol(websocket))
+    # Bağlantı fırtınası kayıttan ve inbox sorgusundan önce kesilir (1013)
+    if not await ratelimit.admit(websocket, "ws_connect_ip", ratelimit.client_ip(websocket)):
+        return
+    connection = await chat_router.register(username, websocket, codec)
+    frames = ratelimit.FrameLimiter(websocket, connection, "chat_frame_user", username)
+    metrics.event(logger, "ws_connect", namespace="chat", user=username)
+    # Çevrimdışıyken gelen mesajlar partiler halinde gönderilir (bkz. inbox.py); yalnızca
+    # inbox çerçevelerini anlayan istemcilere
+    replay = None
+    if inbox.wants_replay(websocket, codec):
+        replay = inbox.InboxReplay(connection, username,
+                                   on_acknowledged=lambda senders: notify_senders(username, senders))
+        replay.start()
 
     try:
         while True:
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
-
-            sender = message_data["sender"]
-            receiver = message_data["receiver"]
-            msg_type = message_data.get("type", "text")
-            content = message_data.get("message")
-            file_name = message_data.get("file_name")
-            mime_type = message_data.get("mime_type")
-            timestamp = datetime.now(timezone.utc)
-            file_url = None
-
-            if msg_type == "file" and file_name:
-                file_bytes = await websocket.receive_bytes()
-                download_token = await save_file(file_bytes, receiver, file_name)
-                file_url = f"{USER_FILES_PATH}/{receiver}/{file_name}"
-
-            conn, cursor = get_connection()
-            cursor.execute("""
-                INSERT INTO messages (sender, receiver, type, content, file_url, file_name, mime_type, timestamp, delivered, seen)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, FALSE, FALSE)
-            """, (sender, receiver, msg_type, content, file_url, file_name, mime_type, timestamp))
-            conn.commit()
-            message_id = cursor.lastrowid
-            cursor.close()
-            conn.close()
-
-            message_data.update({
-                "message_id": message_id,
-                "timestamp": int(timestamp.timestamp()),
-                "file_url": file_url,
-                "status": "sent",
-                "delivered": receiver in active_connections,
-                "seen": False
-            })
-
-            json_message = json.dumps(message_data)
-            receiver_ws = active_connections.get(receiver)
-
-            if receiver_ws:
-                try:
-                    await receiver_ws.send_text(json_message)
-                    conn, cursor = get_connection()
-                    cursor.execute("UPDATE messages SET delivered = TRUE WHERE id = %s", (message_id,))
-                    conn.commit()
-                    cursor.close()
-                    conn.close()
-                except Exception as e:
-                    print(f"WebSocket mesajı gönderilemedi: {e}")
-                    send_fcm_notification(receiver)
-            else:
-                send_fcm_notification(receiver)
-
-            await websocket.send_text(json_message)
+            try:
+                message_data = await codec.receive(websocket)
+            except protocol.FRAME_ERRORS:
+                await connection.send(protocol.frame_error())
+                continue
+            attachment = None
+
+            if message_data.get("type") == "ping":
+                # Uygulama düzeyinde kalp atışı (kontrol çerçevelerini geçirmeyen vekiller için)
+                await connection.send({"type": "pong"})
+                continue
+            if message_data.get("type") == "inbox_ack":
+                up_to = message_data.get("up_to")
+                # Geçersiz onay soketi düşürmez, yok sayılır
+                if replay and isinstance(up_to, int) and not isinstance(up_to, bool) and up_to > 0:
+                    replay.ack(up_to)
+                continue
+            # Yerel kira varken Redis'e gidilmez; aşımda çerçeve yazılmadan atılır
+            if not await frames.admit(message_data):
+                if not codec.inline_data and (message_data.get("type") == "upload_chunk" or
+                                              (message_data.get("type") == "file" and message_data.get("file_name"))):
+                    # v1'de içerik ayrı ikili çerçevede gelir; o da atılır
+                    await websocket.receive_bytes()
+                continue
+
+            if message_data.get("type") in UPLOAD_FRAMES:
+                uploaded = await handle_upload(websocket, connection, message_data)
+                if uploaded is None:
+                    continue
+                message_data, attachment = uploaded
+
+            await process_message(websocket, connection, message_data, attachment)
 
     except WebSocketDisconnect:
-        print(f"🔌 {username} bağlantısı kesildi.")
-        active_connections.pop(username, None)
+        metrics.event(logger, "ws_disconnect", namespace="chat", user=username)
+    finally:
+        if replay:
+            await replay.stop()
+        await chat_router.unregister(username, connection)
+
+_background = set()
+
+
+def _track(coro):
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def route_seen(reader: str, seen_msg: dict, message_id: int, seen_status: bool, sender_future):
+    """
+    Okundu bilgisini mesajın asıl göndericisine iletir. Gönderici istemcinin
+    bildirdiği alandan değil, veritabanından alınır; mesaj okuyana gönderilmemişse
+    hiçbir şey yapılmaz.
+    """
+    try:
+        original_sender = await sender_future
+    except Exception:
+        logger.exception("Okundu bilgisi yazılamadı: %s", message_id)
+        return
+    if not original_sender:
+        return
+    await recent_messages.mark_seen(redis_client, original_sender, reader, message_id, seen_status)
+    await seen_router.send(original_sender, dict(seen_msg, sender=original_sender, message_id=message_id,
+                                                 seen=seen_status))
 
 @app.websocket("/ws/{username}/seen")
 async def websocket_seen(websocket: WebSocket, username: str):
-    await websocket.accept()
-    active_connections[username] = websocket
-    print(f"👁 {username} seen güncelleyiciye bağlandı.")
+    codec = protocol.negotiate(websocket)
+    await websocket.accept(subprotocol=codec.subprotocol(websocket))
+    if not await ratelimit.admit(websocket, "ws_connect_ip", ratelimit.client_ip(websocket)):
+        return
+    connection = await seen_router.register(username, websocket, codec)
+    frames = ratelimit.FrameLimiter(websocket, connection, "seen_frame_user", username)
+    metrics.event(logger, "ws_connect", namespace="seen", user=username)
 
     try:
         while True:
-            seen_data = await websocket.receive_text()
-            seen_msg = json.loads(seen_data)
-
-            message_id = seen_msg["message_id"]
-            seen_status = seen_msg["seen"]
-
-            conn, cursor = get_connection()
-            cursor.execute("UPDATE messages SET seen = %s WHERE id = %s", (seen_status, message_id))
-            conn.commit()
-            cursor.close()
-            conn.close()
-
-            for ws_user, ws in active_connections.items():
-                try:
-                    await ws.send_text(seen_data)
-                except Exception as e:
-                    print(f"{ws_user} için seen verisi gönderilemedi: {e}")
+            try:
+                seen_msg = await codec.receive(websocket)
+            except protocol.FRAME_ERRORS:
+                await connection.send(protocol.frame_error())
+                continue
+
+            if seen_msg.get("type") == "ping":
+                await connection.send({"type": "pong"})
+                continue
+            if not await frames.admit(seen_msg):
+                continue
+
+            try:
+                if "up_to" in seen_msg:
+                    peer = seen_msg["peer"]
+                    up_to = int(seen_msg["up_to"])
+                    if not isinstance(peer, str):
+                        raise ValueError("peer geçersiz.")
+                else:
+                    message_id = int(seen_msg["message_id"])
+                    seen_status = bool(seen_msg["seen"])
+            except protocol.FRAME_ERRORS:
+                await connection.send(protocol.frame_error(seen_msg, "Eksik veya geçersiz alan."))
+                continue
+
+            if "up_to" in seen_msg:
+                # Aralık: peer'in bu kullanıcıya gönderdiği up_to'ya kadarki tüm mesajlar okundu
+                writer.mark_seen_up_to(peer, username, up_to)
+                await recent_messages.seen_up_to(redis_client, peer, username, up_to)
+                await seen_router.send(peer, {"type": "seen", "reader": username, "up_to": up_to})
+                continue
+
+            # Gönderici toplu yazımda bulunur; soket döngüsü grup commit'ini beklemez
+            _track(route_seen(username, seen_msg, message_id, seen_status,
+                              writer.mark_seen(message_id, seen_status, username)))
 
     except WebSocketDisconnect:
-        print(f"👁🔌 {username} seen bağlantısı kesildi.")
-        active_connections.pop(username, None)
+        metrics.event(logger, "ws_disconnect", namespace="seen", user=username)
+    finally:
+        await seen_router.unregister(username, connection)
+
+@app.get("/connections")
+async def get_connections():
+    """
+    Bu worker'daki bağlantıların gönderim kuyruğu derinlikleri ve sayaçları.
+    """
+    return {"chat": chat_router.stats(), "seen": seen_router.stats()}
+
+@app.get("/download/{token}")
+async def download(token: str, request: Request):
+    """
+    save_file tarafından üretilen token ile indirme. Range ve If-None-Match desteklenir.
+    """
+    info = await downloads.resolve_token(redis_client, token)
+    if not info:
+        raise HTTPException(status_code=404, detail="İndirme bağlantısı geçersiz veya süresi dolmuş.")
+
+    response = downloads.file_response(request, info["path"], info["file_name"])
+    if response is None:
+        raise HTTPException(status_code=410, detail="Dosya fiziksel olarak mevcut değil.")
+    return response
 
 @app.get("/download_file/{username}/{file_name}")
-def download_file(username: str, file_name: str, background_tasks: BackgroundTasks):
-    conn, cursor = get_connection()
-    cursor.execute("""
-        SELECT id, file_url FROM messages
-        WHERE receiver = %s AND file_name = %s
-        ORDER BY id DESC LIMIT 1
-    """, (username, file_name))
-    result = cursor.fetchone()
-    cursor.close()
-    conn.close()
-
+async def download_file(username: str, file_name: str, request: Request, background_tasks: BackgroundTasks):
+    # Önce Redis'teki arama önbelleğine bak, yoksa MySQL'e git
+    result = await downloads.cached_lookup(redis_client, username, file_name)
     if not result:
-        raise HTTPException(status_code=404, detail="Dosya bilgisi bulunamadı.")
+        row = await execute_async("""
+            SELECT id, file_url, attachment FROM messages
+            WHERE receiver = %s AND file_name = %s
+            ORDER BY id DESC LIMIT 1
+        """, (username, file_name), fetch="one")
+
+        if not row:
+            raise HTTPException(status_code=404, detail="Dosya bilgisi bulunamadı.")
+
+        # Depodaki nesne; eski mesajlarda kaydedilen yol
+        path = attachments.store.path_for(row["attachment"]) if row["attachment"] else row["file_url"]
+        result = {"path": path, "id": row["id"]}
+        await downloads.cache_lookup(redis_client, username, file_name, result)
 
-    file_path = result["file_url"]
+    file_path = result["path"]
     message_id = result["id"]
 
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=410, detail="Dosya fiziksel olarak mevcut değil.")
+    def delete_row(conn, cursor):
+        released = attachments.release_references(cursor, [message_id])
+        cursor.execute("DELETE FROM messages WHERE id = %s", (message_id,))
+        conn.commit()
+        return released
 
-    def delete_message():
+    async def delete_message():
         try:
-            conn2, cursor2 = get_connection()
-            cursor2.execute("DELETE FROM messages WHERE id = %s", (message_id,))
-            conn2.commit()
-            cursor2.close()
-            conn2.close()
-        except Exception as e:
-            print("Veritabanı silme hatası:", e)
+            # Referansı kalmayan ek depodan da silinir
+            await attachments.store.collect(await run_in_db(delete_row))
+        except Exception:
+            logger.exception("Veritabanı silme hatası")
 
     # İstersen dosya indirildikten sonra mesaj silinebilir
     # background_tasks.add_task(delete_message)
 
-    return FileResponse(
-        path=file_path,
-        filename=os.path.basename(file_path),
-        media_type="application/octet-stream"
-    )
+    # Depodaki dosyanın adı içerik özetidir; istemciye mesajdaki ad gider
+    response = downloads.file_response(request, file_path, file_name)
+    if response is None:
+        raise HTTPException(status_code=410, detail="Dosya fiziksel olarak mevcut değil.")
+    return response
 
 @app.post("/delete_message/{message_id}")
 async def delete_message(message_id: int, payload: dict = Body(...)):
@@ -211,54 +486,150 @@ async def delete_message(message_id: int, payload: dict = Body(...)):
     if not username:
         raise HTTPException(status_code=400, detail="Kullanıcı adı gerekli.")
 
-    conn, cursor = get_connection()
-    cursor.execute(
-        "SELECT 1 FROM deleted_messages WHERE message_id = %s AND user = %s",
-        (message_id, username)
-    )
-    existing = cursor.fetchone()
-    if existing:
-        cursor.close()
-        conn.close()
+    def mark_deleted(conn, cursor):
+        cursor.execute(
+            "SELECT 1 FROM deleted_messages WHERE message_id = %s AND user = %s",
+            (message_id, username)
+        )
+        if cursor.fetchone():
+            return None
+        cursor.execute("SELECT sender, receiver FROM messages WHERE id = %s", (message_id,))
+        message = cursor.fetchone()
+
+        cursor.execute(
+            "INSERT INTO deleted_messages (message_id, user) VALUES (%s, %s)",
+            (message_id, username)
+        )
+        # Sohbet listesindeki son mesaj ve okunmamış sayısı aynı transaction'da güncellenir
+        conversations.message_deleted(cursor, username, message_id)
+        released = []
+        if message:
+            # İki taraf da sildiyse mesaj kimseye görünmez: satır ve ekin referansı kaldırılır
+            participants = {message["sender"], message["receiver"]}
+            cursor.execute(
+                f"SELECT COUNT(DISTINCT user) AS count FROM deleted_messages "
+                f"WHERE message_id = %s AND user IN ({', '.join(['%s'] * len(participants))})",
+                (message_id, *sorted(participants))
+            )
+            if cursor.fetchone()["count"] == len(participants):
+                released = attachments.release_references(cursor, [message_id])
+                cursor.execute("DELETE FROM deleted_messages WHERE message_id = %s", (message_id,))
+                cursor.execute("DELETE FROM messages WHERE id = %s", (message_id,))
+        conn.commit()
+        return message or {}, released
+
+    result = await run_in_db(mark_deleted)
+    if result is None:
         return {"status": "already_deleted"}
-
-    cursor.execute(
-        "INSERT INTO deleted_messages (message_id, user) VALUES (%s, %s)",
-        (message_id, username)
-    )
-    conn.commit()
-    cursor.close()
-    conn.close()
+    message, released = result
+    if message:
+        peer = message["receiver"] if message["sender"] == username else message["sender"]
+        await recent_messages.mark_deleted(redis_client, username, peer, message_id)
+    if released:
+        # Referansı kalmayan ek depodan da silinir
+        try:
+            await attachments.store.collect(released)
+        except Exception:
+            logger.exception("Ek dosya silinemedi")
 
     return {"status": "deleted"}
 
-@app.get("/get_messages/{user1}/{user2}")
-async def get_messages(user1: str, user2: str):
-    conn, cursor = get_connection()
-
-    cursor.execute("""
-        SELECT * FROM messages
-        WHERE ((sender = %s AND receiver = %s)
-               OR (sender = %s AND receiver = %s))
-          AND id NOT IN (
-              SELECT message_id FROM deleted_messages WHERE user = %s
-          )
-        ORDER BY timestamp
-    """, (user1, user2, user2, user1, user1))
-
-    rows = cursor.fetchall()
-    cursor.close()
-    conn.close()
-
+def _serialize_message(row: dict) -> str:
     # Zaman damgalarını uygun hale getir
-    for row in rows:
-        if "timestamp" in row and row["timestamp"]:
-            row["timestamp"] = int(row["timestamp"].timestamp())
-        if "seen_at" in row and row.get("seen_at"):
-            row["seen_at"] = row["seen_at"].isoformat()
-
-    return rows
+    if row.get("timestamp"):
+        row["timestamp"] = int(row["timestamp"].timestamp())
+    if row.get("seen_at"):
+        row["seen_at"] = row["seen_at"].isoformat()
+    return json.dumps(row, default=str)
+
+
+def _stream_json_array(rows, chunk_rows=200):
+    # Satırlar parça parça gönderilir; her parça bir thread geçişine mal olduğundan
+    # tek tek değil, gruplar halinde yield edilir.
+    chunk = ["["]
+    for i, row in enumerate(rows):
+        chunk.append(("," if i else "") + _serialize_message(row))
+        if len(chunk) >= chunk_rows:
+            yield "".join(chunk)
+            chunk = []
+    chunk.append("]")
+    yield "".join(chunk)
+
+
+# (user1, user2) konuşması; user1'in sildiği mesajlar anti-join ile elenir. Her yön
+# (sender, receiver, id) indeksinde ayrı bir aralıktır (bkz. conversations.pair_query).
+# Sıcak katmanla aynı sütunlar: ilk sayfanın biçimi önbellek isabetine bağlı olmasın
+MESSAGES_SELECT = f"""
+    SELECT {', '.join('m.' + field for field in recent_messages.FIELDS)} FROM messages m
+    LEFT JOIN deleted_messages d ON d.message_id = m.id AND d.user = %s
+"""
+
+
+@app.get("/get_messages/{user1}/{user2}", dependencies=[ratelimit.limit("history_user", by="user1")])
+async def get_messages(
+    user1: str,
+    user2: str,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+):
+    """
+    İki kullanıcı arasındaki mesajları eskiden yeniye sıralı JSON dizisi olarak akıtır.
+
+    - Parametresiz: tüm geçmiş (eski davranış).
+    - Yalnızca limit: son `limit` mesaj; mümkünse Redis'teki sıcak katmandan
+      okunur (bkz. recent_messages.py).
+    - before_id: bu ID'den eski mesajların son `limit` tanesi (yukarı kaydırma).
+    - after_id: bu ID'den yeni mesajlar. `limit` verilmezse son senkronizasyondan
+      bu yana gelen her şey akıtılır (yeniden bağlanan istemciler için).
+
+    Sayfalı isteklerde X-Has-More ve bir sonraki imleç (X-Next-Before-Id /
+    X-Next-After-Id) başlıklarda döner.
+    """
+    where, where_params = " AND d.message_id IS NULL", []
+    if before_id is not None:
+        where += " AND m.id < %s"
+        where_params.append(before_id)
+    if after_id is not None:
+        where += " AND m.id > %s"
+        where_params.append(after_id)
+
+    if limit is None and before_id is None:
+        # Tam geçmiş veya senkronizasyon: satırlar belleğe alınmadan akıtılır
+        query, params = conversations.pair_query(MESSAGES_SELECT, (user1,), user1, user2, where, where_params,
+                                                 order="ASC")
+        rows = stream_query(query, params)
+        return StreamingResponse(_stream_json_array(rows), media_type="application/json")
+
+    limit = limit or DEFAULT_PAGE_SIZE
+    # before_id sayfası en yeniden geriye doğru okunur, sonra ters çevrilir
+    descending = after_id is None
+    first_page = before_id is None and after_id is None
+
+    cached = await recent_messages.first_page(redis_client, user1, user2, limit) if first_page else None
+    if cached is not None:
+        rows, has_more = cached
+    else:
+        # Her yön en fazla limit + 1 satır okur; sayfa maliyeti konuşmanın boyuna bağlı değil
+        query, params = conversations.pair_query(MESSAGES_SELECT, (user1,), user1, user2, where, where_params,
+                                                 order="DESC" if descending else "ASC", limit=limit + 1)
+        rows = await execute_async(query, params, fetch="all")
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if descending:
+            rows.reverse()
+        if first_page:
+            # Bir sonraki açılış sıcak katmandan okunsun
+            recent_messages.schedule_backfill(redis_client, user1, user2)
+
+    headers = {"X-Has-More": "true" if has_more else "false"}
+    if rows:
+        if descending:
+            headers["X-Next-Before-Id"] = str(rows[0]["id"])
+        else:
+            headers["X-Next-After-Id"] = str(rows[-1]["id"])
 
+    return StreamingResponse(_stream_json_array(rows), media_type="application/json", headers=headers)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=5004)
@@ -1,13 +1,217 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 import mysql.connector
+from mysql.connector import errors
+
+import metrics
+
+db_config = {
+    'host': os.environ.get('GUVERCIN_DB_HOST', 'localhost'),
+    'user': os.environ.get('GUVERCIN_DB_USER', 'guvercin'),
+    'password': os.environ.get('GUVERCIN_DB_PASSWORD', '********'),
+    'database': os.environ.get('GUVERCIN_DB_NAME', 'guvercin')
+}
+
+# Havuz ayarları
+POOL_SIZE = int(os.environ.get('GUVERCIN_DB_POOL_SIZE', '10'))
+POOL_RECYCLE = float(os.environ.get('GUVERCIN_DB_POOL_RECYCLE', '3600'))  # saniye; bundan eski bağlantı yenilenir
+POOL_PING_AFTER = float(os.environ.get('GUVERCIN_DB_POOL_PING_AFTER', '30'))  # bu kadar boşta kalan bağlantı ping'lenir
+POOL_TIMEOUT = float(os.environ.get('GUVERCIN_DB_POOL_TIMEOUT', '10'))  # boş bağlantı bekleme süresi
+
+
+class PooledConnection:
+    """
+    Havuzdan alınan bağlantı. close() bağlantıyı kapatmaz, havuza geri verir;
+    diğer tüm çağrılar gerçek mysql bağlantısına aktarılır.
+    """
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self._checked_out = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        if self._checked_out:
+            self._checked_out = False
+            self._pool.release(self)
+
+
+class ConnectionPool:
+    """
+    Sabit boyutlu, thread-safe MySQL bağlantı havuzu.
+    Bağlantılar alınırken yaşı (recycle) ve boşta kalma süresi (ping) kontrol edilir.
+    """
+
+    def __init__(self, size=POOL_SIZE, recycle=POOL_RECYCLE, ping_after=POOL_PING_AFTER,
+                 timeout=POOL_TIMEOUT, **config):
+        self.size = size
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self.timeout = timeout
+        self.config = config
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self.opened = 0
+
+    def _open(self):
+        raw = mysql.connector.connect(**self.config)
+        # acquire birden fazla thread'den çağrılır; sayaç kilit altında artırılır
+        with self._lock:
+            self.opened += 1
+        metrics.DB_CONNECTIONS_OPENED.inc()
+        return PooledConnection(self, raw)
+
+    def _discard(self, conn):
+        try:
+            conn._raw.close()
+        except errors.Error:
+            pass
+
+    def _is_healthy(self, conn):
+        now = time.monotonic()
+        if now - conn.created_at > self.recycle:
+            return False
+        if now - conn.last_used > self.ping_after:
+            try:
+                conn._raw.ping(reconnect=False)
+            except errors.Error:
+                return False
+        return True
+
+    def acquire(self):
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise errors.PoolError("Veritabanı havuzunda boş bağlantı yok.")
+        metrics.DB_POOL_WAIT.observe(time.perf_counter() - start)
+        try:
+            while True:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    conn = self._open()
+                elif not self._is_healthy(conn):
+                    self._discard(conn)
+                    continue
+                conn._checked_out = True
+                return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        try:
+            # Commit edilmemiş işlemler bir sonraki kullanıcıya sızmasın
+            if conn._raw.in_transaction:
+                conn._raw.rollback()
+            conn.last_used = time.monotonic()
+            with self._lock:
+                self._idle.append(conn)
+        except errors.Error:
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn in idle:
+            self._discard(conn)
+
+
+pool = ConnectionPool(**db_config)
+
+# Event loop'u bloklamamak için veritabanı çağrıları bu thread'lerde çalışır.
+# Havuz boyutu kadar thread olduğundan thread'ler bağlantı beklemez.
+_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="db")
+
 
 def get_connection():
-    db_config = {
-        'host': 'localhost',
-        'user': 'guvercin',
-        'password': '********',
-        'database': 'guvercin'
-    }
-    db_connection = mysql.connector.connect(**db_config)
-    cursor = db_connection.cursor(dictionary=True)
+    db_connection = pool.acquire()
+    cursor = db_connection.cursor(dictionary=True, buffered=True)
     return db_connection, cursor
 
+
+def execute(query, params=(), fetch=None, commit=False):
+    """
+    Tek bir sorgu çalıştırır.
+    fetch="one" / "all" ise satırları, aksi halde lastrowid değerini döner.
+    """
+    conn, cursor = get_connection()
+    start = time.perf_counter()
+    try:
+        cursor.execute(query, params)
+        if fetch == "one":
+            result = cursor.fetchone()
+        elif fetch == "all":
+            result = cursor.fetchall()
+        else:
+            result = cursor.lastrowid
+        if commit:
+            conn.commit()
+        return result
+    finally:
+        # Sorgu türüne göre (SELECT, INSERT, ...) etiketlenir
+        metrics.DB_QUERY_LATENCY.labels(query.split(None, 1)[0].upper()).observe(time.perf_counter() - start)
+        cursor.close()
+        conn.close()
+
+
+def stream_query(query, params=(), chunk_size=500):
+    """
+    Sonuçları belleğe almadan, parça parça okuyan generator.
+    Büyük sonuç kümelerini yanıt olarak akıtmak için kullanılır.
+    """
+    conn = pool.acquire()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        try:
+            cursor.close()
+        except errors.Error:
+            # Yarıda kesilen okumada kalan satırlar bağlantıyı kirletmesin
+            conn.consume_results()
+        conn.close()
+
+
+def _call_with_connection(func, *args):
+    conn, cursor = get_connection()
+    start = time.perf_counter()
+    try:
+        return func(conn, cursor, *args)
+    finally:
+        # run_in_db işlemleri fonksiyon adıyla etiketlenir
+        metrics.DB_QUERY_LATENCY.labels(getattr(func, "__name__", "run_in_db")).observe(time.perf_counter() - start)
+        cursor.close()
+        conn.close()
+
+
+async def run_in_db(func, *args):
+    """
+    func(conn, cursor, *args) fonksiyonunu havuzdan alınan bir bağlantıyla
+    veritabanı thread'inde çalıştırır. Async handler'lar için.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(_call_with_connection, func, *args))
+
+
+async def execute_async(query, params=(), fetch=None, commit=False):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(execute, query, params, fetch, commit))
@@ -0,0 +1,140 @@
+"""
+WebSocket bağlantısı başına sınırlı gönderim kuyruğu.
+
+Bir sokete yazılan her çerçeve önce o bağlantının kuyruğuna eklenir; kuyruğu
+bağlantıya ait tek bir yazıcı görev boşaltır. Böylece yavaş ya da takılmış bir
+istemci yalnızca kendi kuyruğunu doldurur, göndereni ve diğer kullanıcıları
+bekletmez.
+
+Kuyruk dolduğunda uygulanacak politika (GUVERCIN_WS_OVERFLOW):
+    offline : çerçeve reddedilir, çağıran çevrimdışı teslimata (FCM) geçer (varsayılan)
+    close   : bağlantı 1013 (Try Again Later) koduyla kapatılır
+    block   : gönderen en fazla GUVERCIN_WS_BLOCK_TIMEOUT saniye bekler, sonra offline gibi davranılır.
+              Yalnızca gönderenin kendi görevindeki yazmalar bekler; paylaşılan
+              dinleyicilerden (pub/sub, presence) gelen yazmalar offline gibi davranır.
+"""
+import asyncio
+import logging
+import os
+
+from fastapi import WebSocket
+
+import protocol
+
+QUEUE_SIZE = int(os.environ.get("GUVERCIN_WS_QUEUE_SIZE", "256"))
+OVERFLOW_POLICY = os.environ.get("GUVERCIN_WS_OVERFLOW", "offline")
+BLOCK_TIMEOUT = float(os.environ.get("GUVERCIN_WS_BLOCK_TIMEOUT", "2"))
+
+logger = logging.getLogger(__name__)
+
+
+class Connection:
+    def __init__(self, websocket: WebSocket, username: str, queue_size=QUEUE_SIZE,
+                 policy=OVERFLOW_POLICY, block_timeout=BLOCK_TIMEOUT, on_sent=None, on_failed=None,
+                 codec=protocol.JSON):
+        if policy not in ("offline", "close", "block"):
+            raise ValueError(f"Geçersiz taşma politikası: {policy}")
+        self.websocket = websocket
+        self.username = username
+        # Çerçeveler bağlantının anlaştığı biçimde kodlanır (bkz. protocol.py)
+        self.codec = codec
+        self.policy = policy
+        self.block_timeout = block_timeout
+        # async on_sent(payload, remote) / async on_failed(payload)
+        self.on_sent = on_sent
+        self.on_failed = on_failed
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.queue.qsize(),
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "policy": self.policy,
+        }
+
+    async def send(self, payload: dict, remote: bool = False, wait: bool = True) -> bool:
+        """
+        Çerçeveyi kuyruğa ekler. Kuyruğa eklenemezse False döner;
+        bu durumda teslimat çağıranın sorumluluğundadır. wait=False ise
+        "block" politikasında da beklenmez (diğer bağlantıları da besleyen
+        dinleyici görevler bir istemci yüzünden durmasın).
+        """
+        if self.closed:
+            return False
+        item = (payload, remote)
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if not await self._overflow(item, wait):
+                self.dropped += 1
+                return False
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+
+    async def _overflow(self, item, wait: bool) -> bool:
+        if self.policy == "block":
+            if not wait:
+                return False
+            try:
+                await asyncio.wait_for(self.queue.put(item), self.block_timeout)
+                return True
+            except asyncio.TimeoutError:
+                return False
+        if self.policy == "close":
+            logger.warning("%s gönderim kuyruğu doldu, bağlantı kapatılıyor", self.username)
+            await self.close()
+            try:
+                await self.websocket.close(code=1013)
+            except Exception:
+                pass
+        return False
+
+    async def _write_loop(self):
+        while True:
+            payload, remote = await self.queue.get()
+            try:
+                data = self.codec.encode(payload)
+                if self.codec.binary:
+                    await self.websocket.send_bytes(data)
+                else:
+                    await self.websocket.send_text(data)
+            except Exception as e:
+                logger.warning("%s için WebSocket mesajı gönderilemedi: %s", self.username, e)
+                self.closed = True
+                if self.on_failed:
+                    await self.on_failed(payload)
+                await self._fail_pending()
+                return
+            self.sent += 1
+            if self.on_sent:
+                try:
+                    await self.on_sent(payload, remote)
+                except Exception:
+                    logger.exception("Gönderim sonrası işlem başarısız")
+
+    async def _fail_pending(self):
+        # Kuyrukta kalan çerçeveler çevrimdışı teslimata devredilir
+        while not self.queue.empty():
+            payload, _ = self.queue.get_nowait()
+            if self.on_failed:
+                await self.on_failed(payload)
+
+    async def close(self):
+        if self._writer is None:
+            return
+        self.closed = True
+        writer, self._writer = self._writer, None
+        if writer is not asyncio.current_task():
+            writer.cancel()
+            try:
+                await writer
+            except asyncio.CancelledError:
+                pass
+        await self._fail_pending()
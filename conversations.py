@@ -0,0 +1,213 @@
+"""
+Kullanıcı başına sohbet listesi (materialized conversation index).
+
+`conversations` tablosunda her (owner, peer) çifti için son mesaj, zamanı, kısa
+önizlemesi ve owner'ın okumadığı mesaj sayısı tutulur. Tablo mesaj yazıcısının
+(message_writer) toplu işlemleri ve mesaj silme içinde, aynı transaction'da
+güncellenir; sohbet listesi `messages` tablosunu taramadan okunur.
+
+    ekleme     : iki taraf için son mesaj güncellenir, alıcının unread'i artar
+    okundu     : etkilenen çiftlerin unread'i yeniden sayılır
+    silme      : silinen mesaj son mesajsa bir öncekine geri çekilir, unread yeniden sayılır
+
+Mevcut verilerden yeniden oluşturmak için:
+
+    python3 conversations.py --rebuild
+"""
+import argparse
+
+from connectdb import get_connection
+
+PREVIEW_LENGTH = 100
+REBUILD_CHUNK = 50_000
+
+# owner'ın peer'dan gelen, görmediği ve silmediği mesajlar
+_UNREAD_COUNT = """
+    SELECT COUNT(*) FROM messages m
+    LEFT JOIN deleted_messages d ON d.message_id = m.id AND d.user = c.owner
+    WHERE m.sender = c.peer AND m.receiver = c.owner AND m.seen = FALSE
+      AND d.message_id IS NULL
+"""
+
+LIST_QUERY = """
+    SELECT peer, last_message_id, last_ts, preview, unread FROM conversations
+    WHERE owner = %s
+"""
+
+
+def pair_query(select: str, select_params, user1: str, user2: str, where: str = "", where_params=(),
+               order: str = "DESC", limit: int = None) -> tuple:
+    """
+    user1 ile user2 arasındaki mesajlar için (sorgu, parametreler) döner.
+
+    `(sender=a AND receiver=b) OR (sender=b AND receiver=a)` koşulu
+    (sender, receiver, id) indeksinde iki aralık üretir; MySQL bunları id
+    sırasıyla okuyamaz ve LIMIT'ten önce konuşmanın tamamını sıralar. Burada
+    her yön kendi aralığından id sırasıyla en fazla `limit` satır okuyan ayrı
+    bir alt sorgudur; dış sorgu ikisini UNION ALL ile birleştirip keser.
+
+    select: `SELECT ... FROM messages m [JOIN ...]` (WHERE'siz, id sütunu seçilmeli)
+    where : yön koşuluna eklenecek ` AND ...` koşulları
+    """
+    directions = [(user1, user2)] if user1 == user2 else [(user1, user2), (user2, user1)]
+    parts, params = [], []
+    for sender, receiver in directions:
+        part = f"{select} WHERE m.sender = %s AND m.receiver = %s{where} ORDER BY m.id {order}"
+        params += [*select_params, sender, receiver, *where_params]
+        if limit is not None:
+            part += " LIMIT %s"
+            params.append(limit)
+        parts.append(f"({part})")
+    query = " UNION ALL ".join(parts) + f" ORDER BY id {order}"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+    return query, params
+
+
+def preview_for(msg_type, content, file_name) -> str:
+    if msg_type == "file":
+        return (file_name or "")[:PREVIEW_LENGTH]
+    return (content or "")[:PREVIEW_LENGTH]
+
+
+def record_messages(cursor, rows, ids):
+    """
+    Yeni eklenen mesajları iki tarafın sohbet kaydına işler.
+    rows message_writer.MESSAGE_COLUMNS sırasındadır.
+    """
+    latest = {}  # (owner, peer) -> [last_message_id, last_ts, preview, unread]
+    for row, message_id in zip(rows, ids):
+        sender, receiver, msg_type, content, _, file_name, _, timestamp = row[:8]
+        preview = preview_for(msg_type, content, file_name)
+        for owner, peer, unread in ((sender, receiver, 0), (receiver, sender, 1)):
+            if owner == peer and unread:
+                continue  # Kendine gönderilen mesaj okunmamış sayılmaz
+            entry = latest.get((owner, peer))
+            if entry is None:
+                latest[(owner, peer)] = [message_id, timestamp, preview, unread]
+                continue
+            if message_id > entry[0]:
+                entry[:3] = [message_id, timestamp, preview]
+            entry[3] += unread
+
+    if not latest:
+        return
+    # Anahtar sırasıyla yazılır; eşzamanlı gruplar satır kilitlerini aynı sırada alır
+    items = sorted(latest.items())
+    placeholders = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(items))
+    params = [value for (owner, peer), entry in items for value in (owner, peer, *entry)]
+    # ON DUPLICATE KEY UPDATE atamaları soldan sağa uygulanır; last_message_id en sonda
+    cursor.execute(f"""
+        INSERT INTO conversations (owner, peer, last_message_id, last_ts, preview, unread)
+        VALUES {placeholders}
+        ON DUPLICATE KEY UPDATE
+            last_ts = IF(VALUES(last_message_id) > last_message_id, VALUES(last_ts), last_ts),
+            preview = IF(VALUES(last_message_id) > last_message_id, VALUES(preview), preview),
+            last_message_id = GREATEST(last_message_id, VALUES(last_message_id)),
+            unread = unread + VALUES(unread)
+    """, params)
+
+
+def recount_unread(cursor, pairs):
+    if not pairs:
+        return
+    pairs = sorted(pairs)
+    conditions = " OR ".join(["(c.owner = %s AND c.peer = %s)"] * len(pairs))
+    cursor.execute(
+        f"UPDATE conversations c SET c.unread = ({_UNREAD_COUNT}) WHERE {conditions}",
+        [value for pair in pairs for value in pair]
+    )
+
+
+def message_deleted(cursor, owner: str, message_id: int):
+    """
+    owner'ın sildiği mesajı sohbet kaydından düşürür. deleted_messages kaydı
+    aynı transaction'da önceden eklenmiş olmalıdır.
+    """
+    cursor.execute("SELECT sender, receiver FROM messages WHERE id = %s", (message_id,))
+    message = cursor.fetchone()
+    if not message:
+        return
+    peer = message["receiver"] if message["sender"] == owner else message["sender"]
+
+    # Silinmemiş en son mesaj
+    cursor.execute(*pair_query("""
+        SELECT m.id, m.type, m.content, m.file_name, m.timestamp FROM messages m
+        LEFT JOIN deleted_messages d ON d.message_id = m.id AND d.user = %s
+    """, (owner,), owner, peer, where=" AND d.message_id IS NULL", limit=1))
+    previous = cursor.fetchone()
+
+    # Yalnızca silinen mesaj hâlâ son mesajsa geri çekilir; bu arada yenisi geldiyse dokunulmaz
+    if previous is None:
+        cursor.execute(
+            "DELETE FROM conversations WHERE owner = %s AND peer = %s AND last_message_id = %s",
+            (owner, peer, message_id)
+        )
+    else:
+        cursor.execute("""
+            UPDATE conversations SET last_message_id = %s, last_ts = %s, preview = %s
+            WHERE owner = %s AND peer = %s AND last_message_id = %s
+        """, (previous["id"], previous["timestamp"],
+              preview_for(previous["type"], previous["content"], previous["file_name"]),
+              owner, peer, message_id))
+    recount_unread(cursor, {(owner, peer)})
+
+
+def rebuild(chunk_size=REBUILD_CHUNK):
+    """
+    Tabloyu `messages` ve `deleted_messages` tablolarından baştan oluşturur.
+    Mesajlar ID aralıkları halinde işlenir ve her aralık ayrı commit edilir.
+    Rebuild sırasında yazılan mesajları yazıcı zaten tabloya işler.
+    """
+    conn, cursor = get_connection()
+    try:
+        cursor.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM messages")
+        max_id = cursor.fetchone()["max_id"]
+        cursor.execute("DELETE FROM conversations")
+        conn.commit()
+
+        for start in range(0, max_id, chunk_size):
+            end = min(start + chunk_size, max_id)
+            # Her iki yön için silinmemiş son mesaj
+            cursor.execute("""
+                INSERT INTO conversations (owner, peer, last_message_id, unread)
+                SELECT owner, peer, MAX(id), 0 FROM (
+                    SELECT m.sender AS owner, m.receiver AS peer, m.id FROM messages m
+                    LEFT JOIN deleted_messages d ON d.message_id = m.id AND d.user = m.sender
+                    WHERE m.id > %s AND m.id <= %s AND d.message_id IS NULL
+                    UNION ALL
+                    SELECT m.receiver, m.sender, m.id FROM messages m
+                    LEFT JOIN deleted_messages d ON d.message_id = m.id AND d.user = m.receiver
+                    WHERE m.id > %s AND m.id <= %s AND d.message_id IS NULL
+                ) t
+                GROUP BY owner, peer
+                ON DUPLICATE KEY UPDATE last_message_id = GREATEST(last_message_id, VALUES(last_message_id))
+            """, (start, end, start, end))
+            conn.commit()
+            print(f"Mesajlar işlendi: {end}/{max_id}")
+
+        cursor.execute(f"""
+            UPDATE conversations c JOIN messages m ON m.id = c.last_message_id
+            SET c.last_ts = m.timestamp,
+                c.preview = IF(m.type = 'file', LEFT(COALESCE(m.file_name, ''), {PREVIEW_LENGTH}),
+                               LEFT(COALESCE(m.content, ''), {PREVIEW_LENGTH})),
+                c.unread = ({_UNREAD_COUNT})
+        """)
+        conn.commit()
+        cursor.execute("SELECT COUNT(*) AS total FROM conversations")
+        return cursor.fetchone()["total"]
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rebuild", action="store_true", help="Sohbet listesini mevcut mesajlardan yeniden oluştur")
+    parser.add_argument("--chunk-size", type=int, default=REBUILD_CHUNK)
+    args = parser.parse_args()
+    if args.rebuild:
+        print(f"Oluşturulan sohbet kaydı: {rebuild(args.chunk_size)}")
+    else:
+        parser.print_help()
@@ -1,63 +1,470 @@
-from fastapi import FastAPI, HTTPException
-import redis
+"""
+Hesap silme servisi.
+
+Silme isteği yalnızca oturumu kapatır ve bir silme işi (job) oluşturur; asıl
+silme arka planda, adım adım yapılır ve istek gecikmesine yansımaz:
+
+    redis  : kullanıcı kaydı, presence kaydı, chat:{user_id}:* anahtarları (SCAN COUNT + UNLINK) ve
+             sohbetlerinin sıcak katman (recent_messages) anahtarları
+    mysql  : mesajlar, silinmiş mesaj kayıtları ve sohbet listesi; transaction başına
+             en fazla GUVERCIN_DELETE_BATCH_ROWS satır
+    files  : kullanıcının dosyaları, gönderdiği eski ekler ve referansı kalmayan
+             depo nesneleri (attachments.py); saniyede en fazla
+             GUVERCIN_DELETE_FILES_PER_SECOND dosya
+    index  : kullanıcı adı en son serbest bırakılır, böylece silme sürerken aynı
+             adla yeni hesap açılamaz
+
+İş durumu Redis'te delete_job:{job_id} hash'inde tutulur ve
+GET /delete_user/jobs/{job_id} ile izlenir. Her adım tekrar çalıştırılabilir;
+bir worker çökerse bitmemiş işler kilit süresi dolunca başka bir worker
+tarafından kaldığı adımdan sürdürülür.
+"""
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+import asyncio
 import logging
+import os
+import uuid
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
 import uvicorn
 
-# FastAPI uygulamasını başlatma
-app = FastAPI()
+import metrics
+import redisdb
+import user_index
+import sessions
+import recent_messages
+import presence
+import attachments
+from connectdb import run_in_db
 
-# Redis bağlantısı oluşturma
-r = redis.StrictRedis(host='localhost', port=6379, db=0, decode_responses=True)
+USER_FILES_PATH = os.environ.get("GUVERCIN_FILES_PATH", "/home/gcloude/download_file")
+BATCH_ROWS = int(os.environ.get("GUVERCIN_DELETE_BATCH_ROWS", "1000"))
+# MySQL parçaları arasında diğer sorgulara yer açmak için bekleme
+BATCH_PAUSE = float(os.environ.get("GUVERCIN_DELETE_BATCH_PAUSE", "0.05"))
+SCAN_COUNT = int(os.environ.get("GUVERCIN_DELETE_SCAN_COUNT", "5000"))
+FILES_PER_SECOND = float(os.environ.get("GUVERCIN_DELETE_FILES_PER_SECOND", "200"))
+FILES_BATCH = 50
+LOCK_TTL = 60  # saniye; işi yürüten worker LOCK_TTL / 3'te bir uzatır
+RESUME_INTERVAL = 30  # saniye
+JOB_TTL = 7 * 24 * 60 * 60  # biten işin durumu bu kadar saklanır
+
+PENDING_KEY = "delete_jobs:pending"
+STEPS = ("redis", "mysql", "files", "index")
+
+# Kilit yalnızca hâlâ bu worker'ın token'ını taşıyorsa silinir (GET + DEL atomik)
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Kilit yalnızca hâlâ bu worker'ınsa uzatılır; başka bir worker'ın kilidine dokunulmaz
+_REFRESH_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Paylaşılan async Redis havuzu
+r = redisdb.client
 
 # Logging yapılandırması
 logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
-@app.delete("/delete_user/{username}")
-async def delete_user_account(username: str):
+# Bu worker'da yürüyen işler
+running = {}
+resumer = None
+
+
+def job_key(job_id: str) -> str:
+    return f"delete_job:{job_id}"
+
+
+def job_files_key(job_id: str) -> str:
+    return f"delete_job:{job_id}:files"
+
+
+def job_attachments_key(job_id: str) -> str:
+    return f"delete_job:{job_id}:attachments"
+
+
+def lock_key(job_id: str) -> str:
+    return f"delete_job:{job_id}:lock"
+
+
+def user_job_key(username: str) -> str:
+    return f"delete_job:user:{username}"
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+async def _progress(job_id: str, field: str = None, amount: int = 0):
+    # Sayaç ve güncelleme zamanı tek gidiş-dönüşte; kilidi _keep_lock uzatır
+    pipe = r.pipeline(transaction=False)
+    if field and amount:
+        pipe.hincrby(job_key(job_id), field, amount)
+    pipe.hset(job_key(job_id), "updated_at", _now())
+    await pipe.execute()
+
+
+# --- redis adımı ---
+
+async def _delete_redis(job_id: str, job: dict):
+    username, user_id = job["username"], job["user_id"]
+    removed = await r.unlink(f"user:{username}", f"session:{username}", presence.presence_key(username))
+    await r.hdel(presence.LAST_SEEN_KEY, username)
+    await _progress(job_id, "redis_keys", removed)
+    for pattern in (f"chat:{user_id}:*", f"download:file:{username}:*"):
+        cursor = 0
+        while True:
+            cursor, keys = await r.scan(cursor, match=pattern, count=SCAN_COUNT)
+            if keys:
+                await _progress(job_id, "redis_keys", await redisdb.unlink_many(r, keys))
+            if cursor == 0:
+                break
+    # Sohbet listesi mysql adımında silinir; sıcak katman anahtarları ondan önce bulunur
+    peers = await run_in_db(_select_peers, username)
+    keys = [key for peer in peers for key in recent_messages.conversation_keys(username, peer)]
+    if keys:
+        await _progress(job_id, "redis_keys", await redisdb.unlink_many(r, keys))
+
+
+def _select_peers(conn, cursor, username):
+    cursor.execute("SELECT peer FROM conversations WHERE owner = %s", (username,))
+    return [row["peer"] for row in cursor.fetchall()]
+
+
+# --- mysql adımı ---
+
+def _select_sent_messages(conn, cursor, username, limit):
+    cursor.execute(
+        "SELECT id, file_url, attachment FROM messages WHERE sender = %s ORDER BY id LIMIT %s",
+        (username, limit)
+    )
+    return cursor.fetchall()
+
+
+def _select_received_messages(conn, cursor, username, limit):
+    cursor.execute(
+        "SELECT id, NULL AS file_url, attachment FROM messages WHERE receiver = %s ORDER BY id LIMIT %s",
+        (username, limit)
+    )
+    return cursor.fetchall()
+
+
+def _delete_messages(conn, cursor, ids):
+    placeholders = ", ".join(["%s"] * len(ids))
+    # Eklerin referansları mesajlarla aynı transaction'da azaltılır
+    attachments.release_references(cursor, ids)
+    cursor.execute(f"DELETE FROM deleted_messages WHERE message_id IN ({placeholders})", ids)
+    cursor.execute(f"DELETE FROM messages WHERE id IN ({placeholders})", ids)
+    conn.commit()
+    return cursor.rowcount
+
+
+def _delete_limited(conn, cursor, query, username, limit):
+    cursor.execute(query, (username, limit))
+    conn.commit()
+    return cursor.rowcount
+
+
+async def _delete_mysql(job_id: str, job: dict):
+    username = job["username"]
+    for select in (_select_sent_messages, _select_received_messages):
+        while True:
+            rows = await run_in_db(select, username, BATCH_ROWS)
+            if not rows:
+                break
+            # Eklerin yolları ve depo nesneleri satırlar silinmeden önce işe kaydedilir;
+            # depodaki nesneler doğrudan silinmez, başka mesajlar da gösterebilir
+            files = [row["file_url"] for row in rows if row["file_url"] and not row["attachment"]]
+            if files:
+                await r.sadd(job_files_key(job_id), *files)
+            digests = {row["attachment"] for row in rows if row["attachment"]}
+            if digests:
+                await r.sadd(job_attachments_key(job_id), *digests)
+            deleted = await run_in_db(_delete_messages, [row["id"] for row in rows])
+            await _progress(job_id, "messages", deleted)
+            await asyncio.sleep(BATCH_PAUSE)
+
+    for field, query in (
+        ("deleted_messages", "DELETE FROM deleted_messages WHERE user = %s LIMIT %s"),
+        ("conversations", "DELETE FROM conversations WHERE owner = %s LIMIT %s"),
+        ("conversations", "DELETE FROM conversations WHERE peer = %s LIMIT %s"),
+    ):
+        while True:
+            deleted = await run_in_db(_delete_limited, query, username, BATCH_ROWS)
+            await _progress(job_id, field, deleted)
+            if deleted < BATCH_ROWS:
+                break
+            await asyncio.sleep(BATCH_PAUSE)
+
+
+# --- files adımı ---
+
+def _inside_files_root(path: str) -> bool:
+    # Kullanıcı adı ya da veritabanındaki yol dosya kökünün dışına çıkamaz
+    root = os.path.realpath(USER_FILES_PATH)
+    return os.path.commonpath([root, os.path.realpath(path)]) == root and os.path.realpath(path) != root
+
+
+def _inside_attachment_store(path: str) -> bool:
+    root = os.path.realpath(attachments.store.root)
+    return os.path.commonpath([root, os.path.realpath(path)]) == root
+
+
+def _remove_paths(paths):
+    removed = 0
+    for path in paths:
+        if not _inside_files_root(path) or _inside_attachment_store(path):
+            logger.warning("Dosya kökü dışındaki yol atlandı: %s", path)
+            continue
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def _remove_tree(directory, limit):
+    """directory altındaki en fazla limit dosyayı siler, silinen sayıyı döner."""
+    removed = 0
+    for root, dirs, files in os.walk(directory, topdown=False):
+        for name in files:
+            if removed >= limit:
+                return removed
+            try:
+                os.remove(os.path.join(root, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        try:
+            os.rmdir(root)
+        except OSError:
+            pass
+    return removed
+
+
+async def _delete_files(job_id: str, job: dict):
+    pause = FILES_BATCH / FILES_PER_SECOND
+    while True:
+        # Yollar dosyalar silindikten sonra setten çıkarılır; çökme olursa tekrar denenir
+        paths = await r.srandmember(job_files_key(job_id), FILES_BATCH)
+        if not paths:
+            break
+        removed = await asyncio.to_thread(_remove_paths, paths)
+        await r.srem(job_files_key(job_id), *paths)
+        await _progress(job_id, "files", removed)
+        await asyncio.sleep(pause)
+
+    while True:
+        # Referansı sıfırlanan nesneler; başka mesajların gösterdikleri collect tarafından korunur
+        digests = await r.srandmember(job_attachments_key(job_id), FILES_BATCH)
+        if not digests:
+            break
+        removed = await attachments.store.collect(digests)
+        await r.srem(job_attachments_key(job_id), *digests)
+        await _progress(job_id, "files", removed)
+        await asyncio.sleep(pause)
+
+    directory = os.path.join(USER_FILES_PATH, job["username"])
+    if not _inside_files_root(directory) or _inside_attachment_store(directory):
+        logger.warning("Dosya kökü dışındaki dizin atlandı: %s", directory)
+        return
+    while True:
+        removed = await asyncio.to_thread(_remove_tree, directory, FILES_BATCH)
+        await _progress(job_id, "files", removed)
+        if removed < FILES_BATCH:
+            break
+        await asyncio.sleep(pause)
+
+
+# --- index adımı ---
+
+async def _release_username(job_id: str, job: dict):
+    await user_index.remove_user(r, job["username"])
+
+
+STEP_FUNCTIONS = {
+    "redis": _delete_redis,
+    "mysql": _delete_mysql,
+    "files": _delete_files,
+    "index": _release_username,
+}
+
+
+async def _keep_lock(job_id: str, token: str):
     """
-    Kullanıcı adı ile ilişkili verileri siler
+    Kilidi süre dolmadan uzatır; adımlar arasında uzun bir tarama olsa da iş
+    kilitsiz kalmaz. Kilit artık bu worker'ın değilse döner.
     """
-    # Kullanıcının `users` setinde olup olmadığını kontrol et
-    users = r.smembers("users")
-    user_id = None
+    while True:
+        await asyncio.sleep(LOCK_TTL / 3)
+        try:
+            if not await r.eval(_REFRESH_SCRIPT, 1, lock_key(job_id), token, LOCK_TTL):
+                return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Redis düzelene kadar denenir; kilit bu arada düşerse sonraki deneme fark eder
+            logger.warning("Hesap silme işi %s kilidi uzatılamadı: %s", job_id, e)
 
-    for user in users:
-        if user.startswith(f"{username}:"):
-            user_id = user.split(":")[1]  # Kullanıcı ID'sini al
-            break
 
-    print(f"username: {username}")  # username yazdırma
-    print(f"user_id: {user_id}")  # user_id yazdırma
+async def _run_steps(job_id: str, job: dict):
+    await r.hset(job_key(job_id), mapping={"status": "running", "updated_at": _now()})
+    for step in STEPS[STEPS.index(job.get("step", STEPS[0])):]:
+        await r.hset(job_key(job_id), "step", step)
+        await STEP_FUNCTIONS[step](job_id, job)
+
+    pipe = r.pipeline(transaction=True)
+    pipe.hset(job_key(job_id), mapping={"status": "done", "finished_at": _now(), "updated_at": _now()})
+    pipe.hdel(job_key(job_id), "error")
+    pipe.expire(job_key(job_id), JOB_TTL)
+    pipe.delete(user_job_key(job["username"]), job_files_key(job_id), job_attachments_key(job_id))
+    pipe.srem(PENDING_KEY, job_id)
+    await pipe.execute()
+    logger.info("Hesap silindi: %s (iş %s)", job["username"], job_id)
 
+
+async def run_job(job_id: str):
+    token = uuid.uuid4().hex
+    if not await r.set(lock_key(job_id), token, nx=True, ex=LOCK_TTL):
+        return  # Başka bir worker yürütüyor
+    keeper = steps = None
+    try:
+        job = await r.hgetall(job_key(job_id))
+        if not job or job.get("status") == "done":
+            await r.srem(PENDING_KEY, job_id)
+            return
+
+        keeper = asyncio.create_task(_keep_lock(job_id, token))
+        steps = asyncio.create_task(_run_steps(job_id, job))
+        await asyncio.wait((keeper, steps), return_when=asyncio.FIRST_COMPLETED)
+        if not steps.done():
+            # Kilit başka bir worker'a geçti; aynı iş iki yerde yürümesin
+            logger.warning("Hesap silme işi %s kilidi kaybedildi, durduruluyor", job_id)
+            steps.cancel()
+            return
+        steps.result()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        # İş bekleyenler listesinde kalır ve RESUME_INTERVAL sonra yeniden denenir
+        logger.exception("Hesap silme işi %s başarısız", job_id)
+        await r.hset(job_key(job_id), mapping={"status": "retrying", "error": str(e), "updated_at": _now()})
+    finally:
+        for task in (keeper, steps):
+            if task and not task.done():
+                task.cancel()
+        await r.eval(_RELEASE_SCRIPT, 1, lock_key(job_id), token)
+
+
+def start_job(job_id: str):
+    if job_id in running:
+        return
+    task = asyncio.create_task(run_job(job_id))
+    running[job_id] = task
+    task.add_done_callback(lambda _: running.pop(job_id, None))
+
+
+async def resume_jobs():
+    """Bitmemiş işleri (çöken worker'lardan kalanlar dahil) periyodik olarak sürdürür."""
+    while True:
+        try:
+            for job_id in await r.smembers(PENDING_KEY):
+                start_job(job_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Bekleyen silme işleri okunamadı")
+        await asyncio.sleep(RESUME_INTERVAL)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global resumer
+    resumer = asyncio.create_task(resume_jobs())
+    yield
+    for task in [resumer, *running.values()]:
+        task.cancel()
+    await asyncio.gather(resumer, *running.values(), return_exceptions=True)
+    resumer = None
+
+
+# FastAPI uygulamasını başlatma
+app = FastAPI(lifespan=lifespan)
+metrics.install(app)
+
+
+async def _job_status(job_id: str):
+    job = await r.hgetall(job_key(job_id))
+    if not job:
+        return None
+    for field in ("redis_keys", "messages", "deleted_messages", "conversations", "files"):
+        job[field] = int(job.get(field, 0))
+    job["job_id"] = job_id
+    return job
+
+
+@app.delete("/delete_user/{username}")
+async def delete_user_account(username: str):
+    """
+    Kullanıcının hesap silme işini başlatır ve iş kimliğini döner (202).
+    Kullanıcı için zaten bir iş varsa onun durumu döner.
+    """
+    existing = await r.get(user_job_key(username))
+    if existing:
+        return JSONResponse(status_code=202, content=await _job_status(existing) or {"job_id": existing})
+
+    user_id = await user_index.get_user_id(r, username)
     if not user_id:
         raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
 
-    # Kullanıcıya ait session anahtarını sil
-    session_key = f"session:{username}"
-    r.delete(session_key)
-    logging.info(f"Deleted session: {session_key}")
+    job_id = uuid.uuid4().hex
+    if not await r.set(user_job_key(username), job_id, nx=True):
+        # Aynı anda gelen başka bir istek işi oluşturdu
+        existing = await r.get(user_job_key(username))
+        return JSONResponse(status_code=202, content=await _job_status(existing) or {"job_id": existing})
 
-    # Kullanıcıyı 'users' kümesinden çıkar
-    r.srem('users', f"{username}:{user_id}")
+    pipe = r.pipeline(transaction=True)
+    pipe.hset(job_key(job_id), mapping={
+        "username": username,
+        "user_id": user_id,
+        "status": "queued",
+        "step": STEPS[0],
+        "created_at": _now(),
+        "updated_at": _now(),
+    })
+    pipe.sadd(PENDING_KEY, job_id)
+    # Oturum hemen kapatılır; tüm worker'lar önbellekteki oturumu düşürsün
+    pipe.delete(f"session:{username}")
+    pipe.publish(sessions.REVOCATION_CHANNEL, username)
+    await pipe.execute()
+    logger.info("Hesap silme işi oluşturuldu: %s (iş %s)", username, job_id)
 
-    # Kullanıcıya ait chat anahtarlarını sil (wildcard ile)
-    cursor = 0
-    while True:
-        cursor, chat_keys = r.scan(cursor, match=f"chat:{user_id}:*")
-        for chat_key in chat_keys:
-            r.delete(chat_key)
-            logging.info(f"Deleted chat key: {chat_key}")
-        if cursor == 0:
-            break
+    start_job(job_id)
+    return JSONResponse(status_code=202, content={
+        "message": f"Hesap silme işlemi başlatıldı: {username}",
+        "status": "queued",
+        "job_id": job_id,
+    })
 
-    # Kullanıcı bilgilerini de sil
-    user_key = f"user:{username}"
-    r.delete(user_key)
-    logging.info(f"Deleted user key: {user_key}")
 
-    return {"message": f"Hesap ve ilişkili veriler başarıyla silindi: {username}", "status": "success"}
+@app.get("/delete_user/jobs/{job_id}")
+async def get_delete_job(job_id: str):
+    job = await _job_status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Silme işi bulunamadı")
+    return job
 
 # Uvicorn ile uygulamayı çalıştırma
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=5005)
-
@@ -0,0 +1,92 @@
+"""
+Ek dosya indirme yardımcıları.
+
+save_file ile üretilen indirme token'ları Redis'te TTL ile saklanır, böylece
+herhangi bir worker token'ı MySQL'e gitmeden çözebilir:
+
+    download:{token}                      -> {"path", "file_name", "receiver"}
+    download:file:{receiver}:{file_name}  -> {"path", "id"}  (eski /download_file yolu için önbellek)
+
+Aynı ada yeni bir dosya geldiğinde önbellek mesaj yazılırken güncellenir;
+kayıt yalnızca daha büyük mesaj ID'siyle ezilir, böylece eşzamanlı bir
+indirme eski sonucu geri yazamaz.
+"""
+import json
+import os
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+TOKEN_TTL = int(os.environ.get("GUVERCIN_DOWNLOAD_TOKEN_TTL", str(7 * 24 * 60 * 60)))
+# Bu boyuttan büyük dosyalar büyük parçalarla gönderilir
+LARGE_FILE_SIZE = 8 * 1024 * 1024
+LARGE_CHUNK_SIZE = 1024 * 1024
+
+
+def token_key(token: str) -> str:
+    return f"download:{token}"
+
+
+# KEYS: önbellek  ARGV: sonuç (JSON), mesaj ID'si, TTL
+_CACHE_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current and tonumber(cjson.decode(current).id) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+return 1
+"""
+
+
+def lookup_key(receiver: str, file_name: str) -> str:
+    return f"download:file:{receiver}:{file_name}"
+
+
+async def store_token(client, token: str, path: str, receiver: str, file_name: str):
+    await client.set(token_key(token), json.dumps({"path": path, "file_name": file_name, "receiver": receiver}),
+                     ex=TOKEN_TTL)
+
+
+async def resolve_token(client, token: str):
+    data = await client.get(token_key(token))
+    return json.loads(data) if data else None
+
+
+async def cache_lookup(client, receiver: str, file_name: str, result: dict):
+    await client.eval(_CACHE_SCRIPT, 1, lookup_key(receiver, file_name), json.dumps(result), result["id"],
+                      TOKEN_TTL)
+
+
+async def cached_lookup(client, receiver: str, file_name: str):
+    data = await client.get(lookup_key(receiver, file_name))
+    return json.loads(data) if data else None
+
+
+def file_response(request: Request, path: str, filename: str) -> Response:
+    """
+    Dosyayı Range ve If-None-Match desteğiyle gönderir. Dosya yoksa None döner.
+
+    Range istekleri (devam ettirme, video sarma) FileResponse tarafından 206 ile
+    yanıtlanır. Sunucu `http.response.pathsend` destekliyorsa tam dosya
+    çekirdeğin sendfile yolu ile gönderilir.
+    """
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    response = FileResponse(
+        path=path,
+        filename=filename,
+        media_type="application/octet-stream",
+        stat_result=stat_result
+    )
+    if stat_result.st_size >= LARGE_FILE_SIZE:
+        response.chunk_size = LARGE_CHUNK_SIZE
+
+    etag = response.headers.get("etag")
+    if_none_match = request.headers.get("if-none-match")
+    if etag and if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"etag": etag})
+
+    return response
@@ -0,0 +1,51 @@
+"""
+Yük testleri için sahte FCM adresi.
+
+notifications.HttpTransport ile kullanılır:
+
+    python3 fake_fcm.py
+    GUVERCIN_FCM_TRANSPORT=http GUVERCIN_FCM_ENDPOINT=http://localhost:5099/send python3 chat.py
+
+FAKE_FCM_LATENCY (saniye), FAKE_FCM_RETRY_RATE ve FAKE_FCM_INVALID_RATE ile
+yavaş yanıt ve hata oranları ayarlanabilir.
+"""
+import asyncio
+import os
+import random
+
+from fastapi import FastAPI, Body
+import uvicorn
+
+LATENCY = float(os.environ.get("FAKE_FCM_LATENCY", "0.05"))
+RETRY_RATE = float(os.environ.get("FAKE_FCM_RETRY_RATE", "0"))
+INVALID_RATE = float(os.environ.get("FAKE_FCM_INVALID_RATE", "0"))
+
+app = FastAPI()
+stats = {"requests": 0, "messages": 0}
+
+
+def _result():
+    roll = random.random()
+    if roll < INVALID_RATE:
+        return "invalid"
+    if roll < INVALID_RATE + RETRY_RATE:
+        return "retry"
+    return "ok"
+
+
+@app.post("/send")
+async def send(payload: dict = Body(...)):
+    messages = payload.get("messages", [])
+    stats["requests"] += 1
+    stats["messages"] += len(messages)
+    await asyncio.sleep(LATENCY)
+    return {"results": [_result() for _ in messages]}
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=5099)
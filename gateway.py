@@ -0,0 +1,140 @@
+"""
+Tüm servisleri tek bir ASGI uygulamasında birleştiren ağ geçidi.
+
+İstekler ilk yol parçasına göre sahibi olan servise yönlendirilir; böylece
+istemciler eski yolları (/login, /get_messages/..., /chats/...) aynen kullanır.
+Her servise kendi önekiyle de erişilebilir (/chat/..., /home/...). İki serviste
+birden bulunan /ws/{username} chat'e gider, home'un soketi /home/ws/{username}
+adresindedir.
+
+Redis (redisdb), MySQL ve Firebase istemcileri tek süreçte bir kez oluşturulur;
+alt uygulamaların lifespan'leri ağ geçidinin lifespan'i içinde çalıştırılır.
+/metrics süreçteki tüm servislerin ölçümlerini döner (bkz. metrics.py); istek
+süreleri alt uygulamalarda ölçüldüğünden burada ayrıca ölçülmez.
+
+    uvicorn gateway:app            # tek süreç
+    python3 server.py              # çok süreçli (bkz. server.py)
+"""
+import logging
+from contextlib import AsyncExitStack, asynccontextmanager
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from starlette.responses import PlainTextResponse
+from starlette.routing import get_route_path
+
+import chat
+import delete
+import home
+import login
+import register
+import search
+import metrics
+import redisdb
+from connectdb import execute_async
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(process)d] %(name)s %(levelname)s: %(message)s")
+
+SERVICES = {
+    "chat": chat.app,
+    "home": home.app,
+    "login": login.app,
+    "register": register.app,
+    "search": search.app,
+    "delete": delete.app,
+}
+
+# Yolların ilk parçası -> servis
+LEGACY_ROUTES = {
+    "public_key": "chat",
+    "ws": "chat",
+    "download": "chat",
+    "download_file": "chat",
+    "delete_message": "chat",
+    "get_messages": "chat",
+    "connections": "chat",
+    "chats": "home",
+    "presence": "home",
+    "login": "login",
+    "check-session": "login",
+    "logout": "login",
+    "register": "register",
+    "get_user_id": "register",
+    "get_username": "register",
+    "check_user": "search",
+    "search_users": "search",
+    "delete_user": "delete",
+}
+
+
+class ServiceRouter:
+    """İstekleri ilk yol parçasına göre ilgili servise aktarır."""
+
+    def __init__(self, services: dict, routes: dict):
+        self.services = services
+        self.targets = {segment: services[name] for segment, name in routes.items()}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            segment = get_route_path(scope).lstrip("/").split("/", 1)[0]
+            target = self.targets.get(segment)
+            if target is not None:
+                await target(scope, receive, send)
+                return
+            service = self.services.get(segment)
+            if service is not None:
+                # Önekli erişim: /home/ws/u -> home uygulamasında /ws/u
+                scope = dict(scope, root_path=scope.get("root_path", "") + "/" + segment)
+                await service(scope, receive, send)
+                return
+            if scope["type"] == "websocket":
+                await send({"type": "websocket.close", "code": 1000})
+                return
+        await PlainTextResponse("Not Found", status_code=404)(scope, receive, send)
+
+
+ready = False
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global ready
+    async with AsyncExitStack() as stack:
+        stack.push_async_callback(redisdb.close)
+        for service in SERVICES.values():
+            await stack.enter_async_context(service.router.lifespan_context(service))
+        ready = True
+        yield
+        ready = False
+
+
+app = FastAPI(lifespan=lifespan)
+metrics.install(app, instrument=False)
+
+
+@app.get("/healthz")
+async def healthz():
+    """Süreç ayakta mı (liveness)."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Süreç istek kabul etmeye hazır mı (readiness): Redis ve MySQL erişilebilir olmalı."""
+    checks = {"startup": ready}
+    try:
+        checks["redis"] = await redisdb.ping()
+    except Exception:
+        checks["redis"] = False
+    try:
+        await execute_async("SELECT 1", fetch="one")
+        checks["mysql"] = True
+    except Exception:
+        checks["mysql"] = False
+
+    status_code = 200 if all(checks.values()) else 503
+    return JSONResponse(status_code=status_code, content=checks)
+
+
+# En sona: sağlık kontrolleri ve /metrics dışındaki her şey servislere gider
+app.mount("/", ServiceRouter(SERVICES, LEGACY_ROUTES))
@@ -1,11 +1,37 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from typing import Optional
+import logging
+
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query, Body
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict
-from connectdb import get_connection
+from contextlib import asynccontextmanager
+from connectdb import execute_async
+from conversations import LIST_QUERY
+from router import Router
+from presence import tracker as presence, MAX_QUERY as MAX_PRESENCE_QUERY
+import metrics
+import ratelimit
 import uvicorn
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+# Aktif WebSocket bağlantıları; başka worker'lara bağlı kullanıcılara Redis üzerinden iletilir
+home_router = Router("home", presence=presence)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await presence.start()
+    await home_router.start()
+    yield
+    await home_router.stop()
+    await presence.stop()
+
+app = FastAPI(lifespan=lifespan)
+metrics.install(app)
+ratelimit.install(app)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
 
 # CORS ayarları - Uygulamanın farklı alanlardan erişimine izin verir
 app.add_middleware(
@@ -16,52 +42,72 @@ app.add_middleware(
     allow_headers=["*"],  # Tüm header'lara izin verir
 )
 
-# Aktif WebSocket bağlantıları, her bir kullanıcıya WebSocket nesnesi
-active_connections: Dict[str, WebSocket] = {}
-
-@app.get("/chats/{username}")
-async def get_chats(username: str):
+@app.get("/chats/{username}", dependencies=[ratelimit.limit("history_user", by="username")])
+async def get_chats(
+    username: str,
+    before_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+):
     """
-    Kullanıcının mesajlaştığı diğer kişilerin listesini döner.
-    Bu API, kullanıcının gönderdiği veya aldığı mesajlara göre sohbet ettiği diğer kullanıcıları getirir.
+    Kullanıcının sohbetlerini son mesaja göre yeniden eskiye sıralı döner.
+    Her sohbet için son mesaj, zamanı, önizlemesi ve okunmamış mesaj sayısı
+    conversations tablosundan okunur (bkz. conversations.py).
+
+    - Parametresiz: tüm sohbetler (eski davranış).
+    - limit / before_id: sayfalı okuma; bir sonraki sayfa için next_before_id döner.
+    "users" alanı eski istemciler için korunur.
     """
     try:
-        # Veritabanı bağlantısı ve cursor
-        db_connection, cursor = get_connection()
-
-        # Kullanıcıya ait sohbetleri sorgula
-        query = """
-        SELECT DISTINCT
-            CASE
-                WHEN sender = %s THEN receiver
-                WHEN receiver = %s THEN sender
-            END AS other_user
-        FROM messages
-        WHERE (sender = %s OR receiver = %s)
-        AND id NOT IN (
-            SELECT message_id FROM deleted_messages WHERE user = %s
-        )
-        """
-        # Parametreleri 4 kez aynı şekilde gönderiyoruz
-        cursor.execute(query, (username, username, username, username, username))
-        results = cursor.fetchall()
-
-        if not results:
+        query = LIST_QUERY
+        params = [username]
+        if before_id is not None:
+            query += " AND last_message_id < %s"
+            params.append(before_id)
+        query += " ORDER BY last_message_id DESC"
+        if limit is None and before_id is not None:
+            limit = DEFAULT_PAGE_SIZE
+        if limit is not None:
+            # Bir fazlası okunur; varsa sonraki sayfa vardır
+            query += " LIMIT %s"
+            params.append(limit + 1)
+
+        rows = await execute_async(query, params, fetch="all")
+
+        if not rows and before_id is None:
             return JSONResponse(status_code=404, content={"message": "Hiç sohbet yok."})
 
-        # Kullanıcıların listesi döndürülür
-        users = [row['other_user'] for row in results]
-        print(f"Kullanıcılar: {users}")
-        
-        return {"users": users}
+        has_more = limit is not None and len(rows) > limit
+        rows = rows[:limit] if limit is not None else rows
+        chats = [{
+            "user": row["peer"],
+            "last_message_id": row["last_message_id"],
+            "timestamp": int(row["last_ts"].timestamp()) if row["last_ts"] else None,
+            "preview": row["preview"],
+            "unread": row["unread"],
+        } for row in rows]
+
+        response = {"users": [chat["user"] for chat in chats], "chats": chats}
+        if limit is not None:
+            response["has_more"] = has_more
+            response["next_before_id"] = chats[-1]["last_message_id"] if has_more else None
+        return response
 
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-    finally:
-        # Bağlantıyı ve cursor'u kapat
-        cursor.close()
-        db_connection.close()
+@app.post("/presence", dependencies=[ratelimit.limit("presence_ip")])
+async def get_presence(payload: dict = Body(...)):
+    """
+    Birden fazla kullanıcının çevrimiçi durumunu tek istekte döner:
+    {"users": ["ali", "ayse"]} -> {"users": {"ali": {"online": true, "last_seen": null}, ...}}
+    """
+    usernames = payload.get("users")
+    if not isinstance(usernames, list) or not all(isinstance(u, str) for u in usernames):
+        return JSONResponse(status_code=400, content={"message": "users bir kullanıcı adı listesi olmalı."})
+    if len(usernames) > MAX_PRESENCE_QUERY:
+        return JSONResponse(status_code=400,
+                            content={"message": f"En fazla {MAX_PRESENCE_QUERY} kullanıcı sorgulanabilir."})
+    return {"users": await presence.query(usernames)}
 
 @app.websocket("/ws/{username}")
 async def websocket_endpoint(websocket: WebSocket, username: str):
@@ -70,28 +116,50 @@ async def websocket_endpoint(websocket: WebSocket, username: str):
     Bu API, kullanıcılar arasında anlık mesajlaşma işlemini WebSocket ile sağlar.
     """
     await websocket.accept()  # WebSocket bağlantısını kabul et
-    active_connections[username] = websocket  # Bağlantıyı aktif bağlantılar listesine ekle
-    print(f"{username} bağlandı.")
+    # Bağlantı fırtınası kayıttan önce kesilir (1013)
+    if not await ratelimit.admit(websocket, "ws_connect_ip", ratelimit.client_ip(websocket)):
+        return
+    connection = await home_router.register(username, websocket)  # Bağlantıyı aktif bağlantılara ekle
+    frames = ratelimit.FrameLimiter(websocket, connection, "home_frame_user", username)
+    metrics.event(logger, "ws_connect", namespace="home", user=username)
 
     try:
         while True:
             data = await websocket.receive_json()  # WebSocket'ten gelen veriyi JSON olarak al
+
+            if data.get("type") == "ping":
+                await connection.send({"type": "pong"})
+                continue
+            # İzleme ve mesaj çerçeveleri Redis'e gider; aşımda atılır
+            if not await frames.admit(data):
+                continue
+
+            # Kişi listesi için çevrimiçi durumu izleme; değişiklikler "presence" çerçevesiyle gelir
+            if data.get("type") == "presence_watch":
+                states = await presence.watch(connection, data.get("users") or [])
+                await connection.send({"type": "presence", "users": states})
+                continue
+            if data.get("type") == "presence_unwatch":
+                await presence.unwatch(connection, data.get("users") or [])
+                continue
+
             sender = data.get("sender")  # Gönderen kullanıcı adı
             receiver = data.get("receiver")  # Alıcı kullanıcı adı
             message = data.get("message")  # Gönderilen mesaj
 
-            # Alıcı aktifse, mesajı alıcıya gönder
-            if receiver in active_connections:
-                await active_connections[receiver].send_json({
-                    "type": "new_message",  # Mesaj türü
-                    "from": sender,         # Gönderen kullanıcı
-                    "message": message      # Mesaj içeriği
-                })
+            # Alıcı herhangi bir worker'da aktifse, mesajı alıcıya gönder
+            await home_router.send(receiver, {
+                "type": "new_message",  # Mesaj türü
+                "from": sender,         # Gönderen kullanıcı
+                "message": message      # Mesaj içeriği
+            })
 
     except WebSocketDisconnect:
-        # Bağlantı koparsa, aktif bağlantılardan çıkar
-        print(f"{username} bağlantısı koptu.")
-        active_connections.pop(username, None)
+        metrics.event(logger, "ws_disconnect", namespace="home", user=username)
+    finally:
+        # Bağlantı koparsa, aktif bağlantılardan ve izlemelerden çıkar
+        await presence.unwatch(connection)
+        await home_router.unregister(username, connection)
 
 # Uvicorn ile uygulamayı başlat
 if __name__ == "__main__":
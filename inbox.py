@@ -0,0 +1,202 @@
+"""
+Çevrimdışıyken gelen mesajların yeniden bağlanınca toplu teslimi.
+
+Alıcı bağlı değilken gönderilen mesajlar `delivered = FALSE` olarak kalır.
+Kullanıcı chat soketine bağlandığında bekleyen mesajlar (receiver, delivered, id)
+indeksinden ID sırasıyla, partiler halinde okunup sokete yazılır. İstemci
+aldığı son ID'yi kümülatif olarak onaylar; onaylanan aralık tek bir UPDATE ile
+iletildi yapılır ve göndericilere mesaj başına değil, gönderici başına tek bir
+"iletildi" bildirimi gider:
+
+    sunucu   -> {"type": "inbox", "messages": [...], "last_id": 812, "more": true}
+    istemci  -> {"type": "inbox_ack", "up_to": 812}
+    gönderen <- {"type": "delivered", "receiver": "ayse", "up_to": 812, "count": 37}
+
+Yalnızca bu çerçeveleri anlayan istemcilere yapılır: bağlantıda ?inbox=1
+gönderenler ya da v2 (MessagePack) alt protokolünü seçenler (bkz. wants_replay).
+Eski istemciler inbox_ack göndermediğinden onlara her bağlantıda aynı partiler
+boşuna yeniden okunup gönderilirdi.
+
+Aynı anda en fazla WINDOW parti onaysız bekler; yavaş istemci bütün kutuyu
+belleğe çektirmez. Bağlantı onaysız koparsa mesajlar bekleyen olarak kalır ve
+bir sonraki bağlantıda yeniden gönderilir; istemci message_id ile tekilleştirir.
+"""
+import asyncio
+import logging
+import os
+
+import metrics
+import protocol
+from connectdb import run_in_db
+
+BATCH_SIZE = int(os.environ.get("GUVERCIN_INBOX_BATCH_SIZE", "200"))
+WINDOW = int(os.environ.get("GUVERCIN_INBOX_WINDOW", "4"))  # onaysız bekleyebilecek parti sayısı
+ACK_TIMEOUT = float(os.environ.get("GUVERCIN_INBOX_ACK_TIMEOUT", "30"))  # saniye
+
+REPLAYED = metrics.Counter("guvercin_inbox_replayed_messages_total", "Yeniden bağlanınca gönderilen mesajlar")
+ACKNOWLEDGED = metrics.Counter("guvercin_inbox_acknowledged_messages_total", "Toplu onayla iletildi yapılan mesajlar")
+
+logger = logging.getLogger(__name__)
+
+def wants_replay(websocket, codec) -> bool:
+    """İstemci inbox/inbox_ack çerçevelerini destekliyor mu."""
+    return codec.name == protocol.MSGPACK_V2 or websocket.query_params.get("inbox") == "1"
+
+
+# Alıcının sildiği mesajlar gönderilmez (yine de onayla iletildi yapılır)
+_PENDING_QUERY = """
+    SELECT m.id, m.sender, m.receiver, m.type, m.content, m.file_url, m.file_name, m.mime_type, m.timestamp
+    FROM messages m
+    LEFT JOIN deleted_messages d ON d.message_id = m.id AND d.user = m.receiver
+    WHERE m.receiver = %s AND m.delivered = FALSE AND m.id > %s
+      AND d.message_id IS NULL
+    ORDER BY m.id
+    LIMIT %s
+"""
+
+
+def fetch_pending(conn, cursor, receiver: str, after_id: int, limit: int) -> list:
+    cursor.execute(_PENDING_QUERY, (receiver, after_id, limit))
+    return cursor.fetchall()
+
+
+def acknowledge(conn, cursor, receiver: str, up_to: int) -> list:
+    """
+    receiver'ın up_to'ya kadar bekleyen mesajlarını iletildi yapar.
+    Gönderici başına (sender, count, up_to) satırlarını döner.
+    """
+    cursor.execute("""
+        SELECT sender, COUNT(*) AS count, MAX(id) AS up_to FROM messages
+        WHERE receiver = %s AND delivered = FALSE AND id <= %s
+        GROUP BY sender
+    """, (receiver, up_to))
+    senders = cursor.fetchall()
+    if senders:
+        cursor.execute(
+            "UPDATE messages SET delivered = TRUE WHERE receiver = %s AND delivered = FALSE AND id <= %s",
+            (receiver, up_to)
+        )
+        conn.commit()
+    return senders
+
+
+def _message_payload(row: dict) -> dict:
+    # Canlı mesaj çerçeveleriyle aynı alan adları; istemci aynı işleyiciyi kullanır
+    return {
+        "message_id": row["id"],
+        "sender": row["sender"],
+        "receiver": row["receiver"],
+        "type": row["type"],
+        "message": row["content"],
+        "file_url": row["file_url"],
+        "file_name": row["file_name"],
+        "mime_type": row["mime_type"],
+        "timestamp": int(row["timestamp"].timestamp()) if row["timestamp"] else None,
+        "status": "sent",
+        "delivered": True,
+        "seen": False,
+    }
+
+
+class InboxReplay:
+    """
+    Tek bir chat bağlantısı için bekleyen mesajların gönderimi.
+    Bağlantı router'a kaydedildikten sonra başlatılmalıdır; böylece bu arada
+    gelen yeni mesajlar canlı yoldan iletilir.
+
+    on_acknowledged(senders): acknowledge() sonucuyla çağrılır.
+    """
+
+    def __init__(self, connection, username: str, on_acknowledged=None,
+                 batch_size=BATCH_SIZE, window=WINDOW, ack_timeout=ACK_TIMEOUT):
+        self.connection = connection
+        self.username = username
+        self.on_acknowledged = on_acknowledged
+        self.batch_size = batch_size
+        self.window = window
+        self.ack_timeout = ack_timeout
+        self.sent_up_to = 0
+        self.acked = 0
+        self._committed = 0
+        self._batches = []  # onaysız partilerin last_id değerleri
+        self._ack_event = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Bağlantı kapanırken: gönderimi durdurur, onaylanmış kısmı kaydeder."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self._commit()
+        except Exception:
+            logger.exception("%s için teslim onayı kaydedilemedi", self.username)
+
+    def ack(self, up_to: int):
+        # Gönderilmemiş mesajlar onaylanamaz
+        up_to = min(up_to, self.sent_up_to)
+        if up_to > self.acked:
+            self.acked = up_to
+            self._ack_event.set()
+
+    async def _wait_for_ack(self, up_to: int) -> bool:
+        while self.acked < up_to:
+            self._ack_event.clear()
+            try:
+                await asyncio.wait_for(self._ack_event.wait(), self.ack_timeout)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    async def _run(self):
+        try:
+            while True:
+                rows = await run_in_db(fetch_pending, self.username, self.sent_up_to, self.batch_size + 1)
+                more = len(rows) > self.batch_size
+                rows = rows[:self.batch_size]
+                if not rows:
+                    break
+                last_id = rows[-1]["id"]
+                payload = {
+                    "type": "inbox",
+                    "messages": [_message_payload(row) for row in rows],
+                    "last_id": last_id,
+                    "more": more,
+                }
+                if not await self.connection.send(payload):
+                    break
+                REPLAYED.inc(len(rows))
+                self.sent_up_to = last_id
+                self._batches.append(last_id)
+                if not more:
+                    break
+                if len(self._batches) >= self.window:
+                    # Pencere dolu: en eski partinin onayını bekle
+                    if not await self._wait_for_ack(self._batches[0]):
+                        return
+                    self._batches = [batch for batch in self._batches if batch > self.acked]
+
+            # Son onay gelince tek UPDATE ile kaydedilir
+            if self.sent_up_to and await self._wait_for_ack(self.sent_up_to):
+                await self._commit()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("%s için bekleyen mesajlar gönderilemedi", self.username)
+
+    async def _commit(self):
+        up_to = self.acked
+        if up_to <= self._committed:
+            return
+        self._committed = up_to
+        senders = await run_in_db(acknowledge, self.username, up_to)
+        ACKNOWLEDGED.inc(sum(row["count"] for row in senders))
+        if senders and self.on_acknowledged:
+            await self.on_acknowledged(senders)
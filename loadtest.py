@@ -0,0 +1,369 @@
+"""
+Uçtan uca yük testi.
+
+Servisleri yerel Redis ve MySQL'e karşı başlatır, FCM'i sahte adrese yönlendirir
+(fake_fcm.py) ve binlerce WebSocket istemcisi çalıştırır. Her istemci kayıt
+olur, giriş yapar, eşine metin ve dosya mesajları gönderir, aldığı mesajlar
+için okundu bilgisi yollar ve sohbet listesini yükler. Sonunda:
+
+    - saniyedeki teslim edilen mesaj sayısı,
+    - uçtan uca teslim gecikmesi (p50/p95/p99),
+    - mesaj başına veritabanı sorgusu (SHOW GLOBAL STATUS 'Questions' farkı),
+    - bağlantı başına bellek (sunucu süreçlerinin RSS farkı)
+
+raporlanır ve karşılaştırma için JSON'a yazılır:
+
+    python3 migrations.py
+    python3 loadtest.py --users 2000 --messages 20 --output runs/$(git rev-parse --short HEAD).json
+    python3 loadtest.py --mode services --users 500      # servisler ayrı portlarda
+
+Redis ve MySQL adresleri servislerin kendi ortam değişkenleriyle verilir
+(GUVERCIN_REDIS_URL, GUVERCIN_DB_*). Çok sayıda istemci için `ulimit -n`
+yükseltilmelidir. Sorgu sayısı sunucu genelidir; test sırasında başka trafik
+olmamalıdır.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+import websockets
+
+# --mode services: script -> port
+SERVICES = {
+    "register": ("register.py", 5000),
+    "login": ("login.py", 5001),
+    "home": ("home.py", 5002),
+    "search": ("search.py", 5003),
+    "chat": ("chat.py", 5004),
+}
+FAKE_FCM_PORT = 5099
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class Stack:
+    """Test edilen servis süreçleri."""
+
+    def __init__(self, mode: str, port: int, workers: int):
+        self.mode = mode
+        self.port = port
+        self.workers = workers
+        self.processes = []
+        self.files_path = tempfile.mkdtemp(prefix="guvercin-loadtest-")
+
+    def url(self, service: str) -> str:
+        if self.mode == "gateway":
+            return f"http://localhost:{self.port}"
+        return f"http://localhost:{SERVICES[service][1]}"
+
+    def ws_url(self, path: str) -> str:
+        return self.url("chat").replace("http://", "ws://") + path
+
+    def _spawn(self, args, env):
+        process = subprocess.Popen([sys.executable, *args], cwd=HERE, env=env)
+        self.processes.append(process)
+        return process
+
+    async def start(self):
+        env = dict(os.environ)
+        env.update({
+            "GUVERCIN_FCM_TRANSPORT": "http",
+            "GUVERCIN_FCM_ENDPOINT": f"http://localhost:{FAKE_FCM_PORT}/send",
+            "GUVERCIN_FILES_PATH": self.files_path,
+            "GUVERCIN_WORKERS": str(self.workers),
+            "GUVERCIN_PORT": str(self.port),
+        })
+        # Tüm servisler aynı anahtarla imzalayıp doğrulamalı
+        env.setdefault("GUVERCIN_JWT_KEYS", f"loadtest:{uuid.uuid4().hex}")
+
+        self._spawn(["fake_fcm.py"], env)
+        if self.mode == "gateway":
+            self._spawn(["server.py"], env)
+        else:
+            for script, _ in SERVICES.values():
+                self._spawn([script], env)
+
+        targets = [f"http://localhost:{FAKE_FCM_PORT}/stats"]
+        if self.mode == "gateway":
+            targets.append(f"http://localhost:{self.port}/healthz")
+        else:
+            targets += [f"http://localhost:{port}/docs" for _, port in SERVICES.values()]
+        await wait_until_up(targets)
+
+    def pids(self) -> list:
+        # server.py worker'ları gözetmenin çocuklarıdır; fake_fcm hariç
+        pids = []
+        for process in self.processes[1:]:
+            pids.append(process.pid)
+            pids.extend(children(process.pid))
+        return pids
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+async def wait_until_up(urls, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        for url in urls:
+            while True:
+                try:
+                    await client.get(url)
+                    break
+                except httpx.HTTPError:
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(f"Servis açılmadı: {url}")
+                    await asyncio.sleep(0.5)
+
+
+def children(pid: int) -> list:
+    result = []
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            for child in f.read().split():
+                result.append(int(child))
+                result.extend(children(int(child)))
+    except FileNotFoundError:
+        pass
+    return result
+
+
+def rss_bytes(pids) -> int:
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except FileNotFoundError:
+            pass
+    return total
+
+
+def mysql_questions():
+    """Sunucunun şimdiye kadar aldığı sorgu sayısı; MySQL'e erişilemezse None."""
+    try:
+        import mysql.connector
+        from connectdb import db_config
+        conn = mysql.connector.connect(**db_config)
+        cursor = conn.cursor()
+        cursor.execute("SHOW GLOBAL STATUS LIKE 'Questions'")
+        value = int(cursor.fetchone()[1])
+        cursor.close()
+        conn.close()
+        return value
+    except Exception as e:
+        print(f"MySQL sorgu sayısı okunamadı: {e}")
+        return None
+
+
+class Stats:
+    def __init__(self):
+        self.sent = 0
+        self.delivered = 0
+        self.latencies = []
+        self.seen_receipts = 0
+        self.chat_lists = 0
+        self.errors = 0
+
+
+class Client:
+    def __init__(self, username: str, stack: Stack, stats: Stats):
+        self.username = username
+        self.stack = stack
+        self.stats = stats
+        self.chat = None
+        self.seen = None
+        self.tasks = []
+        self.received = 0
+
+    async def signup(self, http: httpx.AsyncClient):
+        await http.post(self.stack.url("register") + "/register", json={
+            "username": self.username, "password": "loadtest", "fcm": f"fcm-{self.username}",
+            "public_key": "loadtest"})
+        response = await http.post(self.stack.url("login") + "/login", json={
+            "username": self.username, "password": "loadtest", "device": "loadtest"})
+        response.raise_for_status()
+
+    async def connect(self):
+        self.chat = await websockets.connect(self.stack.ws_url(f"/ws/{self.username}?inbox=1"), max_size=None)
+        self.seen = await websockets.connect(self.stack.ws_url(f"/ws/{self.username}/seen"))
+        self.tasks = [asyncio.create_task(self._read_chat()), asyncio.create_task(self._read_seen())]
+
+    async def _read_chat(self):
+        async for frame in self.chat:
+            data = json.loads(frame)
+            if data.get("type") == "inbox":
+                # Önceki turdan kalan bekleyen mesajlar; yalnızca onaylanır
+                await self.chat.send(json.dumps({"type": "inbox_ack", "up_to": data["last_id"]}))
+                continue
+            if data.get("status") != "sent" or data.get("receiver") != self.username:
+                continue  # yankı ya da onay çerçevesi
+            self.stats.delivered += 1
+            self.stats.latencies.append(time.perf_counter() - data["client_ts"])
+            self.received += 1
+            # Okundu bilgisi aralık olarak, birkaç mesajda bir gönderilir
+            if self.received % 5 == 0:
+                await self.seen.send(json.dumps({"peer": data["sender"], "up_to": data["message_id"]}))
+
+    async def _read_seen(self):
+        async for _ in self.seen:
+            self.stats.seen_receipts += 1
+
+    async def load_chat_list(self, http: httpx.AsyncClient):
+        response = await http.get(self.stack.url("home") + f"/chats/{self.username}", params={"limit": 20})
+        if response.status_code in (200, 404):
+            self.stats.chat_lists += 1
+        else:
+            self.stats.errors += 1
+
+    async def send_messages(self, peer: str, count: int, interval: float, file_every: int, file_size: int):
+        payload = os.urandom(file_size)
+        for i in range(count):
+            message = {"sender": self.username, "receiver": peer, "client_ts": time.perf_counter()}
+            if file_every and i % file_every == file_every - 1:
+                message.update({"type": "file", "file_name": f"{uuid.uuid4().hex}.bin",
+                                "mime_type": "application/octet-stream"})
+                await self.chat.send(json.dumps(message))
+                await self.chat.send(payload)
+            else:
+                message.update({"type": "text", "message": f"yük testi mesajı {i}"})
+                await self.chat.send(json.dumps(message))
+            self.stats.sent += 1
+            await asyncio.sleep(interval * random.uniform(0.5, 1.5))
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        for socket in (self.chat, self.seen):
+            if socket is not None:
+                await socket.close()
+
+
+async def gather_limited(coroutines, limit: int):
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+    return await asyncio.gather(*(run(c) for c in coroutines))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] if values else None
+
+
+async def run(args):
+    stack = Stack(args.mode, args.port, args.workers)
+    stats = Stats()
+    run_id = uuid.uuid4().hex[:8]
+    users = [f"lt{run_id}_{i}" for i in range(args.users - args.users % 2)]
+    clients = [Client(name, stack, stats) for name in users]
+
+    await stack.start()
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=60) as http:
+            print(f"{len(clients)} kullanıcı kaydediliyor...")
+            await gather_limited([c.signup(http) for c in clients], args.concurrency)
+
+            rss_before = rss_bytes(stack.pids())
+            print("WebSocket bağlantıları açılıyor...")
+            await gather_limited([c.connect() for c in clients], args.concurrency)
+            await asyncio.sleep(1)
+            rss_after = rss_bytes(stack.pids())
+
+            questions_before = mysql_questions()
+            print("Mesajlaşma başladı...")
+            start = time.perf_counter()
+            # Her istemci bir eşle konuşur: (0,1), (2,3), ...
+            await asyncio.gather(*(
+                c.send_messages(users[i ^ 1], args.messages, args.interval, args.file_every, args.file_size)
+                for i, c in enumerate(clients)
+            ))
+            deadline = time.monotonic() + args.drain_timeout
+            while stats.delivered < stats.sent and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+            elapsed = time.perf_counter() - start
+            await asyncio.gather(*(c.load_chat_list(http) for c in clients))
+            questions_after = mysql_questions()
+
+            try:
+                fcm = (await http.get(f"http://localhost:{FAKE_FCM_PORT}/stats")).json()
+            except httpx.HTTPError:
+                fcm = None
+
+        for c in clients:
+            await c.close()
+    finally:
+        stack.stop()
+
+    connections = len(clients) * 2
+    result = {
+        "config": vars(args),
+        "commit": subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                                 capture_output=True, text=True).stdout.strip(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "messages_sent": stats.sent,
+        "messages_delivered": stats.delivered,
+        "msgs_per_sec": stats.delivered / elapsed if elapsed else 0,
+        "latency_ms": {
+            name: round(percentile(stats.latencies, q) * 1000, 2) if stats.latencies else None
+            for name, q in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))
+        },
+        "db_queries_per_message": (
+            (questions_after - questions_before) / stats.sent
+            if questions_before is not None and questions_after is not None and stats.sent else None
+        ),
+        "rss_per_connection_kb": round((rss_after - rss_before) / connections / 1024, 1),
+        "seen_receipts": stats.seen_receipts,
+        "chat_lists": stats.chat_lists,
+        "errors": stats.errors,
+        "fcm": fcm,
+    }
+    if stats.latencies:
+        result["latency_ms"]["mean"] = round(statistics.mean(stats.latencies) * 1000, 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["gateway", "services"], default="gateway")
+    parser.add_argument("--port", type=int, default=8000, help="gateway modunda server.py portu")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=20, help="Kullanıcı başına mesaj")
+    parser.add_argument("--interval", type=float, default=0.1, help="Mesajlar arası ortalama bekleme (sn)")
+    parser.add_argument("--file-every", type=int, default=10, help="Her N mesajdan biri dosya (0: hiç)")
+    parser.add_argument("--file-size", type=int, default=32 * 1024)
+    parser.add_argument("--concurrency", type=int, default=100, help="Eşzamanlı kayıt/bağlantı sayısı")
+    parser.add_argument("--drain-timeout", type=float, default=30)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps({k: v for k, v in result.items() if k != "config"}, indent=2, ensure_ascii=False))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,84 +1,142 @@
-from flask import Flask, request, jsonify
-import redis
+from fastapi import FastAPI, Body
+from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+import asyncio
 import jwt
-import secrets
+import uvicorn
 from datetime import datetime, timedelta, timezone
 
-app = Flask(__name__)
+import metrics
+import ratelimit
+import redisdb
+import sessions
+import passwords
 
-# Redis bağlantısı
-r = redis.StrictRedis(host='localhost', port=6379, decode_responses=True)
+# Paylaşılan async Redis havuzu
+r = redisdb.client
 
-# JWT için Secret Key
-SECRET_KEY = secrets.token_hex(32)
-print(f"SECRET_KEY: {SECRET_KEY}")
+# Doğrulanmış oturumların süreç içi önbelleği; iptaller tüm worker'lara Redis ile iletilir
+session_cache = sessions.SessionCache()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    listener = asyncio.create_task(sessions.listen_revocations(r, session_cache))
+    yield
+    listener.cancel()
+    try:
+        await listener
+    except asyncio.CancelledError:
+        pass
+
+app = FastAPI(lifespan=lifespan)
+metrics.install(app)
+ratelimit.install(app)
 
 # Kullanıcı giriş endpoint'i
-@app.route('/login', methods=['POST'])
-def login():
-    data = request.get_json()
+@app.post("/login", dependencies=[ratelimit.limit("login_ip")])
+async def login(data: dict = Body(...)):
     username = data.get('username')
     password = data.get('password')
     device_name = data.get('device')
 
     if not username or not password:
-        return jsonify({'error': 'Kullanıcı adı ve şifre gereklidir!'}), 400
+        return JSONResponse(status_code=400, content={'error': 'Kullanıcı adı ve şifre gereklidir!'})
+
+    # Hesap başına deneme sınırı; parola denemeleri IP değiştirerek de yavaşlar.
+    # Yalnızca başarısız denemeler harcar, doğru parolayla sık giriş kilitlenmez.
+    await ratelimit.ensure_available('login_user', username)
 
     # Redis'teki kullanıcıyı kontrol et
     user_key = f"user:{username}"
-    stored_user = r.hgetall(user_key)
+    stored_user = await r.hgetall(user_key)
 
     if not stored_user:
-        return jsonify({'error': 'Kullanıcı bulunamadı!'}), 404
-
-    if stored_user.get('password') != password:
-        return jsonify({'error': 'Kullanıcı adı veya şifre hatalı!'}), 401
-
-    # JWT token oluştur
-    token = jwt.encode(
-        {
-            'username': username,
-            'device': device_name,
-            'exp': datetime.now(timezone.utc) + timedelta(days=7)  # Token geçerlilik süresi: 7 gün
-        },
-        SECRET_KEY,
-        algorithm='HS256'
-    )
+        await ratelimit.charge('login_user', username)
+        return JSONResponse(status_code=404, content={'error': 'Kullanıcı bulunamadı!'})
 
+    # Parola doğrulaması süreç havuzunda yapılır
+    try:
+        valid, new_hash = await passwords.verify_password(stored_user.get('password'), password)
+    except passwords.Overloaded:
+        return JSONResponse(status_code=503, content={'error': 'Sunucu yoğun, lütfen tekrar deneyin.'})
+
+    if not valid:
+        await ratelimit.charge('login_user', username)
+        return JSONResponse(status_code=401, content={'error': 'Kullanıcı adı veya şifre hatalı!'})
+
+    # JWT token oluştur (yapılandırmadaki aktif anahtarla, kid başlığıyla)
+    token = sessions.sign({
+        'username': username,
+        'device': device_name,
+        'exp': datetime.now(timezone.utc) + timedelta(days=7)  # Token geçerlilik süresi: 7 gün
+    })
+
+    # Oturum kaydı, parola güncellemesi ve iptal bildirimi tek gidiş-dönüşte
+    pipe = r.pipeline(transaction=False)
+    # Düz metin ya da eski ayarlarla özetlenmiş parolayı güncelle
+    if new_hash:
+        pipe.hset(user_key, 'password', new_hash)
     # Redis'te oturumu sakla
-    session_key = f"session:{username}"
-    r.set(session_key, token)
-    r.expire(session_key, 7 * 24 * 60 * 60)  # 7 gün TTL
+    pipe.set(f"session:{username}", token, ex=7 * 24 * 60 * 60)  # 7 gün TTL
+    # Önceki token artık geçersiz; tüm worker'lar önbelleklerinden düşürsün
+    pipe.publish(sessions.REVOCATION_CHANNEL, username)
+    await pipe.execute()
 
-    return jsonify({'message': 'Giriş başarılı!', 'token': token}), 201
+    return JSONResponse(status_code=201, content={'message': 'Giriş başarılı!', 'token': token})
 
 # Oturum doğrulama endpoint'i
-@app.route('/check-session', methods=['POST'])
-def check_session():
-    data = request.get_json()
+@app.post("/check-session", dependencies=[ratelimit.limit("session_ip")])
+async def check_session(data: dict = Body(...)):
     token = data.get('token')
 
     if not token:
-        return jsonify({'error': 'Token eksik!'}), 400
+        return JSONResponse(status_code=400, content={'error': 'Token eksik!'})
+
+    # Yakın zamanda doğrulanmış token'lar için Redis'e gidilmez
+    username = session_cache.get(token)
+    if username:
+        return {'valid': True, 'message': 'Oturum geçerli!', 'username': username}
 
     try:
         # Token doğrula
-        decoded = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        decoded = sessions.verify(token)
         username = decoded.get('username')
 
-        # Redis'teki oturumu kontrol et
+        # Redis'teki oturumu kontrol et; okuma sırasında gelen iptal önbelleğe yazmayı engeller
+        generation = session_cache.generation(username)
         session_key = f"session:{username}"
-        stored_token = r.get(session_key)
+        stored_token = await r.get(session_key)
 
         if not stored_token or stored_token != token:
-            return jsonify({'valid': False, 'message': 'Oturum geçersiz!'}), 401
+            return JSONResponse(status_code=401, content={'valid': False, 'message': 'Oturum geçersiz!'})
 
-        return jsonify({'valid': True, 'message': 'Oturum geçerli!', 'username': username}), 200
+        session_cache.put(token, username, decoded['exp'], generation)
+        return {'valid': True, 'message': 'Oturum geçerli!', 'username': username}
     except jwt.ExpiredSignatureError:
-        return jsonify({'valid': False, 'message': 'Token süresi dolmuş!'}), 401
+        return JSONResponse(status_code=401, content={'valid': False, 'message': 'Token süresi dolmuş!'})
     except jwt.InvalidTokenError:
-        return jsonify({'valid': False, 'message': 'Geçersiz token!'}), 401
+        return JSONResponse(status_code=401, content={'valid': False, 'message': 'Geçersiz token!'})
 
-if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001)
+# Oturumu kapatma endpoint'i
+@app.post("/logout", dependencies=[ratelimit.limit("session_ip")])
+async def logout(data: dict = Body(...)):
+    token = data.get('token')
 
+    if not token:
+        return JSONResponse(status_code=400, content={'error': 'Token eksik!'})
+
+    try:
+        username = sessions.verify(token).get('username')
+    except jwt.InvalidTokenError:
+        return JSONResponse(status_code=401, content={'error': 'Geçersiz token!'})
+
+    # Yalnızca bu token hâlâ aktif oturumsa sil
+    session_key = f"session:{username}"
+    if await r.get(session_key) == token:
+        await r.delete(session_key)
+    await sessions.publish_revocation(r, username)
+
+    return {'message': 'Çıkış yapıldı.'}
+
+if __name__ == '__main__':
+    uvicorn.run(app, host='0.0.0.0', port=5001)
@@ -0,0 +1,261 @@
+"""
+Mesaj kalıcılığı için toplu yazma (group commit) hattı.
+
+WebSocket handler'ları her mesaj için ayrı INSERT + commit yapmak yerine
+satırları bu kuyruğa bırakır. Arka plandaki yazıcı biriken işleri tek bir
+işlemde (transaction) yazar:
+
+    - mesajlar çok satırlı INSERT ile,
+    - delivered / seen güncellemeleri `UPDATE ... WHERE id IN (...)` ile,
+    - "şu mesaja kadar okundu" aralıkları konuşma başına tek UPDATE ile,
+    - sohbet listesi (conversations) ve eklerin referans sayıları aynı transaction içinde,
+    - hepsi için tek commit.
+
+Bir toplu yazma sürerken gelen işler bir sonrakine eklenir; böylece yük
+arttıkça commit başına yazılan satır sayısı da artar.
+
+Dayanıklılık modları (GUVERCIN_WRITE_DURABILITY):
+    commit  : message_id, mesajın bulunduğu grup commit edildikten sonra döner (varsayılan)
+    relaxed : message_id, INSERT çalışır çalışmaz döner; commit hemen ardından yapılır.
+              Commit başarısız olursa gönderene dönmüş ID'ler kalıcı olmayabilir.
+"""
+import asyncio
+import logging
+import os
+
+import attachments
+import conversations
+from connectdb import run_in_db
+
+BATCH_SIZE = int(os.environ.get("GUVERCIN_WRITE_BATCH_SIZE", "200"))
+FLUSH_INTERVAL = float(os.environ.get("GUVERCIN_WRITE_FLUSH_INTERVAL", "0.002"))  # saniye
+DURABILITY = os.environ.get("GUVERCIN_WRITE_DURABILITY", "commit")
+RETRY_DELAY = 0.5  # saniye; başarısız gruptan sonra
+
+MESSAGE_COLUMNS = ("sender", "receiver", "type", "content", "file_url", "file_name", "mime_type", "timestamp",
+                   "attachment")
+_ROW_PLACEHOLDERS = f"({', '.join(['%s'] * len(MESSAGE_COLUMNS))}, FALSE, FALSE)"
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriter:
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, durability=DURABILITY):
+        if durability not in ("commit", "relaxed"):
+            raise ValueError(f"Geçersiz dayanıklılık modu: {durability}")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self._inserts = []
+        self._delivered = set()
+        # (mesaj, okuyan) -> durum; okuyanın alıcı olduğu doğrulanınca göndericiyi bekleyenler
+        self._seen = {}
+        self._seen_waiters = {}
+        self._seen_ranges = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._loop = None
+        # innodb_autoinc_lock_mode 0/1 ise çok satırlı INSERT ardışık ID üretir
+        self._multi_row = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._multi_row = await run_in_db(self._detect_multi_row)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._has_pending():
+            await self.flush()
+
+    async def insert_message(self, row: tuple) -> int:
+        """
+        MESSAGE_COLUMNS sırasındaki satırı kuyruğa ekler, mesaj ID'sini döner.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._inserts.append((row, future))
+        self._wakeup.set()
+        return await future
+
+    def mark_delivered(self, message_id: int):
+        self._delivered.add(message_id)
+        self._wakeup.set()
+
+    def mark_seen(self, message_id: int, seen: bool, receiver: str) -> asyncio.Future:
+        """
+        receiver'a gelen mesajın okundu durumunu kuyruğa ekler. Dönen future,
+        grup commit edildikten sonra mesajın göndericisiyle (mesaj receiver'ın
+        değilse None) tamamlanır.
+        """
+        key = (message_id, receiver)
+        self._seen[key] = bool(seen)
+        future = asyncio.get_running_loop().create_future()
+        self._seen_waiters.setdefault(key, []).append(future)
+        self._wakeup.set()
+        return future
+
+    def mark_seen_up_to(self, sender: str, receiver: str, up_to: int):
+        """
+        sender'ın receiver'a gönderdiği, ID'si up_to'ya kadar olan mesajları okundu yapar.
+        Aynı konuşma için biriken aralıklar en büyük ID'de birleştirilir.
+        """
+        key = (sender, receiver)
+        if up_to > self._seen_ranges.get(key, 0):
+            self._seen_ranges[key] = up_to
+        self._wakeup.set()
+
+    def _has_pending(self):
+        return bool(self._inserts or self._delivered or self._seen or self._seen_ranges)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Küçük gruplar için kısa bir süre daha bekle, büyük grupları hemen yaz
+            if self.flush_interval and len(self._inserts) < self.batch_size:
+                await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Toplu mesaj yazımı başarısız")
+                # Geri konan güncellemeler veritabanı düzelene kadar sıkı döngüde denenmesin
+                await asyncio.sleep(RETRY_DELAY)
+            if self._has_pending():
+                self._wakeup.set()
+
+    async def flush(self):
+        inserts = self._inserts[:self.batch_size]
+        del self._inserts[:self.batch_size]
+        delivered, self._delivered = self._delivered, set()
+        seen, self._seen = self._seen, {}
+        seen_waiters, self._seen_waiters = self._seen_waiters, {}
+        seen_ranges, self._seen_ranges = self._seen_ranges, {}
+        if not (inserts or delivered or seen or seen_ranges):
+            return
+
+        try:
+            ids, senders = await run_in_db(self._write_batch, [row for row, _ in inserts], delivered, seen,
+                                           seen_ranges, [future for _, future in inserts])
+        except Exception as e:
+            for _, future in inserts:
+                if not future.done():
+                    future.set_exception(e)
+            # Güncellemeler kaybolmasın: bir sonraki grupta yeniden denenir
+            self._requeue(delivered, seen, seen_waiters, seen_ranges)
+            raise
+
+        for (_, future), message_id in zip(inserts, ids):
+            if not future.done():
+                future.set_result(message_id)
+        for key, futures in seen_waiters.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(senders.get(key))
+
+    def _requeue(self, delivered, seen, seen_waiters, seen_ranges):
+        self._delivered |= delivered
+        # Bu arada gelen daha yeni okundu durumu geçerli kalır
+        self._seen = {**seen, **self._seen}
+        for key, futures in seen_waiters.items():
+            self._seen_waiters.setdefault(key, [])[:0] = futures
+        for key, up_to in seen_ranges.items():
+            self._seen_ranges[key] = max(up_to, self._seen_ranges.get(key, 0))
+
+    @staticmethod
+    def _detect_multi_row(conn, cursor):
+        try:
+            cursor.execute("SELECT @@innodb_autoinc_lock_mode AS mode")
+            row = cursor.fetchone()
+            return row is not None and int(row["mode"]) in (0, 1)
+        except Exception:
+            return False
+
+    def _insert_rows(self, cursor, rows):
+        if self._multi_row and len(rows) > 1:
+            placeholders = ", ".join([_ROW_PLACEHOLDERS] * len(rows))
+            params = [value for row in rows for value in row]
+            cursor.execute(
+                f"INSERT INTO messages ({', '.join(MESSAGE_COLUMNS)}, delivered, seen) VALUES {placeholders}",
+                params
+            )
+            first_id = cursor.lastrowid
+            return [first_id + i for i in range(len(rows))]
+
+        ids = []
+        for row in rows:
+            cursor.execute(
+                f"INSERT INTO messages ({', '.join(MESSAGE_COLUMNS)}, delivered, seen) VALUES {_ROW_PLACEHOLDERS}",
+                row
+            )
+            ids.append(cursor.lastrowid)
+        return ids
+
+    def _write_batch(self, conn, cursor, rows, delivered, seen, seen_ranges, futures):
+        ids = self._insert_rows(cursor, rows) if rows else []
+        if rows:
+            conversations.record_messages(cursor, rows, ids)
+            attachments.add_references(cursor, [row[MESSAGE_COLUMNS.index("attachment")] for row in rows])
+
+        if self.durability == "relaxed":
+            for future, message_id in zip(futures, ids):
+                self._loop.call_soon_threadsafe(_resolve, future, message_id)
+
+        if delivered:
+            id_list = sorted(delivered)
+            cursor.execute(
+                f"UPDATE messages SET delivered = TRUE WHERE id IN ({', '.join(['%s'] * len(id_list))})",
+                id_list
+            )
+
+        # Okundu bilgisi yalnızca okuyanın alıcısı olduğu mesajlara yazılır; göndericiler
+        # okuyan başına tek sorguyla bulunur ve bildirim bunlara gider
+        senders = {}
+        by_receiver = {}
+        for message_id, receiver in seen:
+            by_receiver.setdefault(receiver, []).append(message_id)
+        for receiver, id_list in sorted(by_receiver.items()):
+            id_list.sort()
+            cursor.execute(
+                f"SELECT id, sender FROM messages WHERE id IN ({', '.join(['%s'] * len(id_list))}) AND receiver = %s",
+                [*id_list, receiver]
+            )
+            for row in cursor.fetchall():
+                senders[(row["id"], receiver)] = row["sender"]
+
+        for status in (True, False):
+            id_list = sorted(message_id for (message_id, receiver), value in seen.items()
+                             if value is status and (message_id, receiver) in senders)
+            if id_list:
+                cursor.execute(
+                    f"UPDATE messages SET seen = %s WHERE id IN ({', '.join(['%s'] * len(id_list))})",
+                    [status, *id_list]
+                )
+
+        for (sender, receiver), up_to in seen_ranges.items():
+            cursor.execute(
+                "UPDATE messages SET seen = TRUE WHERE sender = %s AND receiver = %s AND id <= %s AND seen = FALSE",
+                (sender, receiver, up_to)
+            )
+
+        # Okundu durumu değişen konuşmaların okunmamış sayıları
+        if seen or seen_ranges:
+            pairs = {(receiver, sender) for (_, receiver), sender in senders.items()}
+            pairs.update((receiver, sender) for sender, receiver in seen_ranges)
+            conversations.recount_unread(cursor, pairs)
+
+        conn.commit()
+        return ids, senders
+
+
+def _resolve(future, message_id):
+    if not future.done():
+        future.set_result(message_id)
+
+
+writer = MessageWriter()
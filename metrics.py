@@ -0,0 +1,264 @@
+"""
+Servisler için ortak ölçüm (metrics) modülü.
+
+Sayaçlar süreç içinde tutulur ve her serviste /metrics adresinden Prometheus
+metin biçiminde sunulur. Çok süreçli çalışmada (server.py) her worker kendi
+değerlerini döner; Prometheus'ta worker'lar instance etiketiyle ayrılır.
+
+Mesaj yolunda maliyet düşük tutulur: etiketli alt ölçümler bir kez oluşturulup
+önbelleğe alınır, gözlem yalnızca birkaç toplama ve bir kilit alma işidir.
+
+    install(app)                  # route süreleri + /metrics
+    install(app, instrument=False)  # yalnızca /metrics (ağ geçidi)
+
+event(logger, "ws_connect", user=...) her satırı değil, GUVERCIN_LOG_SAMPLE_RATE
+oranında örneklenmiş "ad anahtar=değer" satırlarını yazar.
+"""
+import abc
+import asyncio
+import bisect
+import os
+import random
+import threading
+import time
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+
+LOG_SAMPLE_RATE = float(os.environ.get("GUVERCIN_LOG_SAMPLE_RATE", "0.01"))
+LOOP_LAG_INTERVAL = 0.5  # saniye
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class _Metric(abc.ABC):
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._child())
+        return child
+
+    @abc.abstractmethod
+    def _child(self):
+        """Etiket değerleri başına bir alt ölçüm üretir."""
+
+    # Etiketsiz ölçümler doğrudan kullanılabilir
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.labels(), name)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(child.render(self.name, _format_labels(self.labelnames, values)))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labels):
+        return [f"{name}{labels} {self.value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _child(self):
+        return _CounterChild()
+
+
+class _GaugeChild(_CounterChild):
+    def __init__(self):
+        super().__init__()
+        self._function = None
+
+    def set(self, value: float):
+        # inc/dec ile aynı kilit; eşzamanlı artırma yazılan değeri ezmesin
+        with self._lock:
+            self.value = value
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        """Değer her okunmada function() ile hesaplanır."""
+        self._function = function
+
+    def render(self, name, labels):
+        value = self._function() if self._function else self.value
+        return [f"{name}{labels} {value}"]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _child(self):
+        return _GaugeChild()
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def render(self, name, labels):
+        inner = labels[1:-1] + "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{inner}le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{labels} {self.sum}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _child(self):
+        return _HistogramChild(self.buckets)
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- ortak ölçümler ---
+
+HTTP_LATENCY = Histogram("guvercin_http_request_seconds", "HTTP istek süresi", ("route", "method", "status"))
+DB_QUERY_LATENCY = Histogram("guvercin_db_query_seconds", "MySQL işlem süresi", ("operation",))
+DB_POOL_WAIT = Histogram("guvercin_db_pool_wait_seconds", "Havuzdan bağlantı alma süresi")
+DB_CONNECTIONS_OPENED = Counter("guvercin_db_connections_opened_total", "Açılan MySQL bağlantıları")
+REDIS_LATENCY = Histogram("guvercin_redis_command_seconds", "Redis komut süresi", ("command",))
+WS_CONNECTIONS = Gauge("guvercin_ws_connections", "Aktif WebSocket bağlantıları", ("namespace",))
+WS_MESSAGES = Counter("guvercin_ws_messages_total", "Yönlendirilen WebSocket çerçeveleri",
+                      ("namespace", "result"))
+FCM_LATENCY = Histogram("guvercin_fcm_send_seconds", "FCM toplu gönderim süresi")
+FCM_RESULTS = Counter("guvercin_fcm_notifications_total", "FCM bildirim sonuçları", ("result",))
+LOOP_LAG = Histogram("guvercin_event_loop_lag_seconds", "Event loop gecikmesi",
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+LOOP_BLOCKED = Counter("guvercin_event_loop_blocked_seconds_total", "Event loop'un bloklandığı toplam süre")
+
+_lag_monitor = None
+
+
+async def _monitor_loop_lag():
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(time.perf_counter() - start - LOOP_LAG_INTERVAL, 0.0)
+        LOOP_LAG.observe(lag)
+        if lag > 0.001:
+            LOOP_BLOCKED.inc(lag)
+
+
+def start_loop_monitor():
+    """Çalışan event loop'un gecikmesini ölçer; süreç başına bir kez başlatılır."""
+    global _lag_monitor
+    if _lag_monitor is None or _lag_monitor.done():
+        _lag_monitor = asyncio.get_running_loop().create_task(_monitor_loop_lag())
+
+
+class MetricsMiddleware:
+    """HTTP isteklerinin süresini route şablonuna göre ölçer (/chats/{username} gibi)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start_loop_monitor()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_LATENCY.labels(getattr(route, "path", "unmatched"), scope["method"], status["code"]) \
+                .observe(time.perf_counter() - start)
+
+
+def install(app: FastAPI, instrument: bool = True):
+    if instrument:
+        app.add_middleware(MetricsMiddleware)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics_endpoint():
+        return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
+
+
+def event(logger, name: str, rate: float = None, **fields):
+    """Örneklenmiş, yapılandırılmış log satırı: 'ad anahtar=değer ...'."""
+    if random.random() >= (LOG_SAMPLE_RATE if rate is None else rate):
+        return
+    logger.info("%s %s", name, " ".join(f"{key}={value}" for key, value in fields.items()))
@@ -0,0 +1,88 @@
+"""
+Veritabanı şema geçişleri.
+
+Her geçiş bir kez çalıştırılır ve `schema_migrations` tablosuna kaydedilir:
+
+    python3 migrations.py
+"""
+from connectdb import get_connection
+
+MIGRATIONS = [
+    ("004_message_pagination_indexes", [
+        # get_messages: (sender, receiver) çiftine göre id sıralı sayfalama
+        "CREATE INDEX idx_messages_pair ON messages (sender, receiver, id)",
+        # Kullanıcının sildiği mesajlar için anti-join
+        "CREATE INDEX idx_deleted_user_message ON deleted_messages (user, message_id)",
+    ]),
+    ("005_conversations", [
+        # Kullanıcı başına sohbet listesi (bkz. conversations.py); doldurmak için:
+        # python3 conversations.py --rebuild
+        """
+        CREATE TABLE IF NOT EXISTS conversations (
+            owner VARCHAR(255) NOT NULL,
+            peer VARCHAR(255) NOT NULL,
+            last_message_id BIGINT NOT NULL,
+            last_ts DATETIME NULL,
+            preview VARCHAR(255) NULL,
+            unread INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (owner, peer),
+            KEY idx_conversations_recent (owner, last_message_id)
+        )
+        """,
+        # Okunmamış sayımı: (gönderen, alıcı) çiftinde seen = FALSE aralığı
+        "CREATE INDEX idx_messages_unread ON messages (sender, receiver, seen)",
+    ]),
+    ("006_account_deletion_indexes", [
+        # Hesap silme işi: kullanıcıya gelen mesajlar ve karşı tarafların sohbet kayıtları
+        "CREATE INDEX idx_messages_receiver ON messages (receiver, id)",
+        "CREATE INDEX idx_conversations_peer ON conversations (peer)",
+    ]),
+    ("007_inbox_index", [
+        # Yeniden bağlanınca bekleyen mesajlar: alıcının delivered = FALSE aralığı id sırasıyla
+        "CREATE INDEX idx_messages_inbox ON messages (receiver, delivered, id)",
+    ]),
+    ("008_attachments", [
+        # İçerik adresli ek deposu (bkz. attachments.py); refcount = attachment'ı gösteren mesaj sayısı
+        """
+        CREATE TABLE IF NOT EXISTS attachments (
+            sha256 CHAR(64) PRIMARY KEY,
+            size BIGINT NOT NULL DEFAULT 0,
+            refcount INT NOT NULL DEFAULT 0,
+            pending_until DATETIME NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            KEY idx_attachments_refcount (refcount)
+        )
+        """,
+        "ALTER TABLE messages ADD COLUMN attachment CHAR(64) NULL",
+        "CREATE INDEX idx_messages_attachment ON messages (attachment)",
+    ]),
+]
+
+
+def migrate():
+    conn, cursor = get_connection()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                name VARCHAR(255) PRIMARY KEY,
+                applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("SELECT name FROM schema_migrations")
+        applied = {row["name"] for row in cursor.fetchall()}
+
+        for name, statements in MIGRATIONS:
+            if name in applied:
+                continue
+            print(f"Geçiş uygulanıyor: {name}")
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (name,))
+            conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    migrate()
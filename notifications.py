@@ -0,0 +1,232 @@
+"""
+Asenkron, toplu FCM bildirim gönderici.
+
+WebSocket handler'ları çevrimdışı alıcıyı yalnızca sınırlı bir kuyruğa bırakır
+(notify). Arka plandaki gönderici kısa bir pencere boyunca biriken alıcıları
+toplar, aynı alıcıya gelen mesajları tek bir "N yeni mesaj" bildiriminde
+birleştirir ve hepsini tek bir send_each çağrısıyla gönderir.
+
+    - Geçici hatalar üstel geri çekilme ile yeniden denenir.
+    - Geçersiz token'lar kullanıcı kaydından silinir.
+    - Gönderim katmanı (transport) değiştirilebilir; yük testi için
+      GUVERCIN_FCM_TRANSPORT=http ile yerel sahte bir FCM adresine gönderilir.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import urllib.request
+from collections import Counter
+
+import metrics
+import redisdb
+
+QUEUE_SIZE = int(os.environ.get("GUVERCIN_FCM_QUEUE_SIZE", "10000"))
+BATCH_SIZE = 500  # send_each tek çağrıda en fazla 500 mesaj kabul eder
+BATCH_WINDOW = float(os.environ.get("GUVERCIN_FCM_BATCH_WINDOW", "0.05"))  # saniye
+MAX_RETRIES = int(os.environ.get("GUVERCIN_FCM_MAX_RETRIES", "3"))
+RETRY_BASE_DELAY = 0.5  # saniye
+
+FIREBASE_CREDENTIALS = os.environ.get(
+    "GUVERCIN_FIREBASE_CREDENTIALS",
+    "/home/gcloude/guvercin/guvercin-b5d67-firebase-adminsdk-ieas1-28df47be95.json"
+)
+
+# Gönderim sonuçları
+OK, RETRY, INVALID, FAILED = "ok", "retry", "invalid", "failed"
+
+logger = logging.getLogger(__name__)
+
+
+class FirebaseTransport:
+    """firebase_admin.messaging.send_each ile gönderim."""
+
+    def __init__(self, credentials_path: str = FIREBASE_CREDENTIALS):
+        import firebase_admin
+        from firebase_admin import credentials, exceptions, messaging
+
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(credentials.Certificate(credentials_path))
+        self._messaging = messaging
+        self._invalid = (messaging.UnregisteredError, messaging.SenderIdMismatchError,
+                         exceptions.InvalidArgumentError)
+        self._retry = (messaging.QuotaExceededError, exceptions.UnavailableError,
+                       exceptions.InternalError, exceptions.DeadlineExceededError)
+
+    def send_each(self, notifications: list) -> list:
+        messaging = self._messaging
+        messages = [
+            messaging.Message(
+                notification=messaging.Notification(title=n["title"], body=n.get("body")),
+                token=n["token"]
+            )
+            for n in notifications
+        ]
+        response = messaging.send_each(messages)
+        results = []
+        for item in response.responses:
+            if item.success:
+                results.append(OK)
+            elif isinstance(item.exception, self._invalid):
+                results.append(INVALID)
+            elif isinstance(item.exception, self._retry):
+                results.append(RETRY)
+            else:
+                logger.warning("FCM bildirimi gönderilemedi: %s", item.exception)
+                results.append(FAILED)
+        return results
+
+
+class HttpTransport:
+    """
+    Yük testleri için: bildirimleri JSON olarak yerel bir adrese POST eder.
+    Yanıt {"results": ["ok" | "retry" | "invalid" | "failed", ...]} olmalıdır.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+
+    def send_each(self, notifications: list) -> list:
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps({"messages": notifications}).encode(),
+            headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return json.loads(response.read())["results"]
+
+
+def create_transport():
+    if os.environ.get("GUVERCIN_FCM_TRANSPORT", "firebase") == "http":
+        return HttpTransport(os.environ.get("GUVERCIN_FCM_ENDPOINT", "http://localhost:5099/send"))
+    return FirebaseTransport()
+
+
+class NotificationDispatcher:
+    def __init__(self, redis_client, transport, queue_size=QUEUE_SIZE, batch_window=BATCH_WINDOW,
+                 max_retries=MAX_RETRIES):
+        self.redis = redis_client
+        self.transport = transport
+        self.batch_window = batch_window
+        self.max_retries = max_retries
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._task = None
+        self._retries = set()
+        self.dropped = 0
+
+    def notify(self, receiver: str) -> bool:
+        """
+        Alıcıyı bildirim kuyruğuna ekler; beklemez. Kuyruk doluysa bildirim düşürülür.
+        """
+        try:
+            self._queue.put_nowait(receiver)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            metrics.FCM_RESULTS.labels("dropped").inc()
+            return False
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in [self._task, *self._retries]:
+            if task:
+                task.cancel()
+        self._task = None
+
+    async def _collect(self) -> Counter:
+        counts = Counter([await self._queue.get()])
+        deadline = asyncio.get_running_loop().time() + self.batch_window
+        while len(counts) < BATCH_SIZE:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                counts[await asyncio.wait_for(self._queue.get(), timeout)] += 1
+            except asyncio.TimeoutError:
+                break
+        return counts
+
+    async def _run(self):
+        while True:
+            counts = await self._collect()
+            try:
+                await self._dispatch(counts, attempt=0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("FCM bildirim grubu gönderilemedi")
+
+    async def _dispatch(self, counts: Counter, attempt: int):
+        try:
+            notifications = await self._build(counts)
+        except Exception as e:
+            # Token'lar okunamadı (Redis); grup sonra yeniden kurulur
+            logger.warning("FCM token'ları okunamadı: %s", e)
+            self._schedule(self._dispatch, counts, attempt)
+            return
+        if notifications:
+            await self._send(notifications, attempt)
+
+    async def _build(self, counts: Counter) -> list:
+        receivers = list(counts)
+        # Tüm alıcıların token'ları tek pipeline ile okunur
+        tokens = await redisdb.hget_many(self.redis, [f"user:{receiver}" for receiver in receivers], "fcm_token")
+        notifications = []
+        for receiver, token in zip(receivers, tokens):
+            if not token:
+                logger.info("%s için FCM token bulunamadı.", receiver)
+                continue
+            count = counts[receiver]
+            notifications.append({
+                "receiver": receiver,
+                "token": token.decode() if isinstance(token, bytes) else token,
+                "title": "Yeni bir mesajınız var!" if count == 1 else f"{count} yeni mesajınız var!",
+            })
+        return notifications
+
+    async def _drop_tokens(self, notifications):
+        # Yalnızca token hâlâ aynıysa sil; kullanıcı bu arada yenisini kaydetmiş olabilir
+        keys = [f"user:{n['receiver']}" for n in notifications]
+        stored_tokens = await redisdb.hget_many(self.redis, keys, "fcm_token")
+        pipe = self.redis.pipeline(transaction=False)
+        for key, n, stored in zip(keys, notifications, stored_tokens):
+            if stored is not None and (stored.decode() if isinstance(stored, bytes) else stored) == n["token"]:
+                pipe.hdel(key, "fcm_token")
+        await pipe.execute()
+
+    async def _send(self, notifications: list, attempt: int):
+        try:
+            with metrics.FCM_LATENCY.time():
+                results = await asyncio.to_thread(self.transport.send_each, notifications)
+        except Exception as e:
+            # Tüm grup geçici hata sayılır
+            logger.warning("FCM gönderimi başarısız: %s", e)
+            results = [RETRY] * len(notifications)
+        for result, count in Counter(results).items():
+            metrics.FCM_RESULTS.labels(result).inc(count)
+
+        invalid = [n for n, result in zip(notifications, results) if result == INVALID]
+        retry = [n for n, result in zip(notifications, results) if result == RETRY]
+        if invalid:
+            await self._drop_tokens(invalid)
+        if retry:
+            self._schedule(self._send, retry, attempt)
+
+    def _schedule(self, send, items, attempt: int):
+        if attempt >= self.max_retries:
+            logger.warning("%d FCM bildirimi yeniden denemelerden sonra gönderilemedi", len(items))
+            return
+        task = asyncio.create_task(self._retry(send, items, attempt + 1))
+        self._retries.add(task)
+        task.add_done_callback(self._retries.discard)
+
+    async def _retry(self, send, items, attempt: int):
+        delay = RETRY_BASE_DELAY * (2 ** (attempt - 1))
+        await asyncio.sleep(delay + random.uniform(0, delay / 2))
+        try:
+            await send(items, attempt)
+        except Exception:
+            logger.exception("FCM yeniden deneme başarısız")
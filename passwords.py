@@ -0,0 +1,105 @@
+"""
+Parola özetleme servisi (argon2id).
+
+Özetleme bilerek pahalıdır; istek thread'ini bloklamaması ve tüm çekirdekleri
+kullanabilmesi için işler çekirdek sayısı kadar süreçten oluşan bir havuza
+gönderilir ve sonuç event loop bloklanmadan beklenir. Havuzun önünde sınırlı
+bir kabul kuyruğu vardır: bekleme süresi
+GUVERCIN_HASH_ADMISSION_TIMEOUT'u aşarsa Overloaded fırlatılır ve endpoint 503 döner.
+
+user:{username} hash'lerinde düz metin saklanan eski parolalar ilk başarılı
+girişte özetlenmiş haliyle değiştirilir.
+"""
+import asyncio
+import hmac
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+
+TIME_COST = int(os.environ.get("GUVERCIN_HASH_TIME_COST", "2"))
+MEMORY_COST = int(os.environ.get("GUVERCIN_HASH_MEMORY_COST", "19456"))  # KiB
+PARALLELISM = int(os.environ.get("GUVERCIN_HASH_PARALLELISM", "1"))
+
+POOL_SIZE = int(os.environ.get("GUVERCIN_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Aynı anda havuzda olabilecek (çalışan + sırada bekleyen) iş sayısı
+ADMISSION_LIMIT = int(os.environ.get("GUVERCIN_HASH_ADMISSION_LIMIT", str(POOL_SIZE * 4)))
+ADMISSION_TIMEOUT = float(os.environ.get("GUVERCIN_HASH_ADMISSION_TIMEOUT", "2"))
+
+HASH_PREFIX = "$argon2"
+
+_hasher = PasswordHasher(time_cost=TIME_COST, memory_cost=MEMORY_COST, parallelism=PARALLELISM)
+_admission = None
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class Overloaded(Exception):
+    """Özetleme havuzu dolu ve bekleme süresi aşıldı."""
+
+
+def _get_executor():
+    # Havuz ilk kullanımda açılır; modülü içe aktaran her süreç havuz başlatmasın
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=POOL_SIZE)
+        return _executor
+
+
+async def _submit(func, *args):
+    global _admission
+    if _admission is None:
+        # Semafor, worker'ın event loop'u içinde oluşturulur
+        _admission = asyncio.BoundedSemaphore(ADMISSION_LIMIT)
+    try:
+        await asyncio.wait_for(_admission.acquire(), ADMISSION_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise Overloaded()
+    try:
+        return await asyncio.wrap_future(_get_executor().submit(func, *args))
+    finally:
+        _admission.release()
+
+
+# Aşağıdaki iki fonksiyon havuz süreçlerinde çalışır
+def _hash(password: str) -> str:
+    return _hasher.hash(password)
+
+
+def _verify(stored: str, password: str):
+    try:
+        _hasher.verify(stored, password)
+    except (VerificationError, InvalidHashError):
+        return False, False
+    return True, _hasher.check_needs_rehash(stored)
+
+
+def is_hashed(stored: str) -> bool:
+    return bool(stored) and stored.startswith(HASH_PREFIX)
+
+
+async def hash_password(password: str) -> str:
+    return await _submit(_hash, password)
+
+
+async def verify_password(stored: str, password: str):
+    """
+    (doğru_mu, yeni_özet) döner. yeni_özet None değilse saklanan değer
+    bununla değiştirilmelidir (düz metin kayıt ya da değişmiş maliyet ayarları).
+    """
+    if not stored:
+        return False, None
+
+    if not is_hashed(stored):
+        # Eski kayıt: düz metin parola
+        if not hmac.compare_digest(stored.encode(), password.encode()):
+            return False, None
+        return True, await hash_password(password)
+
+    ok, needs_rehash = await _submit(_verify, stored, password)
+    if ok and needs_rehash:
+        return True, await hash_password(password)
+    return ok, None
@@ -0,0 +1,286 @@
+"""
+Worker'lar arası çevrimiçi durumu (presence).
+
+Bir kullanıcının her soketi (chat, seen, home; birden fazla cihaz) Redis'te
+ayrı bir kayıt olarak tutulur:
+
+    presence:{username}        -> sorted set; üye = soket kimliği, skor = son geçerlilik (ms)
+    presence:last_seen         -> hash; kullanıcı -> son çevrimdışı olma zamanı (sn)
+    presence:changes:{username} -> kanal; "1" çevrimiçi oldu, "0:{last_seen}" çevrimdışı oldu
+
+Kullanıcı, süresi dolmamış en az bir soketi varsa çevrimiçidir. Her worker
+kendi soketlerinin kayıtlarını HEARTBEAT_INTERVAL'de bir tek betikle
+yeniler; worker çökerse kayıtları TTL sonunda kendiliğinden düşer. Ölü TCP
+bağlantıları uvicorn'un WebSocket ping/pong'u ile kapanır (bkz. server.py).
+
+Durum değişikliği yalnızca geçişlerde (ilk soket açıldı / son soket kapandı)
+yayınlanır. Kişi listesini izleyen bağlantılar (watch) bu kanallara worker
+başına bir kez abone olur; çöken worker'ların düşen kayıtları izlenen
+kullanıcılar için SWEEP_INTERVAL'de bir yoklanır.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+
+import metrics
+import redisdb
+
+TTL = int(os.environ.get("GUVERCIN_PRESENCE_TTL", "30"))  # saniye
+HEARTBEAT_INTERVAL = float(os.environ.get("GUVERCIN_PRESENCE_HEARTBEAT", "10"))  # saniye
+SWEEP_INTERVAL = float(os.environ.get("GUVERCIN_PRESENCE_SWEEP", "30"))  # saniye
+MAX_QUERY = 1000  # POST /presence başına kullanıcı
+MAX_WATCH = 500  # bağlantı başına izlenen kullanıcı
+
+LAST_SEEN_KEY = "presence:last_seen"
+CHANNEL_PREFIX = "presence:changes:"
+
+LOCAL_SOCKETS = metrics.Gauge("guvercin_presence_local_sockets", "Bu worker'ın presence kaydı tuttuğu soketler")
+CHANGES = metrics.Counter("guvercin_presence_changes_total", "Yayınlanan çevrimiçi/çevrimdışı geçişleri",
+                          ("state",))
+
+logger = logging.getLogger(__name__)
+
+# Süresi dolan kayıtları temizler, soketi ekler; ilk soketse geçişi yayınlar
+# KEYS: presence:{u}  ARGV: şimdi (ms), son geçerlilik (ms), soket, ttl, kanal
+_CONNECT_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+local before = redis.call('ZCARD', KEYS[1])
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+if before == 0 then
+    redis.call('PUBLISH', ARGV[5], '1')
+end
+return before
+"""
+
+# KEYS: presence:{u}, presence:last_seen  ARGV: şimdi (ms), kullanıcı, soket, kanal
+_DISCONNECT_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) > 0 then
+    return 0
+end
+local last_seen = math.floor(tonumber(ARGV[1]) / 1000)
+redis.call('HSET', KEYS[2], ARGV[2], last_seen)
+redis.call('PUBLISH', ARGV[4], '0:' .. last_seen)
+return 1
+"""
+
+# Yalnızca hâlâ kayıtlı soketleri yeniler (ZADD XX): yenileme sürerken kapanan
+# soketin kaydı geri yazılmaz. Kaydı bulunamayan soketlerin sıralarını döner.
+# KEYS: presence:{u}...  ARGV: son geçerlilik (ms), ttl, soket...
+_HEARTBEAT_SCRIPT = """
+local missing = {}
+for i, key in ipairs(KEYS) do
+    local socket_id = ARGV[i + 2]
+    if redis.call('ZSCORE', key, socket_id) then
+        redis.call('ZADD', key, 'XX', ARGV[1], socket_id)
+        redis.call('EXPIRE', key, ARGV[2])
+    else
+        table.insert(missing, i)
+    end
+end
+return missing
+"""
+
+
+def presence_key(username: str) -> str:
+    return f"presence:{username}"
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _state(online: bool, last_seen) -> dict:
+    return {"online": online, "last_seen": None if online or last_seen is None else int(last_seen)}
+
+
+class Presence:
+    def __init__(self, client=redisdb.client, ttl=TTL, heartbeat_interval=HEARTBEAT_INTERVAL,
+                 sweep_interval=SWEEP_INTERVAL):
+        self.client = client
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.sweep_interval = sweep_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        # Bu worker'daki soketler: soket kimliği -> kullanıcı adı
+        self.sockets = {}
+        # İzlenen kullanıcı -> izleyen bağlantılar; son bilinen durumlar
+        self._watchers = {}
+        self._known = {}
+        self._pubsub = None
+        self._tasks = []
+        self._users = 0
+        LOCAL_SOCKETS.set_function(lambda: len(self.sockets))
+
+    async def start(self):
+        # Aynı süreçteki birden fazla servis (ağ geçidi) tek örneği paylaşır
+        self._users += 1
+        if self._users > 1:
+            return
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._tasks = [asyncio.create_task(loop()) for loop in (self._heartbeat, self._listen, self._sweep)]
+
+    async def stop(self):
+        self._users -= 1
+        if self._users > 0:
+            return
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        for socket_id, username in list(self.sockets.items()):
+            await self.disconnect(username, socket_id)
+        if self._pubsub:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    def socket_id(self, connection) -> str:
+        return f"{self.worker_id}:{id(connection)}"
+
+    async def connect(self, username: str, socket_id: str):
+        self.sockets[socket_id] = username
+        now = _now_ms()
+        before = await self.client.eval(_CONNECT_SCRIPT, 1, presence_key(username),
+                                        now, now + self.ttl * 1000, socket_id, self.ttl, CHANNEL_PREFIX + username)
+        if before == 0:
+            CHANGES.labels("online").inc()
+
+    async def disconnect(self, username: str, socket_id: str):
+        self.sockets.pop(socket_id, None)
+        try:
+            went_offline = await self.client.eval(_DISCONNECT_SCRIPT, 2, presence_key(username), LAST_SEEN_KEY,
+                                                  _now_ms(), username, socket_id, CHANNEL_PREFIX + username)
+        except Exception:
+            # Kayıt TTL sonunda kendiliğinden düşer
+            logger.exception("%s presence kaydı silinemedi", username)
+            return
+        if went_offline:
+            CHANGES.labels("offline").inc()
+
+    async def query(self, usernames) -> dict:
+        """Kullanıcıların durumunu tek gidiş-dönüşte döner: {u: {"online", "last_seen"}}."""
+        usernames = list(dict.fromkeys(usernames))
+        now = _now_ms()
+        pipe = self.client.pipeline(transaction=False)
+        for username in usernames:
+            pipe.zcount(presence_key(username), now, "+inf")
+        if usernames:
+            pipe.hmget(LAST_SEEN_KEY, usernames)
+        results = await pipe.execute() if usernames else [[]]
+        counts, last_seen = results[:-1], results[-1]
+        return {username: _state(count > 0, seen)
+                for username, count, seen in zip(usernames, counts, last_seen)}
+
+    # --- izleme (kişi listeleri) ---
+
+    async def watch(self, connection, usernames) -> dict:
+        """
+        connection'ın usernames kullanıcılarını izlemesini başlatır ve şu anki
+        durumlarını döner. Değişiklikler connection'a {"type": "presence", "users": {...}}
+        çerçevesiyle gönderilir.
+        """
+        usernames = [u for u in dict.fromkeys(usernames)][:MAX_WATCH]
+        states = await self.query(usernames)
+        new_channels = []
+        for username in usernames:
+            watchers = self._watchers.setdefault(username, set())
+            if not watchers:
+                new_channels.append(CHANNEL_PREFIX + username)
+            watchers.add(connection)
+            self._known[username] = states[username]["online"]
+        if new_channels:
+            await self._pubsub.subscribe(*new_channels)
+        return states
+
+    async def unwatch(self, connection, usernames=None):
+        """connection'ın izlemelerini kaldırır (usernames verilmezse hepsini)."""
+        if usernames is None:
+            usernames = [u for u, watchers in self._watchers.items() if connection in watchers]
+        stale = []
+        for username in usernames:
+            watchers = self._watchers.get(username)
+            if not watchers:
+                continue
+            watchers.discard(connection)
+            if not watchers:
+                del self._watchers[username]
+                self._known.pop(username, None)
+                stale.append(CHANNEL_PREFIX + username)
+        if stale and self._pubsub:
+            await self._pubsub.unsubscribe(*stale)
+
+    async def _notify(self, username: str, state: dict):
+        # Yoklama ve yayın aynı geçişi iki kez bildirmesin
+        if username not in self._watchers or self._known.get(username) == state["online"]:
+            return
+        self._known[username] = state["online"]
+        payload = {"type": "presence", "users": {username: state}}
+        for connection in list(self._watchers.get(username, ())):
+            # Abonelik dinleyicisi ortak görevdir; dolu kuyruk beklenmez
+            await connection.send(payload, wait=False)
+
+    async def _listen(self):
+        while True:
+            if not self._watchers:
+                await asyncio.sleep(0.5)
+                continue
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Presence kanalı okunamadı")
+                await asyncio.sleep(1)
+                continue
+            if message is None or message["type"] != "message":
+                continue
+            username = message["channel"][len(CHANNEL_PREFIX):]
+            online, _, last_seen = message["data"].partition(":")
+            await self._notify(username, _state(online == "1", last_seen or None))
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                items = list(self.sockets.items())
+                for start in range(0, len(items), redisdb.PIPELINE_CHUNK):
+                    chunk = items[start:start + redisdb.PIPELINE_CHUNK]
+                    missing = await self.client.eval(
+                        _HEARTBEAT_SCRIPT, len(chunk), *[presence_key(username) for _, username in chunk],
+                        _now_ms() + self.ttl * 1000, self.ttl, *[socket_id for socket_id, _ in chunk])
+                    # Kaydı süresi dolup düşmüş ama hâlâ açık soketler yeniden bağlanır
+                    for index in missing:
+                        socket_id, username = chunk[index - 1]
+                        if socket_id in self.sockets:
+                            await self.connect(username, socket_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Presence kayıtları yenilenemedi")
+
+    async def _sweep(self):
+        # Çöken worker'ların soketleri geçiş yayınlamadan düşer; izlenenler yoklanır
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                watched = list(self._watchers)
+                for start in range(0, len(watched), redisdb.PIPELINE_CHUNK):
+                    states = await self.query(watched[start:start + redisdb.PIPELINE_CHUNK])
+                    for username, state in states.items():
+                        await self._notify(username, state)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Presence yoklaması başarısız")
+
+
+tracker = Presence()
@@ -0,0 +1,170 @@
+"""
+Chat soketlerinin çerçeve biçimi (protokol sürümü).
+
+İstemci desteklediği sürümleri Sec-WebSocket-Protocol başlığıyla bildirir;
+sunucu kendi tercih sırasına göre ilk ortak sürümü seçer. Başlık göndermeyen
+eski istemciler JSON ile devam eder.
+
+    guvercin.v2.msgpack : MessagePack, ikili çerçeveler
+                          - alan adları yerine kısa tamsayı kimlikler (FIELD_IDS)
+                          - dosya ve parça içerikleri aynı çerçevede "data" alanında
+                          - gönderene mesajın tamamı yerine kısa "ack" çerçevesi
+    guvercin.v1.json    : JSON metin çerçeveleri (eski davranış; başlıksız da bu)
+
+Sıkıştırma WebSocket katmanında permessage-deflate ile yapılır (bkz. server.py).
+Her bağlantı kendi codec'ini taşır; worker'lar arası yönlendirmede mesajlar
+sözlük olarak gider ve alıcının codec'iyle kodlanır.
+
+    codec = protocol.negotiate(websocket)
+    await websocket.accept(subprotocol=codec.subprotocol(websocket))
+    frame = await codec.receive(websocket)
+"""
+import json
+
+import msgpack
+
+JSON_V1 = "guvercin.v1.json"
+MSGPACK_V2 = "guvercin.v2.msgpack"
+
+# Değişmemeleri gerekir: istemciler de aynı tabloyu kullanır, yeni alanlar sona eklenir
+FIELD_IDS = {
+    "type": 0,
+    "sender": 1,
+    "receiver": 2,
+    "message": 3,
+    "message_id": 4,
+    "timestamp": 5,
+    "file_name": 6,
+    "mime_type": 7,
+    "file_url": 8,
+    "status": 9,
+    "delivered": 10,
+    "seen": 11,
+    "upload_id": 12,
+    "offset": 13,
+    "detail": 14,
+    "download_token": 15,
+    "up_to": 16,
+    "peer": 17,
+    "last_id": 18,
+    "more": 19,
+    "messages": 20,
+    "count": 21,
+    "reader": 22,
+    "client_id": 23,
+    "size": 24,
+    "data": 25,
+}
+FIELD_NAMES = {field_id: name for name, field_id in FIELD_IDS.items()}
+
+
+class JsonCodec:
+    name = JSON_V1
+    binary = False
+    # Eski istemciler gönderdikleri mesajın zenginleştirilmiş halini geri bekler
+    compact_ack = False
+    inline_data = False
+
+    def encode(self, payload: dict) -> str:
+        return json.dumps(payload)
+
+    def decode(self, data) -> dict:
+        frame = json.loads(data)
+        if not isinstance(frame, dict):
+            raise ValueError("Çerçeve bir sözlük olmalı.")
+        return frame
+
+    async def receive(self, websocket) -> dict:
+        return self.decode(await websocket.receive_text())
+
+    def subprotocol(self, websocket):
+        # Başlıksız bağlanan eski istemcilere alt protokol dönülmez
+        return self.name if self.name in websocket.scope.get("subprotocols", ()) else None
+
+
+def _shorten(frame: dict) -> dict:
+    short = {FIELD_IDS.get(key, key): value for key, value in frame.items()}
+    messages = short.get(FIELD_IDS["messages"])
+    if isinstance(messages, list):
+        short[FIELD_IDS["messages"]] = [_shorten(item) if isinstance(item, dict) else item for item in messages]
+    return short
+
+
+def _expand(frame: dict) -> dict:
+    full = {FIELD_NAMES.get(key, key): value for key, value in frame.items()}
+    messages = full.get("messages")
+    if isinstance(messages, list):
+        full["messages"] = [_expand(item) if isinstance(item, dict) else item for item in messages]
+    return full
+
+
+class MsgpackCodec(JsonCodec):
+    name = MSGPACK_V2
+    binary = True
+    compact_ack = True
+    inline_data = True
+
+    def encode(self, payload: dict) -> bytes:
+        return msgpack.packb(_shorten(payload), use_bin_type=True)
+
+    def decode(self, data) -> dict:
+        frame = msgpack.unpackb(data, raw=False, strict_map_key=False)
+        if not isinstance(frame, dict):
+            raise ValueError("Çerçeve bir sözlük olmalı.")
+        return _expand(frame)
+
+    async def receive(self, websocket) -> dict:
+        return self.decode(await websocket.receive_bytes())
+
+
+JSON = JsonCodec()
+MSGPACK = MsgpackCodec()
+
+# Sunucunun tercih sırası
+CODECS = {codec.name: codec for codec in (MSGPACK, JSON)}
+
+
+def negotiate(websocket) -> JsonCodec:
+    """İstemcinin önerdiği alt protokollerden sunucunun tercih ettiğini seçer."""
+    offered = websocket.scope.get("subprotocols", ())
+    for name, codec in CODECS.items():
+        if name in offered:
+            return codec
+    return JSON
+
+
+# Çözülemeyen çerçeve: bozuk JSON/MessagePack (ValueError alt sınıfları), beklenmeyen
+# metin/ikili çerçeve türü (KeyError) ya da eksik alan
+FRAME_ERRORS = (ValueError, KeyError, TypeError)
+
+
+def frame_error(frame: dict = None, detail: str = "Geçersiz çerçeve.") -> dict:
+    """İşlenemeyen çerçeve için istemciye dönen hata; soket açık kalır."""
+    error = {"type": "error", "detail": detail}
+    if frame and frame.get("client_id") is not None:
+        error["client_id"] = frame["client_id"]
+    return error
+
+
+async def read_attachment(websocket, codec: JsonCodec, frame: dict) -> bytes:
+    """Dosya/parça içeriği: v2'de çerçevenin içinde, v1'de ayrı ikili çerçevede."""
+    if codec.inline_data:
+        data = frame.pop("data", None)
+        if not isinstance(data, bytes):
+            raise ValueError("Çerçevede dosya içeriği yok.")
+        return data
+    return await websocket.receive_bytes()
+
+
+def sender_ack(message: dict) -> dict:
+    """Gönderene yankı yerine dönen kısa onay."""
+    ack = {
+        "type": "ack",
+        "client_id": message.get("client_id"),
+        "message_id": message["message_id"],
+        "timestamp": message["timestamp"],
+        "delivered": message["delivered"],
+    }
+    if message.get("download_token"):
+        ack["download_token"] = message["download_token"]
+    return ack
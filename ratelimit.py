@@ -0,0 +1,322 @@
+"""
+Redis tabanlı hız sınırlama ve kabul kontrolü (token bucket).
+
+Her kural (route/kullanıcı/IP) için anahtar başına bir kova tutulur:
+
+    ratelimit:{kural}:{anahtar}  -> hash; tokens, ts (ms, Redis saati)
+
+Kova saniyede `rate` jetonla dolar, en fazla `burst` jeton biriktirir. Dolum ve
+harcama tek bir Lua betiğinde yapılır; tüm worker'lar aynı kovayı paylaşır.
+
+Yerel hızlı yol: worker bir anahtar için kovadan tek seferde LEASE_SECONDS'lık
+jeton (rate * LEASE_SECONDS, en az 1) alır ve sonraki istekleri Redis'e
+gitmeden bundan harcar. Kiralanan jetonlar kovadan düşüldüğü için worker'lar
+toplamda sınırı aşamaz; kullanılmayan kısım kira süresi bitince kaybolur.
+Reddedilen anahtar, kovanın dolacağı zamana kadar yerel olarak reddedilir;
+süren aşırı yük Redis'e de yük bindirmez. Redis'e ulaşılamazsa istekler
+kira süresi boyunca kabul edilir (fail-open).
+
+Sınırlar GUVERCIN_RATE_LIMITS ile değiştirilebilir:
+
+    GUVERCIN_RATE_LIMITS="login_ip=2/30,chat_frame_user=10/20"   # kural=saniyede/kapasite
+
+HTTP'de aşım 429 + Retry-After ile, soketlerde önce "rate_limited" çerçevesi,
+süren aşımda 1013 (Try Again Later) kapanış koduyla yanıtlanır; her iki durumda
+da veritabanı işinden önce.
+
+    @app.post("/login", dependencies=[ratelimit.limit("login_ip")])
+    await ratelimit.check("login_user", username)          # RateLimited fırlatır
+    await ratelimit.ensure_available("login_user", username)  # harcamadan; boşsa RateLimited
+    await ratelimit.charge("login_user", username)         # başarısız denemeden sonra
+    if not await ratelimit.admit(websocket, "ws_connect_ip", ratelimit.client_ip(websocket)): return
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import JSONResponse
+from starlette.requests import HTTPConnection
+from starlette.websockets import WebSocketDisconnect
+
+import metrics
+import redisdb
+
+ENABLED = os.environ.get("GUVERCIN_RATE_LIMIT", "1") != "0"
+LEASE_SECONDS = float(os.environ.get("GUVERCIN_RATE_LIMIT_LEASE", "0.25"))  # saniye
+# Vekil arkasında istemci IP'si X-Forwarded-For'dan alınır
+TRUST_FORWARDED = os.environ.get("GUVERCIN_TRUST_FORWARDED", "0") == "1"
+# Arka arkaya bu kadar çerçeve reddedilen soket kapatılır
+WS_STRIKES = int(os.environ.get("GUVERCIN_RATE_LIMIT_WS_STRIKES", "50"))
+WS_TRY_AGAIN_LATER = 1013
+MAX_LOCAL_KEYS = 100_000
+
+# kural -> (saniyede jeton, kapasite)
+DEFAULT_RULES = {
+    "login_ip": (1, 20),
+    "login_user": (0.1, 5),
+    "session_ip": (20, 100),
+    "register_ip": (0.05, 5),
+    "lookup_ip": (5, 30),
+    "search_ip": (10, 50),
+    "presence_ip": (5, 20),
+    "history_user": (10, 40),
+    "ws_connect_ip": (1, 20),
+    "chat_frame_user": (20, 60),
+    "seen_frame_user": (50, 200),
+    "home_frame_user": (10, 40),
+}
+
+DECISIONS = metrics.Counter("guvercin_ratelimit_decisions_total", "Hız sınırlayıcı kararları",
+                            ("rule", "result"))
+REDIS_CALLS = metrics.Counter("guvercin_ratelimit_redis_calls_total", "Kova için Redis'e gidilen kontroller",
+                              ("rule",))
+
+logger = logging.getLogger(__name__)
+
+# Kovayı Redis saatine göre doldurur, en fazla ARGV[3] jeton verir
+# KEYS: kova  ARGV: saniyede jeton, kapasite, istenen  -> {verilen, yeniden deneme (ms)}
+# istenen 0 ise yalnızca kovaya bakılır: jeton varsa yeniden deneme 0 döner
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local wanted = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+if now > ts then
+    tokens = math.min(burst, tokens + (now - ts) * rate / 1000)
+    ts = now
+end
+local granted = math.min(wanted, math.floor(tokens))
+local retry_after = 0
+if tokens < 1 then
+    granted = 0
+    retry_after = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - granted), 'ts', ts)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return {granted, retry_after}
+"""
+
+
+def parse_rules(spec: str) -> dict:
+    rules = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        rate, _, burst = value.partition("/")
+        rules[name.strip()] = (float(rate), float(burst))
+    return rules
+
+
+def bucket_key(rule: str, key: str) -> str:
+    return f"ratelimit:{rule}:{key}"
+
+
+def client_ip(connection: HTTPConnection) -> str:
+    if TRUST_FORWARDED:
+        forwarded = connection.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",", 1)[0].strip()
+    return connection.client.host if connection.client else "unknown"
+
+
+class RateLimited(Exception):
+    def __init__(self, rule: str, retry_after: float):
+        super().__init__(rule)
+        self.rule = rule
+        self.retry_after = retry_after
+
+
+class _Lease:
+    __slots__ = ("tokens", "expires", "blocked_until", "refill")
+
+    def __init__(self):
+        self.tokens = 0
+        self.expires = 0.0
+        self.blocked_until = 0.0
+        self.refill = None
+
+
+class RateLimiter:
+    def __init__(self, client=redisdb.client, rules=None, lease_seconds=LEASE_SECONDS, enabled=ENABLED):
+        self.client = client
+        self.rules = dict(DEFAULT_RULES)
+        self.rules.update(rules if rules is not None else parse_rules(os.environ.get("GUVERCIN_RATE_LIMITS", "")))
+        self.lease_seconds = lease_seconds
+        self.enabled = enabled
+        self._leases = {}
+
+    def _lease_size(self, rule: str) -> int:
+        rate, burst = self.rules[rule]
+        return max(1, min(int(burst), int(rate * self.lease_seconds)))
+
+    async def acquire(self, rule: str, key: str) -> float:
+        """Bir jeton harcar. Kabul edilirse 0, edilmezse yeniden deneme süresini (sn) döner."""
+        if not self.enabled:
+            return 0
+        lease_key = (rule, key)
+        while True:
+            now = time.monotonic()
+            lease = self._leases.get(lease_key)
+            if lease is None:
+                if len(self._leases) >= MAX_LOCAL_KEYS:
+                    self._prune(now)
+                lease = self._leases[lease_key] = _Lease()
+            if lease.blocked_until > now:
+                DECISIONS.labels(rule, "limited").inc()
+                return lease.blocked_until - now
+            if lease.tokens > 0 and lease.expires > now:
+                lease.tokens -= 1
+                DECISIONS.labels(rule, "allowed").inc()
+                return 0
+            # Aynı anahtar için eşzamanlı istekler tek dolumu bekler
+            if lease.refill is None:
+                lease.refill = asyncio.ensure_future(self._refill(rule, key, lease))
+            # Bekleyenlerden biri iptal edilirse dolum diğerleri için sürer
+            await asyncio.shield(lease.refill)
+
+    async def peek(self, rule: str, key: str) -> float:
+        """Jeton harcamadan bakar. Kovada jeton varsa 0, yoksa yeniden deneme süresini (sn) döner."""
+        if not self.enabled:
+            return 0
+        now = time.monotonic()
+        lease = self._leases.get((rule, key))
+        if lease is not None:
+            if lease.blocked_until > now:
+                return lease.blocked_until - now
+            if lease.tokens > 0 and lease.expires > now:
+                return 0
+        rate, burst = self.rules[rule]
+        REDIS_CALLS.labels(rule).inc()
+        try:
+            _, retry_after = await self.client.eval(_TAKE_SCRIPT, 1, bucket_key(rule, key), rate, burst, 0)
+        except Exception as e:
+            logger.warning("Hız sınırı kovası okunamadı (%s): %s", rule, e)
+            DECISIONS.labels(rule, "error").inc()
+            return 0
+        return int(retry_after) / 1000
+
+    async def _refill(self, rule: str, key: str, lease: _Lease):
+        rate, burst = self.rules[rule]
+        wanted = self._lease_size(rule)
+        REDIS_CALLS.labels(rule).inc()
+        try:
+            granted, retry_after = await self.client.eval(_TAKE_SCRIPT, 1, bucket_key(rule, key),
+                                                          rate, burst, wanted)
+        except Exception as e:
+            # Her kira yenilemesinde tekrarlanır; iz yerine tek satır
+            logger.warning("Hız sınırı kovası okunamadı (%s): %s", rule, e)
+            DECISIONS.labels(rule, "error").inc()
+            granted, retry_after = wanted, 0
+        finally:
+            lease.refill = None
+        now = time.monotonic()
+        lease.tokens = int(granted)
+        lease.expires = now + self.lease_seconds
+        if not granted:
+            lease.blocked_until = now + int(retry_after) / 1000
+
+    def _prune(self, now: float):
+        stale = [key for key, lease in self._leases.items()
+                 if lease.refill is None and lease.expires <= now and lease.blocked_until <= now]
+        for key in stale:
+            del self._leases[key]
+
+
+limiter = RateLimiter()
+
+
+async def check(rule: str, key: str):
+    """Sınır aşılmışsa RateLimited fırlatır (install ile 429'a çevrilir)."""
+    retry_after = await limiter.acquire(rule, key)
+    if retry_after:
+        raise RateLimited(rule, retry_after)
+
+
+async def ensure_available(rule: str, key: str):
+    """
+    Jeton harcamadan, kova boşsa RateLimited fırlatır. Yalnızca başarısız
+    denemelerin sayıldığı kurallar için charge ile birlikte kullanılır.
+    """
+    retry_after = await limiter.peek(rule, key)
+    if retry_after:
+        DECISIONS.labels(rule, "limited").inc()
+        raise RateLimited(rule, retry_after)
+
+
+async def charge(rule: str, key: str):
+    """Bir jeton harcar; kova boş olsa da hata fırlatmaz (bir sonraki ensure_available reddeder)."""
+    await limiter.acquire(rule, key)
+
+
+def limit(rule: str, by: str = "ip"):
+    """
+    Route bağımlılığı: by="ip" istemci IP'sine, aksi halde adı verilen yol
+    parametresine (ör. "username") göre sınırlar.
+    """
+    async def dependency(request: Request):
+        await check(rule, client_ip(request) if by == "ip" else request.path_params[by])
+    return Depends(dependency)
+
+
+async def _rate_limited(request: Request, exc: RateLimited):
+    retry_after = max(1, math.ceil(exc.retry_after))
+    return JSONResponse(
+        status_code=429,
+        content={"error": "Çok fazla istek, lütfen daha sonra tekrar deneyin.", "retry_after": retry_after},
+        headers={"Retry-After": str(retry_after)}
+    )
+
+
+def install(app: FastAPI):
+    app.add_exception_handler(RateLimited, _rate_limited)
+
+
+async def admit(websocket, rule: str, key: str) -> bool:
+    """Kabul edilmiş soketi sınır aşılmışsa 1013 ile kapatır."""
+    if not await limiter.acquire(rule, key):
+        return True
+    DECISIONS.labels(rule, "closed").inc()
+    await websocket.close(code=WS_TRY_AGAIN_LATER)
+    return False
+
+
+class FrameLimiter:
+    """
+    Soket başına çerçeve sınırı. client_id taşıyan her reddedilen çerçeve için
+    istemciye {"type": "rate_limited", "retry_after", "client_id"} gider; böylece
+    istemci bekleyen mesajı başarısız sayabilir. client_id'siz çerçevelerde
+    yalnızca ilk retteki bildirim gönderilir. Arka arkaya WS_STRIKES çerçeve
+    reddedilirse soket 1013 ile kapatılır.
+    """
+
+    def __init__(self, websocket, connection, rule: str, key: str, strikes: int = WS_STRIKES):
+        self.websocket = websocket
+        self.connection = connection
+        self.rule = rule
+        self.key = key
+        self.max_strikes = strikes
+        self.strikes = 0
+
+    async def admit(self, frame: dict = None) -> bool:
+        retry_after = await limiter.acquire(self.rule, self.key)
+        if not retry_after:
+            self.strikes = 0
+            return True
+        self.strikes += 1
+        client_id = frame.get("client_id") if frame else None
+        if client_id is not None or self.strikes == 1:
+            reject = {"type": "rate_limited", "retry_after": math.ceil(retry_after * 1000) / 1000}
+            if client_id is not None:
+                reject["client_id"] = client_id
+            await self.connection.send(reject)
+        if self.strikes >= self.max_strikes:
+            DECISIONS.labels(self.rule, "closed").inc()
+            await self.websocket.close(code=WS_TRY_AGAIN_LATER)
+            raise WebSocketDisconnect(WS_TRY_AGAIN_LATER)
+        return False
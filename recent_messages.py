@@ -0,0 +1,343 @@
+"""
+Konuşma başına son mesajlar için Redis Stream önbelleği (sıcak katman).
+
+Sohbet açılırken istenen ilk sayfa (get_messages?limit=N) çoğunlukla son birkaç
+düzine mesajdır. Her konuşmanın son GUVERCIN_HOT_WINDOW mesajı bir Redis
+stream'inde tutulur; ilk sayfa buradan okunur, daha eski sayfalar MySQL'den
+(soğuk katman) gelir.
+
+    recent:{a}:{b}               -> stream; mesaj satırları (a < b)
+    recent:{a}:{b}:first         -> konuşmanın ilk mesajının ID'si (biliniyorsa)
+    recent:{a}:{b}:status        -> delivered/seen değişiklikleri (aşağıda)
+    recent:{a}:{b}:deleted:{u}   -> u kullanıcısının sildiği mesaj ID'leri
+
+Mesajlar INSERT'ten hemen sonra XADD ile, mesaj ID'sinden türetilen stream
+ID'siyle ({id}-0) eklenir; böylece stream sırası mesaj sırasıdır ve MAXLEN
+kırpması her zaman en küçük ID'leri atar. Farklı worker'lardan sırasız gelen
+bir ekleme (stream'in sonundan küçük ID) reddedilir; konuşmanın anahtarları
+silinir ve sonraki okumada MySQL'den doldurulur. GUVERCIN_HOT_WINDOW_AGE'den
+eski kayıtlar okurken yok sayılır. Stream her zaman en eski kaydından itibaren
+kesintisizdir, bu yüzden bir sayfa ancak şu durumda buradan verilir:
+
+    - kullanıcının silmediği kayıtlar sayfayı doldurmaya yetiyorsa, ya da
+    - en eski kayıt konuşmanın ilk mesajıysa (first).
+
+Aksi halde MySQL'e düşülür ve stream arka planda MySQL'den doldurulur.
+Eklemeden sonraki delivered/seen güncellemeleri status hash'inde tutulur:
+"seen:{sender}" / "delivered:{sender}" aralık üst sınırları, "s:{id}" / "d:{id}" tek mesaj.
+Status hash'i STATUS_LIMIT alanı aşarsa konuşmanın anahtarları silinir ve bir
+sonraki okumada MySQL'den yeniden doldurulur.
+
+İsabet oranı guvercin_hot_window_requests_total{result} ile izlenir.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+from redis.exceptions import ResponseError
+
+import conversations
+import metrics
+from connectdb import run_in_db
+
+WINDOW = int(os.environ.get("GUVERCIN_HOT_WINDOW", "100"))
+MAX_AGE = int(os.environ.get("GUVERCIN_HOT_WINDOW_AGE", str(7 * 24 * 60 * 60)))  # saniye
+STATUS_LIMIT = WINDOW * 4
+
+# Stream'de saklanan alanlar; None değerler yazılmaz
+FIELDS = ("id", "sender", "receiver", "type", "content", "file_url", "file_name", "mime_type", "timestamp",
+          "delivered", "seen")
+
+REQUESTS = metrics.Counter("guvercin_hot_window_requests_total", "İlk sayfa isteklerinin sıcak katman sonucu",
+                           ("result",))
+BACKFILLS = metrics.Counter("guvercin_hot_window_backfills_total", "MySQL'den doldurulan konuşmalar")
+
+logger = logging.getLogger(__name__)
+
+# Aralık üst sınırı yalnızca büyüyebilir
+_MAX_SCRIPT = """
+local current = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+if tonumber(ARGV[2]) > current then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+"""
+
+# Stream yoksa doldurur; bu arada canlı bir XADD olduysa dokunmaz
+# KEYS: stream, first, deleted:{a}, deleted:{b}
+# ARGV: ttl, first (boş olabilir), kayıtlar (genişlik, stream ID, alan, değer, ...), "|",
+#       a'nın silinenleri, "|", b'nin silinenleri, "|"
+_BACKFILL_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+local ttl = ARGV[1]
+local i = 3
+while ARGV[i] ~= '|' do
+    local width = tonumber(ARGV[i])
+    redis.call('XADD', KEYS[1], ARGV[i + 1], unpack(ARGV, i + 2, i + width))
+    i = i + width + 1
+end
+i = i + 1
+for k = 3, 4 do
+    while ARGV[i] ~= '|' do
+        redis.call('SADD', KEYS[k], ARGV[i])
+        redis.call('EXPIRE', KEYS[k], ttl)
+        i = i + 1
+    end
+    i = i + 1
+end
+if ARGV[2] ~= '' then
+    redis.call('SET', KEYS[2], ARGV[2], 'EX', ttl)
+end
+redis.call('EXPIRE', KEYS[1], ttl)
+return 1
+"""
+
+# Konuşmanın son mesajları; silinenler burada elenmez, kullanıcı başına ayrıca okunur
+_BACKFILL_SELECT = f"SELECT {', '.join('m.' + field for field in FIELDS)} FROM messages m"
+
+# Aynı konuşmanın eşzamanlı doldurulmasını engeller
+_backfilling = set()
+
+
+def stream_key(user1: str, user2: str) -> str:
+    a, b = sorted((user1, user2))
+    return f"recent:{a}:{b}"
+
+
+def conversation_keys(user1: str, user2: str) -> list:
+    """Konuşmanın sıcak katmandaki tüm anahtarları (hesap silme için)."""
+    key = stream_key(user1, user2)
+    return [key, f"{key}:first", f"{key}:status", f"{key}:deleted:{user1}", f"{key}:deleted:{user2}"]
+
+
+def entry_id(message_id) -> str:
+    return f"{int(message_id)}-0"
+
+
+def _entry(row: dict) -> dict:
+    entry = {}
+    for field in FIELDS:
+        value = row.get(field)
+        if value is None:
+            continue
+        if field == "timestamp" and isinstance(value, datetime):
+            # MySQL'den gelen tarihler saat dilimsizdir ve UTC'dir
+            value = (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+        elif isinstance(value, bool):
+            value = int(value)
+        entry[field] = value
+    return entry
+
+
+def _row(entry: dict) -> dict:
+    # MySQL satırlarıyla aynı biçim: tarih saat dilimsiz UTC, bayraklar 0/1
+    row = {field: entry.get(field) for field in FIELDS}
+    row["id"] = int(row["id"])
+    row["delivered"] = int(row["delivered"] or 0)
+    row["seen"] = int(row["seen"] or 0)
+    if row["timestamp"] is not None:
+        row["timestamp"] = datetime.fromtimestamp(float(row["timestamp"]), timezone.utc).replace(tzinfo=None)
+    return row
+
+
+async def append(client, row: dict):
+    """
+    Yeni mesajı konuşmanın stream'ine ekler ve stream'i kırpar. Ekleme
+    başarısız olursa stream'de boşluk kalmaması için konuşma anahtarları silinir.
+    """
+    key = stream_key(row["sender"], row["receiver"])
+    pipe = client.pipeline(transaction=False)
+    # Sırasız ID'de XADD hata verir; execute istisna fırlatır ve konuşma silinir
+    pipe.xadd(key, _entry(row), id=entry_id(row["id"]))
+    pipe.xtrim(key, maxlen=WINDOW, approximate=True)
+    pipe.expire(key, MAX_AGE)
+    pipe.expire(f"{key}:first", MAX_AGE)
+    pipe.hlen(f"{key}:status")
+    try:
+        results = await pipe.execute()
+        if results[-1] > STATUS_LIMIT:
+            await client.unlink(*conversation_keys(row["sender"], row["receiver"]))
+    except Exception as e:
+        if isinstance(e, ResponseError):
+            # Sırasız ekleme beklenen bir durumdur; konuşma yeniden doldurulur
+            logger.info("Mesaj sıcak katmana eklenemedi: %s (%s)", key, e)
+        else:
+            logger.exception("Mesaj sıcak katmana eklenemedi: %s", key)
+        try:
+            await client.unlink(*conversation_keys(row["sender"], row["receiver"]))
+        except Exception:
+            pass
+
+
+async def _update_status(client, sender: str, receiver: str, field: str, value):
+    key = f"{stream_key(sender, receiver)}:status"
+    try:
+        await client.eval(_MAX_SCRIPT, 1, key, field, value, MAX_AGE)
+    except Exception:
+        logger.exception("Sıcak katman durumu güncellenemedi: %s", key)
+
+
+async def seen_up_to(client, sender: str, receiver: str, up_to: int):
+    await _update_status(client, sender, receiver, f"seen:{sender}", up_to)
+
+
+async def delivered_up_to(client, sender: str, receiver: str, up_to: int):
+    await _update_status(client, sender, receiver, f"delivered:{sender}", up_to)
+
+
+async def mark_seen(client, sender: str, receiver: str, message_id: int, seen: bool):
+    key = f"{stream_key(sender, receiver)}:status"
+    pipe = client.pipeline(transaction=False)
+    pipe.hset(key, f"s:{message_id}", int(bool(seen)))
+    pipe.expire(key, MAX_AGE)
+    try:
+        await pipe.execute()
+    except Exception:
+        logger.exception("Sıcak katman durumu güncellenemedi: %s", key)
+
+
+async def mark_delivered(client, sender: str, receiver: str, message_id: int):
+    key = f"{stream_key(sender, receiver)}:status"
+    pipe = client.pipeline(transaction=False)
+    pipe.hset(key, f"d:{message_id}", 1)
+    pipe.expire(key, MAX_AGE)
+    try:
+        await pipe.execute()
+    except Exception:
+        logger.exception("Sıcak katman durumu güncellenemedi: %s", key)
+
+
+async def mark_deleted(client, user: str, peer: str, message_id: int):
+    key = f"{stream_key(user, peer)}:deleted:{user}"
+    pipe = client.pipeline(transaction=False)
+    pipe.sadd(key, message_id)
+    pipe.expire(key, MAX_AGE)
+    try:
+        await pipe.execute()
+    except Exception:
+        # Silinen mesaj önbellekten gösterilmesin; konuşma yeniden doldurulur
+        logger.exception("Silme sıcak katmana yazılamadı: %s", key)
+        await client.unlink(*conversation_keys(user, peer))
+
+
+def _apply_status(row: dict, status: dict):
+    sender = row["sender"]
+    message_id = row["id"]
+    if f"d:{message_id}" in status or message_id <= int(status.get(f"delivered:{sender}", 0)):
+        row["delivered"] = 1
+    seen = status.get(f"s:{message_id}")
+    if seen is not None:
+        row["seen"] = int(seen)
+    elif message_id <= int(status.get(f"seen:{sender}", 0)):
+        row["seen"] = 1
+
+
+async def first_page(client, user1: str, user2: str, limit: int):
+    """
+    user1'in gördüğü son `limit` mesajı eskiden yeniye döner: (rows, has_more).
+    Sıcak katman sayfayı kesin olarak veremiyorsa None döner.
+    """
+    key = stream_key(user1, user2)
+    pipe = client.pipeline(transaction=False)
+    pipe.xrevrange(key, count=WINDOW * 2)
+    pipe.get(f"{key}:first")
+    pipe.hgetall(f"{key}:status")
+    pipe.smembers(f"{key}:deleted:{user1}")
+    try:
+        entries, first, status, deleted = await pipe.execute()
+    except Exception:
+        logger.exception("Sıcak katman okunamadı: %s", key)
+        REQUESTS.labels("error").inc()
+        return None
+
+    # Yaşı dolmuş ama henüz kırpılmamış kayıtlar yok sayılır (silme kümeleri de aynı sürede sona erer);
+    # kalan kayıtlar en yeni eski kayıttan sonraki kesintisiz sondur
+    min_ts = time.time() - MAX_AGE
+    entries.reverse()
+    start = 0
+    for index, (_, fields) in enumerate(entries):
+        if float(fields.get("timestamp", 0)) < min_ts:
+            start = index + 1
+    fresh = entries[start:]
+    if not fresh:
+        REQUESTS.labels("miss").inc()
+        return None
+
+    rows = [_row(fields) for _, fields in fresh]
+    complete = (start == 0 and len(entries) < WINDOW * 2
+                and first is not None and rows[0]["id"] == int(first))
+    visible = [row for row in rows if str(row["id"]) not in deleted]
+
+    if len(visible) > limit:
+        has_more = True
+    elif complete:
+        has_more = False
+    else:
+        REQUESTS.labels("miss").inc()
+        return None
+
+    REQUESTS.labels("hit").inc()
+    page = visible[-limit:]
+    for row in page:
+        _apply_status(row, status)
+    return page, has_more
+
+
+def _load_conversation(conn, cursor, user1: str, user2: str, limit: int):
+    cursor.execute(*conversations.pair_query(_BACKFILL_SELECT, (), user1, user2, limit=limit + 1))
+    rows = cursor.fetchall()
+    complete = len(rows) <= limit
+    rows = rows[:limit]
+    rows.reverse()
+    deleted = {user1: [], user2: []}
+    if rows:
+        ids = [row["id"] for row in rows]
+        cursor.execute(
+            f"SELECT message_id, user FROM deleted_messages WHERE message_id IN ({', '.join(['%s'] * len(ids))})",
+            ids
+        )
+        for row in cursor.fetchall():
+            if row["user"] in deleted:
+                deleted[row["user"]].append(row["message_id"])
+    return rows, complete, deleted
+
+
+async def backfill(client, user1: str, user2: str):
+    """Stream'i MySQL'deki son WINDOW mesajla doldurur (stream yoksa)."""
+    key = stream_key(user1, user2)
+    if key in _backfilling:
+        return
+    _backfilling.add(key)
+    try:
+        if await client.exists(key):
+            return
+        rows, complete, deleted = await run_in_db(_load_conversation, user1, user2, WINDOW)
+        if not rows:
+            return
+        args = [MAX_AGE, rows[0]["id"] if complete else ""]
+        for row in rows:
+            entry = _entry(row)
+            args.extend((len(entry) * 2 + 1, entry_id(row["id"])))
+            for field, value in entry.items():
+                args.extend((field, value))
+        args.append("|")
+        args.extend(deleted[user1])
+        args.append("|")
+        args.extend(deleted[user2])
+        args.append("|")
+        keys = [key, f"{key}:first", f"{key}:deleted:{user1}", f"{key}:deleted:{user2}"]
+        if await client.eval(_BACKFILL_SCRIPT, len(keys), *keys, *args):
+            BACKFILLS.inc()
+    except Exception:
+        logger.exception("Sıcak katman doldurulamadı: %s", key)
+    finally:
+        _backfilling.discard(key)
+
+
+def schedule_backfill(client, user1: str, user2: str):
+    # İsteği bekletmemek için arka planda
+    asyncio.get_running_loop().create_task(backfill(client, user1, user2))
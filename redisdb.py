@@ -0,0 +1,118 @@
+"""
+Paylaşılan async Redis erişimi.
+
+Tüm servisler süreç başına tek bir bağlantı havuzu kullanır; handler'lar Redis'i
+beklerken event loop'u bloklamaz. Havuz doluysa yeni komut en fazla
+GUVERCIN_REDIS_POOL_TIMEOUT saniye boş bağlantı bekler.
+
+Yanıtlar str olarak çözülür (decode_responses=True). Birden fazla anahtara
+dokunan işlemler için aşağıdaki yardımcılar komutları tek pipeline'da, tek
+gidiş-dönüşle gönderir.
+
+Her komutun süresi metrics.REDIS_LATENCY'ye komut adıyla, pipeline'lar ise
+"pipeline" etiketiyle tek gözlem olarak yazılır.
+"""
+import os
+import time
+
+import redis.asyncio as aioredis
+from redis.asyncio.client import Pipeline
+
+import metrics
+
+REDIS_URL = os.environ.get("GUVERCIN_REDIS_URL", "redis://localhost:6379/0")
+MAX_CONNECTIONS = int(os.environ.get("GUVERCIN_REDIS_MAX_CONNECTIONS", "64"))
+POOL_TIMEOUT = float(os.environ.get("GUVERCIN_REDIS_POOL_TIMEOUT", "5"))
+# Bir pipeline'da gönderilecek en fazla komut; çok büyük yanıtlar Redis'i bekletmesin
+PIPELINE_CHUNK = 500
+
+
+class _InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        start = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            metrics.REDIS_LATENCY.labels("pipeline").observe(time.perf_counter() - start)
+
+
+class InstrumentedRedis(aioredis.Redis):
+    """Komut sürelerini ölçen Redis istemcisi."""
+
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            metrics.REDIS_LATENCY.labels(str(args[0]).upper()).observe(time.perf_counter() - start)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> Pipeline:
+        return _InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+pool = aioredis.BlockingConnectionPool.from_url(
+    REDIS_URL,
+    max_connections=MAX_CONNECTIONS,
+    timeout=POOL_TIMEOUT,
+    decode_responses=True,
+    health_check_interval=30,
+)
+client = InstrumentedRedis(connection_pool=pool)
+
+
+def _chunks(items, size=PIPELINE_CHUNK):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+async def hget_many(client, keys, field: str) -> list:
+    """Her anahtardaki aynı alanı okur; sonuçlar anahtar sırasıyla döner."""
+    results = []
+    for chunk in _chunks(list(keys)):
+        pipe = client.pipeline(transaction=False)
+        for key in chunk:
+            pipe.hget(key, field)
+        results.extend(await pipe.execute())
+    return results
+
+
+async def hgetall_many(client, keys) -> list:
+    results = []
+    for chunk in _chunks(list(keys)):
+        pipe = client.pipeline(transaction=False)
+        for key in chunk:
+            pipe.hgetall(key)
+        results.extend(await pipe.execute())
+    return results
+
+
+async def unlink_many(client, keys) -> int:
+    """Anahtarları UNLINK ile siler (bellek arka planda boşaltılır); silinen sayıyı döner."""
+    removed = 0
+    for chunk in _chunks(list(keys)):
+        removed += await client.unlink(*chunk)
+    return removed
+
+
+async def scan_unlink(client, pattern: str, count: int = 1000) -> int:
+    """
+    Desene uyan anahtarları SCAN ile bulup siler. KEYS'in aksine Redis'i uzun
+    süre bloklamaz; her SCAN sayfası tek bir UNLINK ile silinir.
+    """
+    removed = 0
+    cursor = 0
+    while True:
+        cursor, keys = await client.scan(cursor, match=pattern, count=count)
+        if keys:
+            removed += await client.unlink(*keys)
+        if cursor == 0:
+            return removed
+
+
+async def ping() -> bool:
+    return bool(await client.ping())
+
+
+async def close():
+    await client.aclose()
+    await pool.disconnect()
@@ -1,77 +1,94 @@
-from flask import Flask, request, jsonify
-import redis
+from fastapi import FastAPI, Body
+from fastapi.responses import JSONResponse
 import uuid
+import uvicorn
 
-app = Flask(__name__)
+import metrics
+import ratelimit
+import redisdb
+import user_index
+import passwords
 
-# Redis bağlantısı
-redis_client = redis.StrictRedis(host='localhost', port=6379, decode_responses=True)
+app = FastAPI()
+metrics.install(app)
+ratelimit.install(app)
 
-@app.route('/register', methods=['POST'])
-def register_user():
+# Paylaşılan async Redis havuzu
+redis_client = redisdb.client
+
+@app.post('/register', dependencies=[ratelimit.limit('register_ip')])
+async def register_user(data: dict = Body(...)):
     try:
         # Gelen veriyi al
-        data = request.get_json()
         username = data.get('username')
         password = data.get('password')
         fcm_token = data.get('fcm')
         public_key = data.get('public_key')
 
-        # Kullanıcı adı kontrolü
-        if any(username in entry.split(':')[0] for entry in redis_client.smembers('users')):
-            return jsonify({'error': 'Kullanıcı zaten mevcut.'}), 400
+        if not username or not password:
+            return JSONResponse(status_code=400, content={'error': 'Kullanıcı adı ve şifre gereklidir.'})
+
+        # Pahalı özetlemeden önce ucuz ön kontrol; asıl kontrol claim_username'de
+        if await user_index.user_exists(redis_client, username):
+            return JSONResponse(status_code=400, content={'error': 'Kullanıcı zaten mevcut.'})
+
+        # Parola süreç havuzunda özetlenir
+        try:
+            password_hash = await passwords.hash_password(password)
+        except passwords.Overloaded:
+            return JSONResponse(status_code=503, content={'error': 'Sunucu yoğun, lütfen tekrar deneyin.'})
 
         # Benzersiz bir UUID oluştur
         user_id = str(uuid.uuid4())
 
+        # Kullanıcı adını atomik olarak sahiplen (username:user_id indeksi)
+        if not await user_index.claim_username(redis_client, username, user_id):
+            return JSONResponse(status_code=400, content={'error': 'Kullanıcı zaten mevcut.'})
+
         # Kullanıcı bilgilerini sakla
         user_data = {
             'username': username,
-            'password': password,  # Şifre hashlenebilir
+            'password': password_hash,  # argon2id özeti
             'fcm_token': fcm_token,
             'public_key': public_key
         }
 
-        # Redis'e kullanıcı ekle
-        redis_client.sadd('users', f'{username}:{user_id}')  # username:user_id formatında sakla
-        redis_client.hmset(f'user:{username}', user_data)   # Kullanıcı bilgilerini hash olarak sakla
+        # Redis'e kullanıcı ekle (gönderilmeyen alanlar yazılmaz)
+        await redis_client.hset(f'user:{username}', mapping={k: v for k, v in user_data.items() if v is not None})
 
-        return jsonify({'message': 'Kullanıcı başarıyla kaydedildi.', 'user_id': user_id}), 201
+        return JSONResponse(status_code=201, content={'message': 'Kullanıcı başarıyla kaydedildi.', 'user_id': user_id})
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return JSONResponse(status_code=500, content={'error': str(e)})
 
 
-@app.route('/get_user_id/<username>', methods=['GET'])
-def get_user_id(username):
+@app.get('/get_user_id/{username}', dependencies=[ratelimit.limit('lookup_ip')])
+async def get_user_id(username: str):
     try:
         # Kullanıcı adıyla ilişkili ID'yi bul
-        for entry in redis_client.smembers('users'):
-            stored_username, stored_user_id = entry.split(':')
-            if stored_username == username:
-                return jsonify({'user_id': stored_user_id}), 200
+        stored_user_id = await user_index.get_user_id(redis_client, username)
+        if stored_user_id:
+            return {'user_id': stored_user_id}
 
-        return jsonify({'error': 'Kullanıcı bulunamadı.'}), 404
+        return JSONResponse(status_code=404, content={'error': 'Kullanıcı bulunamadı.'})
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return JSONResponse(status_code=500, content={'error': str(e)})
 
 
-@app.route('/get_username/<user_id>', methods=['GET'])
-def get_username(user_id):
+@app.get('/get_username/{user_id}', dependencies=[ratelimit.limit('lookup_ip')])
+async def get_username(user_id: str):
     try:
         # Kullanıcı ID'siyle ilişkili adı bul
-        for entry in redis_client.smembers('users'):
-            stored_username, stored_user_id = entry.split(':')
-            if stored_user_id == user_id:
-                return jsonify({'username': stored_username}), 200
+        stored_username = await user_index.get_username(redis_client, user_id)
+        if stored_username:
+            return {'username': stored_username}
 
-        return jsonify({'error': 'Kullanıcı bulunamadı.'}), 404
+        return JSONResponse(status_code=404, content={'error': 'Kullanıcı bulunamadı.'})
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return JSONResponse(status_code=500, content={'error': str(e)})
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
-
+    uvicorn.run(app, host='0.0.0.0', port=5000)
@@ -0,0 +1,198 @@
+"""
+Worker'lar arası WebSocket yönlendirmesi.
+
+Her worker kendi süreçindeki bağlantıları `local` sözlüğünde tutar ve bu
+kullanıcıların Redis kanalına abone olur. Bir kullanıcının birden fazla soketi
+(cihazı) olabilir; mesaj hepsine yazılır. En fazla MAX_SOCKETS_PER_USER soket
+tutulur, fazlasında en eskisi kapatılır. Yerel sokete yazma her bağlantının
+kendi gönderim kuyruğu üzerinden yapılır (bkz. connection.py). Kullanıcının
+soketleri farklı worker'larda olabileceğinden her mesaj yerel soketlere
+doğrudan yazılır ve ayrıca tek bir PUBLISH ile diğer worker'lara iletilir;
+gönderen worker kendi yayınını atlar:
+
+    ws:{namespace}:{username}   -> kullanıcıya özel kanal
+    ws:{namespace}:__all__      -> o namespace'teki tüm bağlantılar
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+
+import redis.asyncio as aioredis
+from fastapi import WebSocket
+
+import metrics
+import protocol
+from connection import Connection
+from redisdb import REDIS_URL
+
+BROADCAST = "__all__"
+MAX_SOCKETS_PER_USER = int(os.environ.get("GUVERCIN_WS_MAX_SOCKETS_PER_USER", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+class Router:
+    def __init__(self, namespace: str, redis_url: str = REDIS_URL, presence=None):
+        self.namespace = namespace
+        # Kendi yayınlarımızı pub/sub'dan tekrar teslim etmemek için
+        self.worker_id = uuid.uuid4().hex
+        self.local: dict[str, list[Connection]] = {}
+        # Soketler açılıp kapanırken çevrimiçi durumu güncellenir (bkz. presence.py)
+        self.presence = presence
+        self._redis = aioredis.Redis.from_url(redis_url)
+        self._pubsub = None
+        self._listener = None
+        # Mesaj bir sokete yazıldığında: async on_delivered(username, payload, remote)
+        # remote=True ise mesaj başka bir worker'dan pub/sub ile gelmiştir.
+        self.on_delivered = None
+        # Mesaj hiçbir sokete yazılamadığında: async on_failed(username, payload)
+        self.on_failed = None
+        metrics.WS_CONNECTIONS.labels(namespace).set_function(
+            lambda: sum(len(connections) for connections in self.local.values()))
+        # Mesaj yolunda etiket araması yapılmasın diye alt sayaçlar önceden alınır
+        self._sent_local = metrics.WS_MESSAGES.labels(namespace, "local")
+        self._sent_remote = metrics.WS_MESSAGES.labels(namespace, "remote")
+        self._sent_offline = metrics.WS_MESSAGES.labels(namespace, "offline")
+        self._sent_failed = metrics.WS_MESSAGES.labels(namespace, "failed")
+
+    def _channel(self, username: str) -> str:
+        return f"ws:{self.namespace}:{username}"
+
+    async def start(self):
+        self._pubsub = self._redis.pubsub()
+        await self._pubsub.subscribe(self._channel(BROADCAST))
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        for connections in list(self.local.values()):
+            for connection in list(connections):
+                await connection.close()
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        await self._redis.aclose()
+
+    async def register(self, username: str, websocket: WebSocket, codec=protocol.JSON) -> Connection:
+        """
+        Soketi kendi gönderim kuyruğuyla kaydeder. Handler kendi soketine de
+        dönen bağlantı üzerinden yazmalıdır. Çerçeveler codec ile kodlanır.
+        """
+        async def on_sent(payload, remote):
+            if self.on_delivered:
+                await self.on_delivered(username, payload, remote)
+
+        async def on_failed(payload):
+            if self.on_failed:
+                await self.on_failed(username, payload)
+
+        connection = Connection(websocket, username, on_sent=on_sent, on_failed=on_failed, codec=codec)
+        connections = self.local.setdefault(username, [])
+        connections.append(connection)
+        if len(connections) == 1:
+            await self._pubsub.subscribe(self._channel(username))
+        if len(connections) > MAX_SOCKETS_PER_USER:
+            # En eski soket kapatılır; handler'ı unregister ile listeden çıkarır
+            oldest = connections[0]
+            await oldest.close()
+            try:
+                await oldest.websocket.close(code=1000)
+            except Exception:
+                pass
+        if self.presence:
+            await self.presence.connect(username, self.presence.socket_id(connection))
+        return connection
+
+    async def unregister(self, username: str, connection: Connection):
+        await connection.close()
+        if self.presence:
+            await self.presence.disconnect(username, self.presence.socket_id(connection))
+        connections = self.local.get(username)
+        if connections is None or connection not in connections:
+            return
+        connections.remove(connection)
+        if not connections:
+            del self.local[username]
+            await self._pubsub.unsubscribe(self._channel(username))
+
+    def stats(self) -> dict:
+        """Bağlantı başına kuyruk derinliği ve gönderim sayaçları."""
+        return {username: [connection.stats() for connection in connections]
+                for username, connections in self.local.items()}
+
+    async def send(self, username: str, payload: dict) -> bool:
+        """
+        Mesajı kullanıcının bu worker'daki soketlerine yazar ve diğer
+        worker'lardaki soketleri için kanalına publish eder. Kullanıcının hiçbir
+        soketine ulaşılamazsa False döner.
+        """
+        subscribed = username in self.local
+        delivered = subscribed and await self._deliver(username, payload, remote=False, report=False)
+        receivers = await self._redis.publish(self._channel(username),
+                                              json.dumps({"origin": self.worker_id, "payload": payload}))
+        # Bu worker'ın kendi aboneliği sayılmaz
+        if receivers - (1 if subscribed else 0) > 0:
+            self._sent_remote.inc()
+            return True
+        if delivered:
+            return True
+        if subscribed:
+            self._sent_failed.inc()
+        else:
+            self._sent_offline.inc()
+        if self.on_failed:
+            await self.on_failed(username, payload)
+        return False
+
+    async def broadcast(self, payload: dict):
+        await self._redis.publish(self._channel(BROADCAST), json.dumps({"payload": payload}))
+
+    async def _deliver(self, username: str, payload: dict, remote: bool, report: bool = True) -> bool:
+        # Mesaj kullanıcının soketlerinin kuyruklarına eklenir; on_delivered sokete yazıldıktan sonra çağrılır
+        delivered = False
+        for connection in list(self.local.get(username, ())):
+            # Pub/sub dinleyicisi tüm kullanıcılar için ortaktır; orada kuyruk beklenmez
+            if await connection.send(payload, remote, wait=not remote):
+                delivered = True
+        if delivered:
+            self._sent_local.inc()
+            return True
+        if report:
+            self._sent_failed.inc()
+            if self.on_failed:
+                await self.on_failed(username, payload)
+        return False
+
+    async def _listen(self):
+        prefix = f"ws:{self.namespace}:"
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Redis pub/sub okunamadı")
+                await asyncio.sleep(1)
+                continue
+            if message is None:
+                continue
+
+            channel = message["channel"].decode()
+            envelope = json.loads(message["data"])
+            if envelope.get("origin") == self.worker_id:
+                continue
+            payload = envelope["payload"]
+            username = channel[len(prefix):]
+            if username == BROADCAST:
+                for local_user in list(self.local):
+                    await self._deliver(local_user, payload, remote=True)
+            else:
+                await self._deliver(username, payload, remote=True)
@@ -1,26 +1,70 @@
-from flask import Flask, jsonify, request
-import redis
+from typing import Optional
+import os
+import time
 
-app = Flask(__name__)
+from fastapi import FastAPI, Query
+from fastapi.responses import JSONResponse
+import uvicorn
 
-# Redis bağlantısını kuruyoruz
-redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, decode_responses=True)
+import metrics
+import ratelimit
+import redisdb
+import user_index
 
-# Kullanıcı adı var mı kontrolü
-@app.route('/check_user', methods=['GET'])
-def check_user():
-    username = request.args.get('username')
+app = FastAPI()
+metrics.install(app)
+ratelimit.install(app)
+
+# Paylaşılan async Redis havuzu
+redis_client = redisdb.client
 
-    # 'users' set'ini alıyoruz
-    all_users = redis_client.smembers('users')
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+# Bu uzunluğa kadar olan öneklerin ilk sayfası süreç içinde önbelleğe alınır;
+# kısa önekler en sık yazılan ve en çok eşleşen tuş vuruşlarıdır
+CACHE_PREFIX_LENGTH = int(os.environ.get("GUVERCIN_SEARCH_CACHE_PREFIX_LENGTH", "2"))
+CACHE_TTL = float(os.environ.get("GUVERCIN_SEARCH_CACHE_TTL", "30"))
+CACHE_SIZE = 10_000
 
+# (katlanmış önek, limit) -> (son geçerlilik zamanı, sonuç)
+_search_cache = {}
+
+# Kullanıcı adı var mı kontrolü
+@app.get('/check_user', dependencies=[ratelimit.limit('lookup_ip')])
+async def check_user(username: Optional[str] = None):
     # Kullanıcı adıyla tam eşleşen bir kullanıcı var mı kontrol ediyoruz
-    for user in all_users:
-        if user.startswith(username + ":"):
-            return jsonify({"message": "Kullanıcı mevcut", "exists": True}), 200
+    if username and await user_index.user_exists(redis_client, username):
+        return {"message": "Kullanıcı mevcut", "exists": True}
 
-    return jsonify({"message": "Kullanıcı bulunamadı", "exists": False}), 404
+    return JSONResponse(status_code=404, content={"message": "Kullanıcı bulunamadı", "exists": False})
 
-if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5003)
+# Önekle kullanıcı arama (yazarken otomatik tamamlama)
+@app.get('/search_users', dependencies=[ratelimit.limit('search_ip')])
+async def search_users(
+    prefix: str = Query(..., min_length=1),
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT),
+    cursor: Optional[str] = None,
+):
+    """
+    Adı prefix ile başlayan kullanıcıları alfabetik sırayla döner. Büyük/küçük
+    harf ve Türkçe İ/I/ı farkı gözetilmez. Sonraki sayfa için dönen
+    next_cursor, cursor parametresiyle gönderilir.
+    """
+    cache_key = None
+    if cursor is None and len(prefix) <= CACHE_PREFIX_LENGTH:
+        cache_key = (user_index.fold(prefix), limit)
+        cached = _search_cache.get(cache_key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+    users, next_cursor = await user_index.search_prefix(redis_client, prefix, limit, cursor)
+    result = {"users": users, "next_cursor": next_cursor}
 
+    if cache_key is not None:
+        if len(_search_cache) >= CACHE_SIZE:
+            _search_cache.clear()
+        _search_cache[cache_key] = (time.monotonic() + CACHE_TTL, result)
+    return result
+
+if __name__ == '__main__':
+    uvicorn.run(app, host='0.0.0.0', port=5003)
@@ -1,32 +1,169 @@
-import subprocess
-
-# Flask servislerini çalıştıran Python dosyalarının yolları
-scripts = [
-    "chat.py",
-    "home.py",
-    "login.py",
-    "register.py",
-    "search.py"
-]
-
-processes = []
-
-# Her bir servisi çalıştır
-for script in scripts:
-    print(f"API başlatıldı: {script}...")
-    process = subprocess.Popen(
-        ["python3", script], 
-        stdout=subprocess.PIPE, 
-        stderr=subprocess.PIPE, 
-        text=True
+"""
+Tüm servisleri (gateway.py) birden fazla worker süreciyle çalıştıran gözetmen.
+
+Dinleme soketi gözetmende bir kez açılır ve her worker'a devredilir; çekirdek
+bağlantıları worker'lar arasında dağıtır. Worker'ların çıktıları doğrudan
+terminale akar.
+
+    GUVERCIN_WORKERS=4 python3 server.py
+
+Sinyaller:
+    SIGHUP          : worker'lar tek tek yeniden başlatılır (rolling restart);
+                      yenisi hazır olmadan eskisi durdurulmaz
+    SIGTERM/SIGINT  : tüm worker'lar bekleyen istekleri bitirip kapanır
+
+Beklenmedik şekilde ölen worker yeniden başlatılır.
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+import uvicorn
+
+HOST = os.environ.get("GUVERCIN_HOST", "0.0.0.0")
+PORT = int(os.environ.get("GUVERCIN_PORT", "8000"))
+WORKERS = int(os.environ.get("GUVERCIN_WORKERS", str(os.cpu_count() or 1)))
+# Worker'ın açık bağlantıları bitirmesi için verilen süre
+SHUTDOWN_TIMEOUT = float(os.environ.get("GUVERCIN_SHUTDOWN_TIMEOUT", "30"))
+# Yeni worker'ın hazır olmasının beklendiği en uzun süre
+STARTUP_TIMEOUT = float(os.environ.get("GUVERCIN_STARTUP_TIMEOUT", "60"))
+# WebSocket ping/pong: yanıt vermeyen (kopmuş TCP) soketler kapatılır, presence kaydı düşer
+WS_PING_INTERVAL = float(os.environ.get("GUVERCIN_WS_PING_INTERVAL", "15"))
+WS_PING_TIMEOUT = float(os.environ.get("GUVERCIN_WS_PING_TIMEOUT", "15"))
+# permessage-deflate: istemci önerirse WebSocket çerçeveleri sıkıştırılır (bkz. protocol.py)
+WS_DEFLATE = os.environ.get("GUVERCIN_WS_DEFLATE", "1") == "1"
+
+logger = logging.getLogger("guvercin.server")
+
+_spawn = multiprocessing.get_context("spawn")
+
+
+def create_config() -> uvicorn.Config:
+    return uvicorn.Config(
+        "gateway:app",
+        host=HOST,
+        port=PORT,
+        timeout_graceful_shutdown=SHUTDOWN_TIMEOUT,
+        ws_ping_interval=WS_PING_INTERVAL,
+        ws_ping_timeout=WS_PING_TIMEOUT,
+        ws_per_message_deflate=WS_DEFLATE,
     )
-    processes.append(process)
 
-# Servislerin çıktısını gösterme
-for i, process in enumerate(processes):
-    stdout, stderr = process.communicate()  # Çıktıları ve hataları yakala
-    if stdout:
-        print(f"Çıktılar ({scripts[i]}):\n{stdout}")
-    if stderr:
-        print(f"Hata ({scripts[i]}):\n{stderr}")
 
+def _run_worker(config: uvicorn.Config, sock, ready):
+    """Worker sürecinin giriş noktası."""
+    config.configure_logging()
+    server = uvicorn.Server(config)
+
+    def watch_startup():
+        while not server.started and not server.should_exit:
+            time.sleep(0.05)
+        if server.started:
+            ready.set()
+
+    threading.Thread(target=watch_startup, daemon=True).start()
+    server.run(sockets=[sock])
+
+
+class Worker:
+    def __init__(self, config: uvicorn.Config, sock):
+        self.ready = _spawn.Event()
+        self.process = _spawn.Process(target=_run_worker, args=(config, sock, self.ready))
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def start(self):
+        self.process.start()
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def wait_ready(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.ready.wait(0.2):
+                return True
+            if not self.process.is_alive():
+                return False
+        return False
+
+    def stop(self):
+        if self.process.is_alive():
+            os.kill(self.pid, signal.SIGTERM)
+        self.process.join(SHUTDOWN_TIMEOUT + 5)
+        if self.process.is_alive():
+            logger.warning("Worker %s kapanmadı, sonlandırılıyor", self.pid)
+            self.process.kill()
+            self.process.join()
+
+
+class Supervisor:
+    def __init__(self, config: uvicorn.Config, workers: int):
+        self.config = config
+        self.count = workers
+        self.workers = []
+        self.sock = None
+        self._exit = threading.Event()
+        self._reload = threading.Event()
+
+    def _spawn_worker(self) -> Worker:
+        worker = Worker(self.config, self.sock)
+        worker.start()
+        logger.info("Worker başlatıldı: %s", worker.pid)
+        return worker
+
+    def run(self):
+        self.sock = self.config.bind_socket()
+        signal.signal(signal.SIGTERM, lambda *_: self._exit.set())
+        signal.signal(signal.SIGINT, lambda *_: self._exit.set())
+        signal.signal(signal.SIGHUP, lambda *_: self._reload.set())
+
+        logger.info("%s worker ile http://%s:%s dinleniyor (gözetmen: %s)",
+                    self.count, HOST, PORT, os.getpid())
+        self.workers = [self._spawn_worker() for _ in range(self.count)]
+
+        while not self._exit.wait(0.5):
+            if self._reload.is_set():
+                self._reload.clear()
+                self.rolling_restart()
+            self.respawn_dead()
+
+        logger.info("Kapatılıyor...")
+        for worker in self.workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGTERM)
+        for worker in self.workers:
+            worker.stop()
+        self.sock.close()
+
+    def respawn_dead(self):
+        for i, worker in enumerate(self.workers):
+            if not worker.is_alive() and not self._exit.is_set():
+                logger.warning("Worker %s beklenmedik şekilde kapandı (kod %s), yeniden başlatılıyor",
+                               worker.pid, worker.process.exitcode)
+                self.workers[i] = self._spawn_worker()
+
+    def rolling_restart(self):
+        logger.info("Worker'lar sırayla yeniden başlatılıyor")
+        for i, old in enumerate(list(self.workers)):
+            if self._exit.is_set():
+                return
+            new = self._spawn_worker()
+            if not new.wait_ready(STARTUP_TIMEOUT):
+                # Yeni kod açılamıyorsa eski worker'larla devam edilir
+                logger.error("Yeni worker %s hazır olmadı, yeniden başlatma durduruldu", new.pid)
+                new.stop()
+                return
+            self.workers[i] = new
+            old.stop()
+            logger.info("Worker %s yerine %s devrede", old.pid, new.pid)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(process)d] %(name)s %(levelname)s: %(message)s")
+    Supervisor(create_config(), WORKERS).run()
@@ -0,0 +1,172 @@
+"""
+Oturum doğrulama: yapılandırmadan gelen imza anahtarları, doğrulanmış token
+önbelleği ve worker'lar arası iptal (revocation) bildirimi.
+
+Anahtarlar GUVERCIN_JWT_KEYS="kid1:gizli1,kid2:gizli2" biçiminde verilir; yeni
+token'lar GUVERCIN_JWT_ACTIVE_KID (varsayılan: ilk anahtar) ile imzalanır, eski
+anahtarlar doğrulama için listede kalarak döndürme (rotation) yapılır.
+
+Doğrulanan token'lar süreç içi LRU önbellekte tutulur; sık yapılan oturum
+kontrolleri Redis'e gitmez. Çıkış, yeni giriş veya hesap silme durumunda
+kullanıcı adı `session:revoked` kanalına publish edilir ve her worker o
+kullanıcının önbellek kayıtlarını hemen siler.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+
+REVOCATION_CHANNEL = "session:revoked"
+CACHE_SIZE = int(os.environ.get("GUVERCIN_SESSION_CACHE_SIZE", "100000"))
+# İptal bildirimi kaçırılırsa bir kaydın önbellekte kalabileceği en uzun süre
+CACHE_TTL = float(os.environ.get("GUVERCIN_SESSION_CACHE_TTL", "300"))
+ALGORITHM = "HS256"
+
+logger = logging.getLogger(__name__)
+
+
+def load_keys():
+    raw = os.environ.get("GUVERCIN_JWT_KEYS")
+    if not raw:
+        # Eski davranış: süreç başına rastgele anahtar. Yalnızca tek worker ile çalışır.
+        logger.warning("GUVERCIN_JWT_KEYS tanımlı değil, geçici bir imza anahtarı üretildi.")
+        return {"local": secrets.token_hex(32)}, "local"
+
+    keys = {}
+    for item in raw.split(","):
+        kid, _, secret = item.strip().partition(":")
+        if not kid or not secret:
+            raise ValueError("GUVERCIN_JWT_KEYS 'kid:gizli' çiftlerinden oluşmalıdır.")
+        keys[kid] = secret
+    active = os.environ.get("GUVERCIN_JWT_ACTIVE_KID", next(iter(keys)))
+    if active not in keys:
+        raise ValueError(f"Aktif anahtar bulunamadı: {active}")
+    return keys, active
+
+
+KEYS, ACTIVE_KID = load_keys()
+
+
+def sign(payload: dict) -> str:
+    return jwt.encode(payload, KEYS[ACTIVE_KID], algorithm=ALGORITHM, headers={"kid": ACTIVE_KID})
+
+
+def verify(token: str) -> dict:
+    """
+    Token'ı başlığındaki kid'e ait anahtarla doğrular.
+    jwt.ExpiredSignatureError / jwt.InvalidTokenError fırlatabilir.
+    """
+    kid = jwt.get_unverified_header(token).get("kid", ACTIVE_KID)
+    key = KEYS.get(kid)
+    if key is None:
+        raise jwt.InvalidTokenError(f"Bilinmeyen anahtar: {kid}")
+    return jwt.decode(token, key, algorithms=[ALGORITHM])
+
+
+class SessionCache:
+    """
+    Doğrulanmış token'lar için thread-safe LRU önbellek.
+    Her kayıt en geç token'ın exp zamanında (ve en fazla CACHE_TTL sonra) düşer.
+
+    Redis'ten okuma ile put arasında gelen iptal kaydı geri getirmesin diye
+    okumadan önce generation() alınır ve put'a verilir; arada iptal olduysa
+    kayıt eklenmez.
+    """
+
+    def __init__(self, max_size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # token -> (username, expires_at)
+        self._by_user = {}  # username -> {token}
+        self._generations = {}  # username -> iptal sayısı
+        self._epoch = 0  # clear() sayısı
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            username, expires_at = entry
+            if expires_at <= now:
+                self._remove(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return username
+
+    def generation(self, username: str) -> tuple:
+        with self._lock:
+            return self._epoch, self._generations.get(username, 0)
+
+    def put(self, token: str, username: str, exp: float, generation: tuple = None):
+        expires_at = min(exp, time.time() + self.ttl)
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(username, 0)):
+                return
+            self._entries[token] = (username, expires_at)
+            self._entries.move_to_end(token)
+            self._by_user.setdefault(username, set()).add(token)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def drop_user(self, username: str):
+        with self._lock:
+            self._generations[username] = self._generations.get(username, 0) + 1
+            for token in self._by_user.pop(username, ()):
+                self._entries.pop(token, None)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._generations.clear()
+            self._entries.clear()
+            self._by_user.clear()
+
+    def _remove(self, token):
+        username, _ = self._entries.pop(token)
+        tokens = self._by_user.get(username)
+        if tokens:
+            tokens.discard(token)
+            if not tokens:
+                del self._by_user[username]
+
+
+async def publish_revocation(client, username: str):
+    await client.publish(REVOCATION_CHANNEL, username)
+
+
+async def listen_revocations(client, cache: SessionCache):
+    """
+    İptal kanalını dinler; uygulamanın lifespan'inde görev olarak çalıştırılır
+    ve iptal (cancel) edilene kadar döner.
+    """
+    while True:
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(REVOCATION_CHANNEL)
+            async for message in pubsub.listen():
+                username = message["data"]
+                if isinstance(username, bytes):
+                    username = username.decode()
+                cache.drop_user(username)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Bağlantı koptuysa iptal bildirimleri kaçırılmış olabilir
+            logger.warning("Oturum iptal kanalı okunamadı: %s", e)
+            cache.clear()
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
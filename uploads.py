@@ -0,0 +1,208 @@
+"""
+Parçalı ve devam ettirilebilir dosya yükleme.
+
+Sohbet soketi üzerinden protokol:
+
+    -> {"type": "upload_start", "sender", "receiver", "file_name", "mime_type", "size", "upload_id"?}
+    <- {"type": "upload_ack", "upload_id", "offset"}
+    -> {"type": "upload_chunk", "upload_id", "offset"}  ardından binary çerçeve
+    <- {"type": "upload_ack", "upload_id", "offset"}
+    -> {"type": "upload_finish", "upload_id"}
+
+Kesilen bir yükleme, aynı upload_id ile upload_start gönderilerek son onaylanan
+offset'ten devam ettirilir. Parçalar diske event loop dışında yazılır; onaylanan
+offset her zaman diskteki .part dosyasının boyutudur.
+
+Yükleme onu başlatan soketin kullanıcısına aittir (meta verideki owner); başka
+bir kullanıcı aynı upload_id ile devam ettiremez ya da tamamlayamaz. UPLOAD_TTL
+saniyedir dokunulmayan yarım yüklemeler arka planda silinir.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+import uuid
+
+MAX_CHUNK_SIZE = int(os.environ.get("GUVERCIN_UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+UPLOAD_TTL = int(os.environ.get("GUVERCIN_UPLOAD_TTL", str(24 * 60 * 60)))  # saniye
+SWEEP_INTERVAL = 60 * 60  # saniye
+
+logger = logging.getLogger(__name__)
+
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadError(Exception):
+    def __init__(self, detail: str, offset: int = None):
+        super().__init__(detail)
+        self.detail = detail
+        self.offset = offset
+
+
+def _run_io(func, *args):
+    # Disk hataları soketi düşürmesin; istemciye upload_error olarak döner
+    try:
+        return func(*args)
+    except FileNotFoundError:
+        raise UploadError("Yükleme bulunamadı.")
+    except OSError:
+        raise UploadError("Dosya yazılamadı.")
+
+
+def _check_owner(meta: dict, owner: str):
+    # Başkasının yüklemesinin varlığı da belli edilmez
+    if meta.get("owner") != owner:
+        raise UploadError("Yükleme bulunamadı.")
+
+
+class UploadStore:
+    def __init__(self, root: str, max_chunk_size: int = MAX_CHUNK_SIZE, ttl: int = UPLOAD_TTL):
+        self.root = root
+        self.max_chunk_size = max_chunk_size
+        self.ttl = ttl
+        self._sweeper = None
+
+    async def start(self):
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                removed = await asyncio.to_thread(self.sweep)
+                if removed:
+                    logger.info("Terk edilmiş yükleme silindi: %d", removed)
+            except Exception:
+                logger.exception("Yarım yüklemeler temizlenemedi")
+            await asyncio.sleep(SWEEP_INTERVAL)
+
+    def sweep(self) -> int:
+        """ttl saniyedir .json ve .part dosyasına dokunulmamış yüklemeleri siler."""
+        cutoff = time.time() - self.ttl
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return 0
+        removed = 0
+        for upload_id in {os.path.splitext(name)[0] for name in names}:
+            if not _UPLOAD_ID.match(upload_id):
+                continue
+            paths = self._paths(upload_id)
+            try:
+                if max((os.path.getmtime(path) for path in paths if os.path.exists(path)), default=0) > cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            removed += 1
+        return removed
+
+    def _paths(self, upload_id: str):
+        if not upload_id or not _UPLOAD_ID.match(upload_id):
+            raise UploadError("Geçersiz upload_id.")
+        base = os.path.join(self.root, upload_id)
+        return base + ".json", base + ".part"
+
+    def _start(self, upload_id, meta):
+        os.makedirs(self.root, exist_ok=True)
+        meta_path, part_path = self._paths(upload_id)
+        if os.path.exists(meta_path):
+            # Devam eden yükleme: onaylanan offset diskteki boyuttur
+            with open(meta_path) as f:
+                stored = json.load(f)
+            _check_owner(stored, meta["owner"])
+            return stored, os.path.getsize(part_path)
+
+        with open(part_path, "wb"):
+            pass
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+        return meta, 0
+
+    async def start(self, meta: dict, owner: str, upload_id: str = None):
+        """
+        owner için yeni bir yükleme başlatır ya da var olanı devam ettirir.
+        (upload_id, meta, offset) döner.
+        """
+        size = meta.get("size")
+        if size is not None and (not isinstance(size, int) or isinstance(size, bool) or size < 0):
+            raise UploadError("Geçersiz dosya boyutu.")
+        meta = dict(meta, owner=owner)
+        upload_id = upload_id or uuid.uuid4().hex
+        meta, offset = await asyncio.to_thread(_run_io, self._start, upload_id, meta)
+        return upload_id, meta, offset
+
+    def _write_chunk(self, upload_id, owner, offset, data):
+        meta_path, part_path = self._paths(upload_id)
+        if not os.path.exists(meta_path):
+            raise UploadError("Yükleme bulunamadı.")
+        with open(meta_path) as f:
+            meta = json.load(f)
+        _check_owner(meta, owner)
+        current = os.path.getsize(part_path)
+        if offset != current:
+            raise UploadError("Beklenmeyen offset.", current)
+        size = meta.get("size")
+        if size is not None and current + len(data) > size:
+            raise UploadError("Dosya boyutu aşıldı.", current)
+        with open(part_path, "ab") as f:
+            f.write(data)
+        return current + len(data)
+
+    async def write_chunk(self, upload_id: str, owner: str, offset: int, data: bytes) -> int:
+        if len(data) > self.max_chunk_size:
+            raise UploadError(f"Parça boyutu en fazla {self.max_chunk_size} bayt olabilir.")
+        return await asyncio.to_thread(_run_io, self._write_chunk, upload_id, owner, offset, data)
+
+    def _finish(self, upload_id, owner, destination):
+        meta_path, part_path = self._paths(upload_id)
+        if not os.path.exists(meta_path):
+            raise UploadError("Yükleme bulunamadı.")
+        with open(meta_path) as f:
+            meta = json.load(f)
+        _check_owner(meta, owner)
+        current = os.path.getsize(part_path)
+        size = meta.get("size")
+        if size is not None and current != size:
+            raise UploadError("Yükleme tamamlanmadı.", current)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(part_path, destination)
+        os.remove(meta_path)
+        return meta
+
+    async def finish(self, upload_id: str, owner: str, destination) -> dict:
+        """
+        owner'ın yüklemesini tamamlar ve dosyayı hedefe taşır. destination, meta
+        alıp hedef yolu döndüren bir fonksiyondur. Yüklemenin meta verisini döner.
+        """
+        meta_path, _ = self._paths(upload_id)
+        meta = await asyncio.to_thread(_read_json, meta_path)
+        if meta is None:
+            raise UploadError("Yükleme bulunamadı.")
+        _check_owner(meta, owner)
+        path = destination(meta)
+        meta = await asyncio.to_thread(_run_io, self._finish, upload_id, owner, path)
+        meta["path"] = path
+        return meta
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,138 @@
+"""
+Kullanıcı adı <-> kullanıcı ID indeksi.
+
+`users` seti tek başına "username:user_id" girdilerini tutuyordu ve her arama
+tüm seti çekip Python'da dolaşıyordu. Bu modül iki hash ile O(1) arama sağlar:
+
+    user_ids   : username -> user_id
+    usernames  : user_id  -> username
+    users:lex  : önek araması için sıralı küme; skor 0, üye "katlanmış_ad\0ad"
+
+Önek araması ZRANGEBYLEX ile yapılır; katlama Türkçe harfleri de kapsar
+(İ, I ve ı hepsi i olur), böylece "ı" araması "Işık", "İrem" ve "ismet"i de bulur.
+
+Eski `users` seti geriye dönük uyumluluk için güncel tutulmaya devam eder.
+Fonksiyonlar async Redis istemcisiyle çalışır (bkz. redisdb.py).
+"""
+import asyncio
+
+USER_IDS_KEY = "user_ids"
+USERNAMES_KEY = "usernames"
+LEGACY_USERS_KEY = "users"
+LEX_KEY = "users:lex"
+LEX_SEPARATOR = "\0"
+
+_TURKISH_FOLD = str.maketrans({"İ": "i", "I": "i", "ı": "i"})
+
+# Kullanıcı adını atomik olarak sahiplen: ad boştaysa iki hash'i ve eski seti
+# aynı anda günceller, doluysa hiçbir şeye dokunmaz.
+_CLAIM_SCRIPT = """
+if redis.call('HSETNX', KEYS[1], ARGV[1], ARGV[2]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[2], ARGV[2], ARGV[1])
+redis.call('SADD', KEYS[3], ARGV[1] .. ':' .. ARGV[2])
+redis.call('ZADD', KEYS[4], 0, ARGV[3])
+return 1
+"""
+
+# Kullanıcıyı indeksten atomik olarak çıkarır, silinen ID'yi döner.
+_REMOVE_SCRIPT = """
+local user_id = redis.call('HGET', KEYS[1], ARGV[1])
+if not user_id then
+    return false
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], user_id)
+redis.call('SREM', KEYS[3], ARGV[1] .. ':' .. user_id)
+redis.call('ZREM', KEYS[4], ARGV[2])
+return user_id
+"""
+
+
+def _decode(value):
+    if isinstance(value, bytes):
+        return value.decode()
+    return value
+
+
+def fold(text: str) -> str:
+    """Arama için büyük/küçük harf katlama (Türkçe İ/I/ı dahil)."""
+    return text.translate(_TURKISH_FOLD).casefold()
+
+
+def lex_member(username: str) -> str:
+    return f"{fold(username)}{LEX_SEPARATOR}{username}"
+
+
+async def claim_username(client, username: str, user_id: str) -> bool:
+    """
+    Kullanıcı adını verilen ID ile kaydeder.
+    Ad daha önce alınmışsa False döner.
+    """
+    keys = [USER_IDS_KEY, USERNAMES_KEY, LEGACY_USERS_KEY, LEX_KEY]
+    return bool(await client.eval(_CLAIM_SCRIPT, len(keys), *keys, username, user_id, lex_member(username)))
+
+
+async def get_user_id(client, username: str):
+    return _decode(await client.hget(USER_IDS_KEY, username))
+
+
+async def get_username(client, user_id: str):
+    return _decode(await client.hget(USERNAMES_KEY, user_id))
+
+
+async def user_exists(client, username: str) -> bool:
+    return bool(await client.hexists(USER_IDS_KEY, username))
+
+
+async def remove_user(client, username: str):
+    """
+    Kullanıcıyı indeksten ve eski `users` setinden siler.
+    Kullanıcı yoksa None döner.
+    """
+    keys = [USER_IDS_KEY, USERNAMES_KEY, LEGACY_USERS_KEY, LEX_KEY]
+    return _decode(await client.eval(_REMOVE_SCRIPT, len(keys), *keys, username, lex_member(username)))
+
+
+async def search_prefix(client, prefix: str, limit: int, cursor: str = None):
+    """
+    Katlanmış hali prefix ile başlayan kullanıcı adlarını sıralı döner.
+    cursor önceki sayfanın son kullanıcı adıdır. (adlar, sonraki_cursor) döner.
+    """
+    folded = fold(prefix).encode()
+    start = b"(" + lex_member(cursor).encode() if cursor else b"[" + folded
+    # UTF-8'de hiçbir karakter 0xFF ile başlamaz; önekle başlayan her üyeden büyüktür
+    end = b"[" + folded + b"\xff"
+    members = await client.zrangebylex(LEX_KEY, start, end, start=0, num=limit + 1)
+    names = [_decode(member).split(LEX_SEPARATOR, 1)[1] for member in members[:limit]]
+    next_cursor = names[-1] if len(members) > limit else None
+    return names, next_cursor
+
+
+async def migrate(client, batch_size: int = 1000) -> int:
+    """
+    Mevcut `users` setinden indeksi oluşturur. Tekrar çalıştırılması güvenlidir.
+    """
+    migrated = 0
+    pipe = client.pipeline(transaction=False)
+    async for entry in client.sscan_iter(LEGACY_USERS_KEY, count=batch_size):
+        username, _, user_id = _decode(entry).rpartition(":")
+        if not username or not user_id:
+            print(f"Geçersiz kayıt atlandı: {entry!r}")
+            continue
+        pipe.hsetnx(USER_IDS_KEY, username, user_id)
+        pipe.hsetnx(USERNAMES_KEY, user_id, username)
+        pipe.zadd(LEX_KEY, {lex_member(username): 0})
+        migrated += 1
+        if migrated % batch_size == 0:
+            await pipe.execute()
+    await pipe.execute()
+    return migrated
+
+
+if __name__ == "__main__":
+    # Tek seferlik geçiş: python3 user_index.py
+    import redisdb
+    count = asyncio.run(migrate(redisdb.client))
+    print(f"İndekse aktarılan kullanıcı sayısı: {count}")